@@ -0,0 +1,277 @@
+# crow_app/activity.py - BATCHED USER ACTIVITY RECORDING
+
+import atexit
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .conf import setting_reader
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ASYNC': False,            # False writes every activity immediately (tests)
+    'BATCH_SIZE': 200,         # rows per bulk_create
+    'FLUSH_INTERVAL': 1.0,     # seconds between background flushes
+    'MAX_QUEUE': 10000,        # bound on queued activities
+    'POLICY': 'drop_oldest',   # 'block', 'drop_oldest' or 'sample' when the queue is full
+    'BLOCK_TIMEOUT': 0.5,      # seconds 'block' waits for room before dropping
+    'SAMPLE_RATE': 0.1,        # fraction 'sample' keeps once the queue is half full
+}
+
+POLICIES = ('block', 'drop_oldest', 'sample')
+
+
+get_pipeline_setting = setting_reader('ACTIVITY_PIPELINE', DEFAULTS)
+
+
+def get_client_ip(request):
+    """Get user's IP address"""
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        ip = x_forwarded_for.split(',')[0]
+    else:
+        ip = request.META.get('REMOTE_ADDR')
+    return ip
+
+
+def _build_activity(fields):
+    from .models import UserActivity
+    from .user_agent_cache import get_user_agent_id
+
+    fields = dict(fields)
+    fields['user_agent_id'] = get_user_agent_id(fields.pop('raw_user_agent'))
+    return UserActivity(**fields)
+
+
+class ActivityPipeline:
+    """
+    Bounded queue of pending UserActivity rows drained by a background
+    thread with bulk_create.
+
+    What happens when producers outrun the database is set by `policy`:
+    'block' waits up to `block_timeout` for room, 'drop_oldest' discards
+    the oldest queued row, and 'sample' keeps only `sample_rate` of new
+    rows once the queue is half full.
+    """
+
+    def __init__(self, batch_size=200, flush_interval=1.0, max_queue=10000,
+                 policy='drop_oldest', block_timeout=0.5, sample_rate=0.1):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown activity pipeline policy: {policy}")
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.sample_rate = sample_rate
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+        self.counters = {
+            'enqueued': 0,
+            'dropped': 0,
+            'sampled_out': 0,
+            'flushed': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'max_depth': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+        }
+
+    def put(self, fields):
+        """Queue one activity; returns False if the backpressure policy dropped it"""
+        with self._lock:
+            depth = len(self._queue)
+
+            if self.policy == 'sample' and depth >= self.max_queue // 2:
+                if depth >= self.max_queue or random.random() >= self.sample_rate:
+                    self.counters['sampled_out'] += 1
+                    return False
+
+            elif self.policy == 'drop_oldest' and depth >= self.max_queue:
+                self._queue.popleft()
+                self.counters['dropped'] += 1
+
+            elif self.policy == 'block' and depth >= self.max_queue:
+                self._wakeup.set()
+                if not self._not_full.wait_for(lambda: len(self._queue) < self.max_queue, self.block_timeout):
+                    self.counters['dropped'] += 1
+                    return False
+
+            self._queue.append(fields)
+            self.counters['enqueued'] += 1
+            depth = len(self._queue)
+            self.counters['max_depth'] = max(self.counters['max_depth'], depth)
+
+        self._ensure_worker()
+        if depth >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def flush(self):
+        """Write every queued activity to the database"""
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                    self._not_full.notify_all()
+                if not batch:
+                    return
+                self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        from .models import UserActivity
+
+        from .rollups import count_rows
+        from .user_stats import count_user_rows
+
+        started = time.perf_counter()
+        written = 0
+        try:
+            activities = [_build_activity(fields) for fields in batch]
+            UserActivity.objects.bulk_create(activities)
+            written = len(batch)
+            count_rows(UserActivity, activities)  # bulk_create sends no post_save
+            count_user_rows(UserActivity, activities)
+        except Exception as e:
+            # One bad row (e.g. its user was deleted meanwhile) must not
+            # sink the whole batch, so retry the rows one at a time
+            logger.warning(f"Activity batch insert failed, retrying row by row: {e}")
+            for fields in batch:
+                try:
+                    _build_activity(fields).save()
+                    written += 1
+                except Exception as row_error:
+                    logger.error(f"Failed to log activity: {row_error}")
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.counters['flushes'] += 1
+            self.counters['flushed'] += written
+            self.counters['flush_errors'] += len(batch) - written
+            self.counters['last_flush_ms'] = elapsed_ms
+            self.counters['total_flush_ms'] += elapsed_ms
+            self.counters['max_flush_ms'] = max(self.counters['max_flush_ms'], elapsed_ms)
+
+    def stats(self):
+        """Snapshot of queue depth and flush counters for the metrics endpoint"""
+        with self._lock:
+            data = dict(self.counters)
+            data['depth'] = len(self._queue)
+        data['policy'] = self.policy
+        data['avg_flush_ms'] = data['total_flush_ms'] / data['flushes'] if data['flushes'] else 0.0
+        return data
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='activity-flusher', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_activity_pipeline():
+    """Return the process-wide pipeline, or None when ACTIVITY_PIPELINE['ASYNC'] is off"""
+    global _pipeline
+    if not get_pipeline_setting('ASYNC'):
+        return None
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = ActivityPipeline(
+                    batch_size=get_pipeline_setting('BATCH_SIZE'),
+                    flush_interval=get_pipeline_setting('FLUSH_INTERVAL'),
+                    max_queue=get_pipeline_setting('MAX_QUEUE'),
+                    policy=get_pipeline_setting('POLICY'),
+                    block_timeout=get_pipeline_setting('BLOCK_TIMEOUT'),
+                    sample_rate=get_pipeline_setting('SAMPLE_RATE'),
+                )
+                atexit.register(_pipeline.flush)
+    return _pipeline
+
+
+def record_activity(user, activity_type, description='', request=None,
+                    meeting=None, room=None, team=None):
+    """
+    Log a UserActivity row
+
+    Single entry point for activity tracking. With the async pipeline
+    enabled the row is queued and written in a later batch; otherwise it
+    is written before returning.
+    """
+    fields = {
+        'user_id': user.id,
+        'activity_type': activity_type,
+        'description': description,
+        'meeting': meeting,
+        'room': room,
+        'team': team,
+        'ip_address': get_client_ip(request) if request is not None else None,
+        'raw_user_agent': request.META.get('HTTP_USER_AGENT', '') if request is not None else '',
+        'timestamp': timezone.now(),
+    }
+
+    pipeline = get_activity_pipeline()
+    if pipeline is not None:
+        return pipeline.put(fields)
+
+    try:
+        _build_activity(fields).save()
+    except Exception as e:
+        # Don't break the request if activity logging fails
+        logger.error(f"Failed to log activity: {e}")
+        return False
+    return True
+
+
+async def arecord_activity(user, activity_type, description='', request=None,
+                           meeting=None, room=None, team=None):
+    """
+    Async variant of record_activity
+
+    Queuing is in-memory and safe to do on the event loop; only the
+    synchronous fallback and the 'block' policy need a worker thread.
+    """
+    pipeline = get_activity_pipeline()
+    if pipeline is None or pipeline.policy == 'block':
+        return await sync_to_async(record_activity)(
+            user, activity_type, description, request=request,
+            meeting=meeting, room=room, team=team
+        )
+    return record_activity(
+        user, activity_type, description, request=request,
+        meeting=meeting, room=room, team=team
+    )
@@ -3,15 +3,27 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
-from django.db.models import Count, Sum, Avg, Q, F
+from django.db.models import Count, Sum, Q, F
+from django.db.models.functions import TruncDate
 from datetime import timedelta, datetime
 from .models import (
     AdminRole, UserSession, MeetingSession, UserActivity, 
     OnlineUser, Meeting, UserClass, ClassMembership, Contact,
     SiteStatistics
 )
+from .activity import get_activity_pipeline, record_activity
+from .concurrency import meeting_peaks, stored_peaks
+from .export import EXPORTS, FORMATS, async_chunks, export_stream, filename, parse_bound
+from .keyset import InvalidCursor, paginate
+from .presence import get_presence_backend
+from .rollups import by_dimension, day_start, series, totals
+from .rooms import room_registry
+from .session_buffer import get_session_buffer
+from .user_stats import with_stats
+from .widget_cache import get_widgets, invalidate_widgets, stats as widget_stats, widget
 from django.contrib import messages
 
 from django.db import IntegrityError
@@ -25,49 +37,38 @@ def is_admin(user):
         return False
 
 
-@login_required
-def admin_dashboard(request):
-    """Main admin dashboard with comprehensive statistics"""
-    
-    # Check if user is admin
-    if not is_admin(request.user):
-        messages.error(request, "You don't have admin access")
-        return redirect('home')
-    
-    admin_role = request.user.admin_role
-    
-    # Time ranges
+def dashboard_ranges():
+    """(today, 30 days ago, 7 days ago) for the dashboard widgets"""
     today = timezone.now().date()
-    thirty_days_ago = today - timedelta(days=30)
-    seven_days_ago = today - timedelta(days=7)
-    
-    # === OVERVIEW STATISTICS ===
-    
-    # Total counts
-    total_users = User.objects.count()
-    total_teams = UserClass.objects.count()
-    total_meetings = Meeting.objects.count()
-    total_contacts = Contact.objects.count()
-    
-    # Active users (logged in last 30 days)
-    active_users_30d = UserSession.objects.filter(
-        login_time__gte=thirty_days_ago
-    ).values('user').distinct().count()
-    
-    # Online users (active in last 2 minutes)
-    online_now = OnlineUser.get_online_count()
-    
-    # New users (last 7 days)
-    new_users_7d = User.objects.filter(
-        date_joined__gte=seven_days_ago
-    ).count()
-    
-    # Meetings today
-    meetings_today = Meeting.objects.filter(
-        created_at__date=today
-    ).count()
-    
-    # === USER ANALYTICS ===
+    return today, today - timedelta(days=30), today - timedelta(days=7)
+
+
+# === DASHBOARD WIDGETS ===
+# Each section of the dashboard is computed by one widget and cached on its
+# own TTL (see crow_app/widget_cache.py and DASHBOARD_CACHE in settings).
+# Widgets return plain lists and dicts, never lazy querysets.
+
+@widget('overview')
+def overview_widget():
+    today, thirty_days_ago, seven_days_ago = dashboard_ranges()
+    return {
+        # Total counts
+        'total_users': User.objects.count(),
+        'total_teams': UserClass.objects.count(),
+        'total_meetings': Meeting.objects.count(),
+        'total_contacts': Contact.objects.count(),
+        # Active users (logged in last 30 days)
+        'active_users_30d': User.objects.filter(last_login__gte=thirty_days_ago).count(),
+        # New users (last 7 days)
+        'new_users_7d': User.objects.filter(date_joined__gte=seven_days_ago).count(),
+        # Meetings today
+        'meetings_today': totals('meeting_created', today)['count'],
+    }
+
+
+@widget('user_analytics')
+def user_analytics_widget():
+    today, thirty_days_ago, seven_days_ago = dashboard_ranges()
     
     # Most active users (by session count) - FIXED
     most_active_users = User.objects.annotate(
@@ -77,12 +78,12 @@ def admin_dashboard(request):
         session_count__gt=0
     ).order_by('-session_count')[:10]
     
-    # Users online in meetings
-    users_in_meetings = OnlineUser.objects.filter(
-        is_in_meeting=True
-    ).select_related('user', 'current_meeting')
-    
-    # === TEAM ANALYTICS - FIXED ===
+    return {'most_active_users': list(most_active_users)}
+
+
+@widget('team_analytics')
+def team_analytics_widget():
+    today, thirty_days_ago, seven_days_ago = dashboard_ranges()
     
     # Most active teams (by member count only)
     most_active_teams = UserClass.objects.annotate(
@@ -93,141 +94,208 @@ def admin_dashboard(request):
     
     # Team growth (new teams per day - last 7 days)
     team_growth = UserClass.objects.filter(
-        created_at__gte=seven_days_ago
-    ).extra(
-        select={'day': 'date(created_at)'}
+        created_at__gte=day_start(seven_days_ago)
+    ).annotate(
+        day=TruncDate('created_at')
     ).values('day').annotate(
         count=Count('id')
     ).order_by('day')
     
-    # === MEETING ANALYTICS ===
+    return {'most_active_teams': list(most_active_teams), 'team_growth': list(team_growth)}
+
+
+@widget('meeting_stats')
+def meeting_stats_widget():
+    today, thirty_days_ago, seven_days_ago = dashboard_ranges()
     
     # Total meeting time (last 30 days)
-    meeting_stats = MeetingSession.objects.filter(
-        joined_at__gte=thirty_days_ago,
-        left_at__isnull=False
-    ).aggregate(
-        total_sessions=Count('id'),
-        total_time=Sum('video_enabled_duration'),
-        avg_duration=Avg('video_enabled_duration'),
-        total_video_time=Sum('video_enabled_duration'),
-        total_screen_share_time=Sum('screen_shared_duration')
-    )
+    ended_sessions = totals('meeting_session', thirty_days_ago)
+    meeting_stats = {
+        'total_sessions': ended_sessions['count'],
+        'total_time': ended_sessions['total'],
+        'avg_duration': ended_sessions['total'] / ended_sessions['count'] if ended_sessions['count'] else None,
+        'total_video_time': ended_sessions['total'],
+        'total_screen_share_time': totals('meeting_screen_share', thirty_days_ago)['total'],
+    }
     
     # Convert seconds to minutes
     meeting_stats['total_time_minutes'] = (meeting_stats['total_time'] or 0) // 60
     meeting_stats['avg_duration_minutes'] = (meeting_stats['avg_duration'] or 0) // 60
     
-    # Meetings per day (last 30 days)
-    meetings_per_day = Meeting.objects.filter(
-        created_at__gte=thirty_days_ago
-    ).extra(
-        select={'day': 'date(created_at)'}
-    ).values('day').annotate(
-        count=Count('id')
-    ).order_by('day')
-    
-    # Top meeting hosts - FIXED
-    top_hosts = User.objects.annotate(
-        hosted_count=Count('hosted_rooms')
-    ).filter(
-        hosted_count__gt=0
-    ).order_by('-hosted_count')[:10]
-    
-    # === ACTIVITY ANALYTICS ===
-    
-    # Activity breakdown (last 30 days)
-    activity_breakdown = UserActivity.objects.filter(
-        timestamp__gte=thirty_days_ago
-    ).values('activity_type').annotate(
-        count=Count('id')
-    ).order_by('-count')
-    
-    # Login activity per day
-    logins_per_day = UserActivity.objects.filter(
-        activity_type='login',
-        timestamp__gte=thirty_days_ago
-    ).extra(
-        select={'day': 'date(timestamp)'}
-    ).values('day').annotate(
-        count=Count('id')
-    ).order_by('day')
-    
-    # === DEVICE & BROWSER STATS ===
+    # Top meeting hosts (by rooms created)
+    host_counts = by_dimension('room_created', limit=10)
+    hosts = User.objects.in_bulk([int(row['dimension']) for row in host_counts])
+    top_hosts = []
+    for row in host_counts:
+        host = hosts.get(int(row['dimension']))
+        if host is not None:
+            host.hosted_count = row['count']
+            top_hosts.append(host)
+    
+    return {
+        'meeting_stats': meeting_stats,
+        # Meetings per day (last 30 days)
+        'meetings_per_day': series('meeting_created', thirty_days_ago),
+        'top_hosts': top_hosts,
+    }
+
+
+@widget('activity')
+def activity_widget():
+    today, thirty_days_ago, seven_days_ago = dashboard_ranges()
+    return {
+        # Activity breakdown (last 30 days)
+        'activity_breakdown': [
+            {'activity_type': row['dimension'], 'count': row['count']}
+            for row in by_dimension('activity', thirty_days_ago)
+        ],
+        # Login activity per day
+        'logins_per_day': series('activity', thirty_days_ago, dimension='login'),
+    }
+
+
+@widget('device_browser')
+def device_browser_widget():
+    today, thirty_days_ago, seven_days_ago = dashboard_ranges()
+    return {
+        'device_stats': [
+            {'device_type': row['dimension'], 'count': row['count']}
+            for row in by_dimension('session_device', thirty_days_ago)
+        ],
+        'browser_stats': [
+            {'browser': row['dimension'], 'count': row['count']}
+            for row in by_dimension('session_browser', thirty_days_ago, limit=10)
+        ],
+    }
+
+
+@widget('concurrency')
+def concurrency_widget():
+    today, thirty_days_ago, seven_days_ago = dashboard_ranges()
+    
+    # Hourly peaks of today, kept up to date by generate_site_stats
+    users_by_hour = stored_peaks('users', today, hourly=True)
+    meetings_by_hour = {row['hour']: row['peak'] for row in stored_peaks('meetings', today, hourly=True)}
+    
+    # Meetings with the most participants at once (last 7 days)
+    busiest = meeting_peaks(day_start(seven_days_ago), timezone.now(), limit=10)
+    meetings = Meeting.objects.in_bulk([meeting_id for meeting_id, _ in busiest])
+    busiest_meetings = [
+        {'meeting': meetings[meeting_id], 'peak': peak}
+        for meeting_id, peak in busiest if meeting_id in meetings
+    ]
+    
+    return {
+        'peak_users_today': max((row['peak'] for row in users_by_hour), default=0),
+        'peak_in_meetings_today': max(meetings_by_hour.values(), default=0),
+        'hourly_peaks_today': [
+            {'hour': row['hour'], 'users': row['peak'], 'in_meetings': meetings_by_hour.get(row['hour'], 0)}
+            for row in users_by_hour
+        ],
+        'peak_users_per_day': stored_peaks('users', thirty_days_ago),
+        'busiest_meetings': busiest_meetings,
+    }
+
+
+@widget('recent_activity')
+def recent_activity_widget():
+    recent_activities = UserActivity.objects.select_related(
+        'user', 'meeting', 'room', 'team'
+    ).order_by('-timestamp')[:20]
+    return {'recent_activities': list(recent_activities)}
+
+
+@login_required
+def admin_dashboard(request):
+    """Main admin dashboard with comprehensive statistics"""
     
-    device_stats = UserSession.objects.filter(
-        login_time__gte=thirty_days_ago
-    ).values('device_type').annotate(
-        count=Count('id')
-    ).order_by('-count')
+    # Check if user is admin
+    if not is_admin(request.user):
+        messages.error(request, "You don't have admin access")
+        return redirect('home')
     
-    browser_stats = UserSession.objects.filter(
-        login_time__gte=thirty_days_ago
-    ).values('browser').annotate(
-        count=Count('id')
-    ).order_by('-count')[:10]
+    admin_role = request.user.admin_role
+    today, thirty_days_ago, seven_days_ago = dashboard_ranges()
     
-    # === RECENT ACTIVITY ===
+    # Live sections, not cached
     
-    recent_activities = UserActivity.objects.select_related(
-        'user', 'meeting', 'room', 'team'
-    ).order_by('-timestamp')[:20]
+    # Online users (active in last 2 minutes)
+    online_now = get_presence_backend().get_online_count()
     
-    # Generate today's stats snapshot
-    try:
-        SiteStatistics.generate_today_stats()
-    except Exception as e:
-        print(f"Failed to generate stats: {e}")
+    # Users online in meetings
+    users_in_meetings = OnlineUser.objects.filter(
+        is_in_meeting=True
+    ).select_related('user', 'current_meeting')
     
-    # Get historical stats for trends
+    # Get historical stats for trends (written by `manage.py generate_site_stats`)
     historical_stats = SiteStatistics.objects.filter(
         date__gte=thirty_days_ago
     ).order_by('date')
     
     context = {
         'admin_role': admin_role,
-        
-        # Overview
-        'total_users': total_users,
-        'total_teams': total_teams,
-        'total_meetings': total_meetings,
-        'total_contacts': total_contacts,
-        'active_users_30d': active_users_30d,
         'online_now': online_now,
-        'new_users_7d': new_users_7d,
-        'meetings_today': meetings_today,
-        
-        # Users
-        'most_active_users': most_active_users,
         'users_in_meetings': users_in_meetings,
-        
-        # Teams
-        'most_active_teams': most_active_teams,
-        'team_growth': list(team_growth),
-        
-        # Meetings
-        'meeting_stats': meeting_stats,
-        'meetings_per_day': list(meetings_per_day),
-        'top_hosts': top_hosts,
-        
-        # Activity
-        'activity_breakdown': list(activity_breakdown),
-        'logins_per_day': list(logins_per_day),
-        
-        # Device/Browser
-        'device_stats': list(device_stats),
-        'browser_stats': list(browser_stats),
-        
-        # Recent
-        'recent_activities': recent_activities,
-        
-        # Historical
         'historical_stats': historical_stats,
+        # Overview, users, teams, meetings, activity, device/browser, recent
+        **get_widgets(),
     }
     
     return render(request, 'admin/dashboard.html', context)
 
 
+# === ADMIN LISTS ===
+# Keyset-paginated (see crow_app/keyset.py): each list is a queryset and an
+# ordering ending in the primary key, and a page is picked by ?cursor=.
+# The pages and admin_list_api share them.
+
+ADMIN_LISTS = {
+    # Counts come from UserStats, one join
+    'users': (lambda: with_stats(User.objects.select_related('admin_role')), ['-date_joined', '-id']),
+    'meetings': (lambda: Meeting.objects.select_related('room__host'), ['-created_at', '-id']),
+    'teams': (lambda: UserClass.objects.select_related('created_by').annotate(member_count=Count('members')), ['-created_at', '-id']),
+    'activities': (lambda: UserActivity.objects.select_related('user'), ['-timestamp', '-id']),
+}
+
+# Attributes admin_list_api returns for each row ('a.b' follows a relation)
+LIST_API_FIELDS = {
+    'users': ['id', 'username', 'email', 'is_active', 'date_joined', 'last_seen',
+              'session_count', 'meeting_count', 'team_count'],
+    'meetings': ['id', 'title', 'room.name', 'room.host.username', 'scheduled_time', 'duration', 'created_at'],
+    'teams': ['id', 'name', 'created_at', 'member_count'],
+    'activities': ['id', 'user.username', 'activity_type', 'description', 'timestamp'],
+}
+
+
+def list_page(name, cursor=None, per_page=50):
+    """One KeysetPage of an admin list; raises InvalidCursor for a bad cursor"""
+    queryset, ordering = ADMIN_LISTS[name]
+    return paginate(queryset(), ordering, cursor, per_page)
+
+
+def list_page_or_first(request, name):
+    """The page of an admin list named by ?cursor=, or its first page when the cursor is bad"""
+    try:
+        return list_page(name, request.GET.get('cursor'))
+    except InvalidCursor:
+        return list_page(name)
+
+
+def approximate_totals():
+    """
+    Size of each admin list from maintained counters rather than COUNT(*):
+    the latest SiteStatistics snapshot (None before generate_site_stats
+    has run) and the activity rollups
+    """
+    latest = SiteStatistics.objects.order_by('-date').values('total_users', 'total_meetings', 'total_teams').first() or {}
+    return {
+        'users': latest.get('total_users'),
+        'meetings': latest.get('total_meetings'),
+        'teams': latest.get('total_teams'),
+        'activities': totals('activity')['count'],
+    }
+
+
 @login_required
 def admin_users_list(request):
     """List all users with management options"""
@@ -235,22 +303,9 @@ def admin_users_list(request):
         messages.error(request, "Access denied")
         return redirect('home')
     
-    # Get all users with annotations - FIXED
-    users = User.objects.annotate(
-        session_count=Count('sessions'),
-        meeting_count=Count('meeting_sessions'),
-        team_count=Count('class_memberships')
-    ).order_by('-date_joined')
-    
-    # Pagination
-    from django.core.paginator import Paginator
-    paginator = Paginator(users, 50)
-    page_number = request.GET.get('page')
-    users_page = paginator.get_page(page_number)
-    
     context = {
-        'users': users_page,
-        'total_users': users.count(),
+        'users': list_page_or_first(request, 'users'),
+        'total_users': approximate_totals()['users'],
     }
     
     return render(request, 'admin/users_list.html', context)
@@ -263,15 +318,16 @@ def admin_user_detail(request, user_id):
         messages.error(request, "Access denied")
         return redirect('home')
     
-    user = get_object_or_404(User, id=user_id)
+    # User statistics (kept in UserStats, archived rows included)
+    user = get_object_or_404(with_stats(User.objects.all()), id=user_id)
     
-    # User statistics
     user_stats = {
-        'total_sessions': UserSession.objects.filter(user=user).count(),
-        'total_meetings': MeetingSession.objects.filter(user=user).count(),
-        'total_teams': ClassMembership.objects.filter(user=user).count(),
-        'total_contacts': Contact.objects.filter(user=user).count(),
-        'total_activities': UserActivity.objects.filter(user=user).count(),
+        'total_sessions': user.session_count,
+        'total_meetings': user.meeting_count,
+        'total_teams': user.team_count,
+        'total_contacts': user.contact_count,
+        'total_activities': user.activity_count,
+        'last_seen': user.last_seen,
     }
     
     # Recent sessions
@@ -305,13 +361,9 @@ def admin_teams_list(request):
         messages.error(request, "Access denied")
         return redirect('home')
     
-    teams = UserClass.objects.annotate(
-        member_count=Count('members')
-    ).order_by('-created_at')
-    
     context = {
-        'teams': teams,
-        'total_teams': teams.count(),
+        'teams': list_page_or_first(request, 'teams'),
+        'total_teams': approximate_totals()['teams'],
     }
     
     return render(request, 'admin/teams_list.html', context)
@@ -324,19 +376,9 @@ def admin_meetings_list(request):
         messages.error(request, "Access denied")
         return redirect('home')
     
-    meetings = Meeting.objects.select_related(
-        'room__host'
-    ).order_by('-created_at')
-    
-    # Pagination
-    from django.core.paginator import Paginator
-    paginator = Paginator(meetings, 50)
-    page_number = request.GET.get('page')
-    meetings_page = paginator.get_page(page_number)
-    
     context = {
-        'meetings': meetings_page,
-        'total_meetings': meetings.count(),
+        'meetings': list_page_or_first(request, 'meetings'),
+        'total_meetings': approximate_totals()['meetings'],
     }
     
     return render(request, 'admin/meetings_list.html', context)
@@ -350,6 +392,7 @@ def admin_analytics_api(request):
     
     chart_type = request.GET.get('type', 'users')
     days = int(request.GET.get('days', 30))
+    hourly = request.GET.get('interval') == 'hour'  # counter-backed charts only
     
     end_date = timezone.now().date()
     start_date = end_date - timedelta(days=days)
@@ -357,33 +400,40 @@ def admin_analytics_api(request):
     if chart_type == 'users':
         # User signups over time
         data = User.objects.filter(
-            date_joined__date__gte=start_date
-        ).extra(
-            select={'day': 'date(date_joined)'}
+            date_joined__gte=day_start(start_date)
+        ).annotate(
+            day=TruncDate('date_joined')
         ).values('day').annotate(
             count=Count('id')
         ).order_by('day')
         
     elif chart_type == 'meetings':
         # Meetings created over time
-        data = Meeting.objects.filter(
-            created_at__gte=start_date
-        ).extra(
-            select={'day': 'date(created_at)'}
-        ).values('day').annotate(
-            count=Count('id')
-        ).order_by('day')
+        data = series('meeting_created', start_date, hourly=hourly)
         
     elif chart_type == 'logins':
         # Logins over time
-        data = UserActivity.objects.filter(
-            activity_type='login',
-            timestamp__gte=start_date
-        ).extra(
-            select={'day': 'date(timestamp)'}
-        ).values('day').annotate(
-            count=Count('id')
-        ).order_by('day')
+        data = series('activity', start_date, dimension='login', hourly=hourly)
+    
+    elif chart_type == 'activity':
+        # Activity types over the whole range
+        data = by_dimension('activity', start_date)
+    
+    elif chart_type == 'concurrency':
+        # Most users signed in ('users') or in meetings ('meetings') at once
+        kind = request.GET.get('kind', 'users')
+        if kind not in ('users', 'meetings'):
+            return JsonResponse({'error': 'Invalid kind'}, status=400)
+        data = stored_peaks(kind, start_date, hourly=hourly)
+    
+    elif chart_type == 'meeting_peaks':
+        # Meetings with the most participants at once over the range
+        peaks = meeting_peaks(day_start(start_date), timezone.now(), limit=20)
+        titles = dict(Meeting.objects.filter(id__in=[meeting_id for meeting_id, _ in peaks]).values_list('id', 'title'))
+        data = [
+            {'meeting_id': meeting_id, 'title': titles.get(meeting_id, ''), 'peak': peak}
+            for meeting_id, peak in peaks
+        ]
     
     else:
         return JsonResponse({'error': 'Invalid chart type'}, status=400)
@@ -395,6 +445,89 @@ def admin_analytics_api(request):
     })
 
 
+@login_required
+def admin_list_api(request, kind):
+    """API endpoint paging through an admin list with ?cursor= and ?limit="""
+    if not is_admin(request.user):
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    
+    if kind not in ADMIN_LISTS:
+        return JsonResponse({'error': 'Invalid list'}, status=400)
+    
+    try:
+        limit = min(max(int(request.GET.get('limit', 50)), 1), 200)
+        page = list_page(kind, request.GET.get('cursor'), limit)
+    except ValueError:  # a bad limit or an InvalidCursor
+        return JsonResponse({'error': 'Invalid cursor or limit'}, status=400)
+    
+    def value(row, path):
+        for name in path.split('.'):
+            row = getattr(row, name, None)
+        return row
+    
+    return JsonResponse({
+        'results': [{path.replace('.', '_'): value(row, path) for path in LIST_API_FIELDS[kind]} for row in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+        'approximate_total': approximate_totals()[kind],
+    })
+
+
+@login_required
+def admin_export(request, kind):
+    """
+    Stream an export of a tracking table (see crow_app/export.py)
+    ?format=csv|ndjson, ?start= / ?end= ISO dates or datetimes,
+    ?user=<id> (repeatable), ?gzip=1
+    """
+    if not is_admin(request.user):
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    
+    if not request.user.admin_role.can_view_analytics:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    fmt = request.GET.get('format', 'csv')
+    if kind not in EXPORTS or fmt not in FORMATS:
+        return JsonResponse({'error': 'Invalid export or format'}, status=400)
+    
+    try:
+        start = parse_bound(request.GET.get('start'))
+        end = parse_bound(request.GET.get('end'))
+        user_ids = [int(user_id) for user_id in request.GET.getlist('user')]
+    except ValueError:
+        return JsonResponse({'error': 'Invalid start, end or user'}, status=400)
+    
+    compress = request.GET.get('gzip') in ('1', 'true')
+    chunks = export_stream(kind, fmt, start, end, user_ids, compress)
+    if isinstance(request, ASGIRequest):
+        chunks = async_chunks(chunks)
+    response = StreamingHttpResponse(
+        chunks,
+        # A .gz download, not Content-Encoding: the client keeps the file compressed
+        content_type='application/gzip' if compress else f'{FORMATS[fmt][0]}; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename(kind, fmt, compress)}"'
+    return response
+
+
+@login_required
+def admin_tracking_metrics(request):
+    """API endpoint exposing tracking pipeline counters"""
+    if not is_admin(request.user):
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    
+    buffer = get_session_buffer()
+    pipeline = get_activity_pipeline()
+    
+    return JsonResponse({
+        'session_buffer': buffer.stats() if buffer is not None else None,
+        'activity_pipeline': pipeline.stats() if pipeline is not None else None,
+        'signaling': dict(room_registry.stats),
+        'signaling_rooms': room_registry.room_stats(),
+        'dashboard_widgets': widget_stats(),
+    })
+
+
 @login_required  
 def make_admin(request, user_id):
     """Make a user an admin (super_admin only)"""
@@ -414,6 +547,7 @@ def make_admin(request, user_id):
             user=user,
             defaults={'role': role}
         )
+        invalidate_widgets()
         
         messages.success(request, f"{user.username} is now an admin with role: {role}")
         return redirect('admin_users_list')
@@ -433,12 +567,8 @@ def admin_manage_users(request):
         messages.error(request, "You don't have permission to manage users")
         return redirect('admin_dashboard')
     
-    # Get all users with their roles
-    users = User.objects.annotate(
-        session_count=Count('sessions'),
-        meeting_count=Count('meeting_sessions'),
-        team_count=Count('class_memberships')
-    ).select_related('admin_role').order_by('-date_joined')
+    # One page of users with their roles and counts
+    users = list_page_or_first(request, 'users')
     
     # Get available admin roles
     admin_roles = AdminRole.ROLE_CHOICES
@@ -498,11 +628,14 @@ def admin_create_user(request):
                     role=admin_role
                 )
             
+            invalidate_widgets()
+            
             # Log activity
-            UserActivity.objects.create(
-                user=request.user,
-                activity_type='user_created',
-                description=f"Created user: {username}"
+            record_activity(
+                request.user,
+                'user_created',
+                f"Created user: {username}",
+                request=request
             )
             
             messages.success(request, f"User {username} created successfully")
@@ -571,11 +704,14 @@ def admin_edit_user(request, user_id):
                     if hasattr(user, 'admin_role'):
                         user.admin_role.delete()
             
+            invalidate_widgets()
+            
             # Log activity
-            UserActivity.objects.create(
-                user=request.user,
-                activity_type='user_updated',
-                description=f"Updated user: {user.username}"
+            record_activity(
+                request.user,
+                'user_updated',
+                f"Updated user: {user.username}",
+                request=request
             )
             
             messages.success(request, f"User {user.username} updated successfully")
@@ -617,14 +753,16 @@ def admin_delete_user(request, user_id):
         
         try:
             # Log activity before deletion
-            UserActivity.objects.create(
-                user=request.user,
-                activity_type='user_deleted',
-                description=f"Deleted user: {username}"
+            record_activity(
+                request.user,
+                'user_deleted',
+                f"Deleted user: {username}",
+                request=request
             )
             
             # Delete user
             user.delete()
+            invalidate_widgets()
             
             messages.success(request, f"User {username} deleted successfully")
             
@@ -652,12 +790,14 @@ def admin_toggle_user_status(request, user_id):
     # Toggle status
     user.is_active = not user.is_active
     user.save()
+    invalidate_widgets()
     
     # Log activity
-    UserActivity.objects.create(
-        user=request.user,
-        activity_type='user_status_changed',
-        description=f"{'Activated' if user.is_active else 'Deactivated'} user: {user.username}"
+    record_activity(
+        request.user,
+        'user_status_changed',
+        f"{'Activated' if user.is_active else 'Deactivated'} user: {user.username}",
+        request=request
     )
     
     return JsonResponse({
@@ -732,12 +872,14 @@ def admin_bulk_action(request):
                 message = f"Deleted {count} users"
             else:
                 return JsonResponse({'error': 'Invalid action'}, status=400)
+            invalidate_widgets()
             
             # Log activity
-            UserActivity.objects.create(
-                user=request.user,
-                activity_type='bulk_action',
-                description=f"Bulk action: {action} on {len(user_ids)} users"
+            record_activity(
+                request.user,
+                'bulk_action',
+                f"Bulk action: {action} on {len(user_ids)} users",
+                request=request
             )
             
             return JsonResponse({'success': True, 'message': message})
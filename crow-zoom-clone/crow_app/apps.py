@@ -4,4 +4,8 @@ class CrowAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crow_app'
     # Optional: Add a verbose name
-    verbose_name = "Crow Video App"
\ No newline at end of file
+    verbose_name = "Crow Video App"
+    
+    def ready(self):
+        # Connects the receivers that keep the dashboard counters and user stats current
+        from . import rollups, user_stats
\ No newline at end of file
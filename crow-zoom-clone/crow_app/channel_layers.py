@@ -0,0 +1,451 @@
+# crow_app/channel_layers.py - CHANNEL LAYER FOR SEVERAL WORKERS ON ONE HOST
+
+import argparse
+import asyncio
+import fcntl
+import itertools
+import json
+import logging
+import os
+import struct
+import subprocess
+import sys
+import time
+import uuid
+import weakref
+from collections import deque
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from .rooms import Admissions
+
+logger = logging.getLogger(__name__)
+
+_LENGTH = struct.Struct('>I')
+
+BROKER_IDLE_TIMEOUT = 60  # seconds the broker stays up with no clients
+RECEIVE_BATCH = 64        # queued messages handed over per receive request
+
+
+async def _read_frame(reader):
+    (length,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+    return msgpack.unpackb(await reader.readexactly(length))
+
+
+def _frame(*fields):
+    payload = msgpack.packb(fields)
+    return _LENGTH.pack(len(payload)) + payload
+
+
+class _Broker:
+    """
+    Holds every channel queue and group for the host, served on a Unix socket
+
+    Requests are msgpack lists behind a 4-byte length:
+    [op, request_id, *args]. Message bodies travel as opaque msgpack bytes
+    and are never decoded here. A receive waits in the broker until a
+    message arrives, so delivery is a push on the connection that asked;
+    when messages are already queued it takes up to RECEIVE_BATCH of them
+    in one reply, so a backlog drains in few round trips.
+    """
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.queues = {}    # channel -> deque of (expires_at, payload)
+        self.waiters = {}   # channel -> deque of (writer, request_id)
+        self.groups = {}    # group -> {channel: expires_at}
+        self.admissions = Admissions()  # room places, owned by the client connection that took them
+        self.clients = 0
+        self.idle_since = time.time()
+
+    async def serve(self, path):
+        server = await asyncio.start_unix_server(self.handle, path=path)
+        os.chmod(path, 0o600)
+        sweeper = asyncio.get_running_loop().create_task(self.sweep())
+        async with server:
+            await sweeper  # returns once the broker has been idle long enough
+
+    async def handle(self, reader, writer):
+        self.clients += 1
+        try:
+            while True:
+                op, request_id, *args = await _read_frame(reader)
+                if op == 'receive':
+                    self.receive(writer, request_id, *args)
+                    continue
+                elif op == 'send':
+                    result = self.put(*args)
+                elif op == 'group_send':
+                    group, payload = args
+                    for channel in list(self.groups.get(group, ())):
+                        self.put(channel, payload)
+                    continue  # fire and forget
+                elif op == 'group_add':
+                    group, channel = args
+                    self.groups.setdefault(group, {})[channel] = time.time() + self.layer.group_expiry
+                    result = 'ok'
+                elif op == 'group_discard':
+                    group, channel = args
+                    members = self.groups.get(group, {})
+                    members.pop(channel, None)
+                    if not members:
+                        self.groups.pop(group, None)
+                    result = 'ok'
+                elif op == 'cancel':
+                    # Ack only if the receive was still waiting; otherwise its
+                    # message is already on the way and the client keeps it
+                    (channel,) = args
+                    waiters = self.waiters.get(channel, ())
+                    if (writer, request_id) not in waiters:
+                        continue
+                    waiters.remove((writer, request_id))
+                    result = None
+                elif op == 'admit':
+                    result = self.admissions.try_admit(*args, owner=writer)
+                elif op == 'release':
+                    self.admissions.release(*args)
+                    result = 'ok'
+                elif op == 'count':
+                    result = self.admissions.count(*args)
+                elif op == 'flush':
+                    self.queues.clear()
+                    self.groups.clear()
+                    result = 'ok'
+                else:
+                    result = 'error'
+                writer.write(_frame(request_id, result))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.warning(f"Channel broker dropped a connection: {e}")
+        finally:
+            writer.close()
+            self.admissions.release_owner(writer)  # that worker's consumers are gone
+            self.clients -= 1
+            if not self.clients:
+                self.idle_since = time.time()
+
+    def put(self, channel, payload):
+        """Deliver to a waiting receive, or queue; 'full' at capacity"""
+        waiters = self.waiters.get(channel)
+        while waiters:
+            writer, request_id = waiters.popleft()
+            if writer.is_closing():
+                continue
+            writer.write(_frame(request_id, [payload]))
+            return 'ok'
+
+        queue = self.queues.setdefault(channel, deque())
+        now = time.time()
+        while queue and queue[0][0] < now:
+            queue.popleft()
+        if len(queue) >= self.layer.get_capacity(channel):
+            return 'full'
+        queue.append((now + self.layer.expiry, payload))
+        return 'ok'
+
+    def receive(self, writer, request_id, channel):
+        queue = self.queues.get(channel)
+        now = time.time()
+        payloads = []
+        while queue and len(payloads) < RECEIVE_BATCH:
+            expires_at, payload = queue.popleft()
+            if expires_at >= now:
+                payloads.append(payload)
+        if payloads:
+            writer.write(_frame(request_id, payloads))
+        else:
+            self.waiters.setdefault(channel, deque()).append((writer, request_id))
+
+    async def sweep(self):
+        """Drop expired messages, group memberships and dead waiters"""
+        while True:
+            await asyncio.sleep(1)
+            now = time.time()
+            if not self.clients and now - self.idle_since > BROKER_IDLE_TIMEOUT:
+                return
+            for channel, queue in list(self.queues.items()):
+                while queue and queue[0][0] < now:
+                    queue.popleft()
+                if not queue:
+                    del self.queues[channel]
+            for group, members in list(self.groups.items()):
+                for channel, expires_at in list(members.items()):
+                    if expires_at < now:
+                        del members[channel]
+                if not members:
+                    del self.groups[group]
+            for channel, waiters in list(self.waiters.items()):
+                live = deque(waiter for waiter in waiters if not waiter[0].is_closing())
+                if live:
+                    self.waiters[channel] = live
+                else:
+                    del self.waiters[channel]
+
+
+class _Connection:
+    """One event loop's connection to the broker, multiplexing requests by id"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count()
+        self.pending = {}     # request_id -> future
+        self.receiving = {}   # request_id -> channel, for receives
+        self.buffered = {}    # channel -> deque of payloads received but not yet returned
+        self.closed = False
+        self.reader_task = asyncio.get_running_loop().create_task(self.read_replies())
+
+    async def read_replies(self):
+        try:
+            while True:
+                request_id, result = await _read_frame(self.reader)
+                channel = self.receiving.pop(request_id, None)
+                future = self.pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(result)
+                elif channel is not None and result is not None:
+                    # The receive was cancelled after the broker sent the messages
+                    self.buffered.setdefault(channel, deque()).extend(result)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            self.closed = True
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('channel broker connection lost'))
+            self.pending.clear()
+
+    def post(self, op, *args):
+        if self.closed:
+            raise ConnectionError('channel broker connection lost')
+        self.writer.write(_frame(op, None, *args))
+
+    async def request(self, op, *args):
+        if self.closed:
+            raise ConnectionError('channel broker connection lost')
+        request_id = next(self.ids)
+        future = self.pending[request_id] = asyncio.get_running_loop().create_future()
+        self.writer.write(_frame(op, request_id, *args))
+        return await future
+
+    async def receive(self, channel):
+        buffered = self.buffered.get(channel)
+        if buffered:
+            payload = buffered.popleft()
+            if not buffered:
+                del self.buffered[channel]
+            return payload
+
+        if self.closed:
+            raise ConnectionError('channel broker connection lost')
+        request_id = next(self.ids)
+        future = self.pending[request_id] = asyncio.get_running_loop().create_future()
+        self.receiving[request_id] = channel
+        self.writer.write(_frame('receive', request_id, channel))
+        try:
+            payloads = await future
+        except asyncio.CancelledError:
+            self.pending.pop(request_id, None)
+            if not self.closed:
+                self.writer.write(_frame('cancel', request_id, channel))
+            raise
+        if len(payloads) > 1:
+            self.buffered.setdefault(channel, deque()).extend(payloads[1:])
+        return payloads[0]
+
+    def close(self):
+        self.closed = True
+        self.reader_task.cancel()
+        self.writer.close()
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """
+    Channel layer shared by the daphne/worker processes of one host
+
+    Every process talks to one broker process over a Unix socket. The
+    first client that cannot connect starts it (`python -m
+    crow_app.channel_layers`); a lock file makes sure only one runs, and it
+    exits after BROKER_IDLE_TIMEOUT seconds without clients. It takes its
+    expiry and capacity options from the client that started it, and its
+    own process keeps it off the workers' GIL. Queued messages live only in
+    the broker's memory, so this is not a substitute for Redis across
+    hosts. `channel_capacity` patterns must be glob strings.
+
+    Capacity, message expiry and group expiry follow the Channels spec.
+    """
+
+    extensions = ['groups', 'flush', 'admission']
+
+    def __init__(self, path='/tmp/crow-channels.sock', expiry=60, group_expiry=86400,
+                 capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = path
+        self.group_expiry = group_expiry
+        self.client_prefix = uuid.uuid4().hex
+        self._connections = weakref.WeakKeyDictionary()  # event loop -> _Connection
+        self._connecting = weakref.WeakKeyDictionary()   # event loop -> task opening its connection
+        self._config = {
+            'expiry': expiry,
+            'group_expiry': group_expiry,
+            'capacity': capacity,
+            'channel_capacity': channel_capacity or {},
+        }
+        self._broker_started_at = 0
+
+    # ─── Channels API ─────────────────────────────────────────────────────────
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        assert '__asgi_channel__' not in message
+
+        result = await self._request('send', channel, msgpack.packb(message))
+        if result == 'full':
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        while True:
+            connection = await self._connection()
+            try:
+                payload = await connection.receive(channel)
+            except ConnectionError:
+                self._drop_connection(connection)
+                continue
+            return msgpack.unpackb(payload)
+
+    async def new_channel(self, prefix='specific'):
+        return f"{prefix}.{self.client_prefix}!{uuid.uuid4().hex}"
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await self._request('group_add', group, channel)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await self._request('group_discard', group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_group_name(group), 'Group name not valid'
+        payload = msgpack.packb(message)
+        for attempt in range(2):
+            connection = await self._connection()
+            try:
+                connection.post('group_send', group, payload)
+                return
+            except ConnectionError:
+                self._drop_connection(connection)
+
+    async def flush(self):
+        await self._request('flush')
+
+    # ─── Admission extension (see rooms.Admissions) ──────────────────────────
+
+    async def try_admit(self, room_id, user_id, channel, limit, rate, burst):
+        """Atomically take a place in a room for every worker on the host"""
+        return await self._request('admit', room_id, user_id, channel, limit, rate, burst)
+
+    async def release(self, room_id, user_id, channel):
+        await self._request('release', room_id, user_id, channel)
+
+    async def count(self, room_id):
+        """Places taken in a room on every worker"""
+        return await self._request('count', room_id)
+
+    async def close(self):
+        connection = self._connections.pop(asyncio.get_running_loop(), None)
+        if connection is not None:
+            connection.close()
+
+    # ─── Broker connection ───────────────────────────────────────────────────
+
+    async def _request(self, op, *args):
+        for attempt in range(2):
+            connection = await self._connection()
+            try:
+                return await connection.request(op, *args)
+            except ConnectionError:
+                self._drop_connection(connection)
+                if attempt:
+                    raise
+
+    async def _connection(self):
+        loop = asyncio.get_running_loop()
+        connection = self._connections.get(loop)
+        if connection is None or connection.closed:
+            # Concurrent first calls on one loop share a single connection attempt
+            connecting = self._connecting.get(loop)
+            if connecting is None:
+                connecting = self._connecting[loop] = loop.create_task(self._open_connection(loop))
+            connection = await asyncio.shield(connecting)
+        return connection
+
+    async def _open_connection(self, loop):
+        try:
+            reader, writer = await self._connect()
+            connection = self._connections[loop] = _Connection(reader, writer)
+            return connection
+        finally:
+            del self._connecting[loop]
+
+    def _drop_connection(self, connection):
+        loop = asyncio.get_running_loop()
+        if self._connections.get(loop) is connection:
+            del self._connections[loop]
+        connection.close()
+
+    async def _connect(self):
+        for attempt in range(100):
+            try:
+                return await asyncio.open_unix_connection(self.path)
+            except OSError:
+                self._start_broker()
+                await asyncio.sleep(0.05)
+        raise ConnectionError(f"Cannot reach channel broker at {self.path}")
+
+    def _start_broker(self):
+        """Spawn a broker process; it exits at once if another one holds the lock"""
+        if time.monotonic() - self._broker_started_at < 1:
+            return  # give the last one time to bind
+        self._broker_started_at = time.monotonic()
+        subprocess.Popen(
+            [sys.executable, '-m', 'crow_app.channel_layers', self.path, json.dumps(self._config)],
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        logger.info(f"Started channel broker on {self.path}")
+
+
+def run_broker(path, config):
+    """Serve the broker on `path` unless another process already does"""
+    lock_file = open(path + '.lock', 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return
+
+    # Holding the lock means any existing socket file is stale
+    if os.path.exists(path):
+        os.unlink(path)
+    try:
+        asyncio.run(_Broker(UnixSocketChannelLayer(path=path, **config)).serve(path))
+    finally:
+        os.unlink(path)
+        lock_file.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Channel broker for UnixSocketChannelLayer')
+    parser.add_argument('path')
+    parser.add_argument('config', nargs='?', default='{}', help='layer options as JSON')
+    args = parser.parse_args()
+    run_broker(args.path, json.loads(args.config))
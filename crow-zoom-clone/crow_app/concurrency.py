@@ -0,0 +1,245 @@
+# crow_app/concurrency.py - PEAK-CONCURRENCY ENGINE FOR USERS AND MEETINGS
+#
+# How many users were signed in at once, and how many were in meetings at
+# once, per hour, per day and per meeting. Every figure is a sorted-event
+# sweep done with NumPy array operations: each interval becomes a +1 at
+# its start and a -1 at its end, the events are sorted (ends before starts
+# at the same instant, so touching intervals do not overlap) and a
+# cumulative sum gives the level after every event. A bucket's peak is
+# the highest level reached inside it or the level carried into it.
+#
+# Intervals are UserSession login to logout (or last activity) and
+# MeetingSession join to leave; a user's overlapping intervals are merged
+# first so each user counts once. Meeting sessions that never recorded a
+# leave are open until now, but for at most OPEN_SESSION_HOURS.
+#
+# Hourly peaks are stored in ConcurrencyPeak for the dashboard.
+# refresh_current_day() (run by `manage.py generate_site_stats`) only
+# recomputes the hours a session may still change, the last RECHECK_HOURS,
+# so it costs the sessions of a few hours rather than the whole day;
+# update_peaks() backfills any range.
+
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Max, Q
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .conf import setting_reader
+from .models import ConcurrencyPeak, MeetingSession, UserSession
+from .rollups import day_start
+
+DEFAULTS = {
+    'OPEN_SESSION_HOURS': 4,  # cap on meeting sessions that never recorded a leave
+    'RECHECK_HOURS': 2,       # stored hours refresh_current_day() recomputes
+}
+
+KINDS = ('users', 'meetings')
+
+
+get_concurrency_setting = setting_reader('CONCURRENCY', DEFAULTS)
+
+
+def _ms(values):
+    """Epoch milliseconds of aware datetimes, as an int64 array"""
+    seconds = np.fromiter((value.timestamp() for value in values), dtype=np.float64, count=len(values))
+    return np.rint(seconds * 1000).astype(np.int64)
+
+
+def _hour(at):
+    return timezone.localtime(at).replace(minute=0, second=0, microsecond=0)
+
+
+# ─── Sweeps ──────────────────────────────────────────────────────────────────
+
+def merge_overlaps(starts, ends, *keys):
+    """
+    Merge the overlapping (or touching) intervals that share all `keys`
+
+    Returns (starts, ends, *keys) with one entry per merged interval.
+    """
+    if not len(starts):
+        return (starts, ends, *keys)
+    order = np.lexsort((starts, *reversed(keys)))
+    starts, ends = starts[order], ends[order]
+    keys = [key[order] for key in keys]
+
+    changed = np.zeros(len(starts), dtype=bool)
+    for key in keys:
+        changed[1:] |= key[1:] != key[:-1]
+    rank = np.cumsum(changed)
+
+    # Furthest end so far within each key. Lifting every key above the whole
+    # span of the one before stops the running max leaking across keys
+    base = starts.min()
+    span = ends.max() - base + 1
+    reach = np.maximum.accumulate(ends - base + rank * span) - rank * span + base
+
+    heads = changed.copy()
+    heads[0] = True
+    heads[1:] |= starts[1:] > reach[:-1]
+    heads = np.flatnonzero(heads)
+    return (starts[heads], np.maximum.reduceat(ends, heads), *(key[heads] for key in keys))
+
+
+def sweep(starts, ends):
+    """(times, levels): after the event at times[i], levels[i] intervals are open"""
+    times = np.concatenate((starts, ends))
+    deltas = np.concatenate((np.ones(len(starts), dtype=np.int64), np.full(len(ends), -1, dtype=np.int64)))
+    order = np.lexsort((deltas, times))  # ends (-1) before starts at the same instant
+    return times[order], np.cumsum(deltas[order])
+
+
+def bucket_peaks(starts, ends, edges):
+    """Highest level in each bucket [edges[i], edges[i + 1]), as an int64 array"""
+    times, levels = sweep(starts, ends)
+    if not len(times):
+        return np.zeros(len(edges) - 1, dtype=np.int64)
+
+    # Level carried into each bucket: after the last event at or before its start
+    carried = np.searchsorted(times, edges[:-1], side='right') - 1
+    peaks = np.where(carried >= 0, levels[np.maximum(carried, 0)], 0)
+
+    # Highest level reached by the events strictly after each bucket's start
+    # (those at the start are in `carried`) and before its end. Partway
+    # through several events at one instant the level is not a real one
+    first = np.searchsorted(times, edges[:-1], side='right')
+    last = np.searchsorted(times, edges[1:], side='left')
+    inside = first < last
+    if inside.any():
+        # reduceat over [first, last) pairs; the odd results span the gaps between buckets
+        bounds = np.column_stack((first[inside], last[inside])).ravel()
+        reached = np.maximum.reduceat(np.append(levels, 0), bounds)[::2]
+        peaks[inside] = np.maximum(peaks[inside], reached)
+    return peaks
+
+
+def group_peaks(groups, starts, ends):
+    """{group: highest level} for intervals split into independent groups (e.g. meetings)"""
+    if not len(starts):
+        return {}
+    keys = np.concatenate((groups, groups))
+    times = np.concatenate((starts, ends))
+    deltas = np.concatenate((np.ones(len(starts), dtype=np.int64), np.full(len(ends), -1, dtype=np.int64)))
+    order = np.lexsort((deltas, times, keys))
+    keys = keys[order]
+    levels = np.cumsum(deltas[order])  # each group's events sum to zero, so every group starts from 0
+    heads = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return dict(zip(keys[heads].tolist(), np.maximum.reduceat(levels, heads).tolist()))
+
+
+# ─── Intervals ───────────────────────────────────────────────────────────────
+
+def load_intervals(kind, start_at, end_at, now=None):
+    """
+    (owners, groups, starts, ends) arrays of the `kind` intervals
+    overlapping [start_at, end_at), clipped to it
+
+    Owners are user ids, groups meeting ids ('meetings') or zeros ('users');
+    times are epoch milliseconds.
+    """
+    # Both reads are bounded from below on the end of the interval
+    # (session_end_idx, msession_left_joined_idx), so a recent window reads
+    # a few hours of rows. The start's upper bound is written as exclude()
+    # because as a plain `__lt` SQLite prefers it (a scan of all history
+    # before end_at) to the end's index
+    if kind == 'users':
+        rows = UserSession.objects.exclude(login_time__gte=end_at).filter(
+            Q(logout_time__gte=start_at) | Q(logout_time__isnull=True, last_activity__gte=start_at)
+        ).annotate(
+            ended_at=Coalesce('logout_time', 'last_activity')
+        ).order_by().values_list('user_id', 'login_time', 'ended_at')
+        rows = [(user_id, 0, started, ended) for user_id, started, ended in rows]
+    elif kind == 'meetings':
+        now = now or timezone.now()
+        cap = timedelta(hours=get_concurrency_setting('OPEN_SESSION_HOURS'))
+        rows = MeetingSession.objects.exclude(joined_at__gte=end_at).filter(
+            Q(left_at__gte=start_at) | Q(left_at__isnull=True, joined_at__gte=start_at - cap)
+        ).order_by().values_list('user_id', 'meeting_id', 'joined_at', 'left_at')
+        rows = [(user_id, meeting_id, joined, left or min(now, joined + cap)) for user_id, meeting_id, joined, left in rows]
+    else:
+        raise ValueError(f"Unknown concurrency kind: {kind}")
+
+    if not rows:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, empty
+    owners, groups, starts, ends = zip(*rows)
+    owners, groups = np.array(owners, dtype=np.int64), np.array(groups, dtype=np.int64)
+    starts, ends = np.clip(_ms(starts), *_ms([start_at, end_at])), np.clip(_ms(ends), *_ms([start_at, end_at]))
+    keep = ends > starts
+    return owners[keep], groups[keep], starts[keep], ends[keep]
+
+
+def peaks(kind, edges, now=None):
+    """Most distinct users at once in each bucket [edges[i], edges[i + 1]) of datetimes"""
+    owners, _, starts, ends = load_intervals(kind, edges[0], edges[-1], now)
+    starts, ends, _ = merge_overlaps(starts, ends, owners)
+    return bucket_peaks(starts, ends, _ms(edges)).tolist()
+
+
+def daily_peaks(kind, start, end, now=None):
+    """{date: peak} for the days in [start, end)"""
+    days = [start + timedelta(days=offset) for offset in range((end - start).days)]
+    if not days:
+        return {}
+    return dict(zip(days, peaks(kind, [day_start(day) for day in days] + [day_start(end)], now)))
+
+
+def hourly_peaks(kind, start_at, end_at, now=None):
+    """{hour: peak} for the hours from the one holding start_at up to end_at"""
+    if end_at <= start_at:
+        return {}
+    hours = [_hour(start_at)]
+    while hours[-1] + timedelta(hours=1) < end_at:
+        hours.append(hours[-1] + timedelta(hours=1))
+    return dict(zip(hours, peaks(kind, hours + [hours[-1] + timedelta(hours=1)], now)))
+
+
+def meeting_peaks(start_at, end_at, now=None, limit=None):
+    """[(meeting id, most participants at once)] within [start_at, end_at), highest first"""
+    owners, groups, starts, ends = load_intervals('meetings', start_at, end_at, now)
+    starts, ends, groups, _ = merge_overlaps(starts, ends, groups, owners)
+    result = sorted(group_peaks(groups, starts, ends).items(), key=lambda item: (-item[1], item[0]))
+    return result[:limit] if limit else result
+
+
+# ─── Stored hourly peaks ─────────────────────────────────────────────────────
+
+def update_peaks(start_at, end_at, now=None):
+    """Recompute and store both kinds' peaks for the hours from start_at to end_at; returns the hours written"""
+    rows = [
+        ConcurrencyPeak(kind=kind, hour=hour, peak=peak)
+        for kind in KINDS
+        for hour, peak in hourly_peaks(kind, start_at, end_at, now).items()
+    ]
+    ConcurrencyPeak.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=['kind', 'hour'], update_fields=['peak'], batch_size=500,
+    )
+    return len(rows) // len(KINDS)
+
+
+def refresh_current_day(now=None):
+    """
+    Bring the stored peaks up to now, recomputing only the last
+    RECHECK_HOURS before the latest stored hour (all of today on the
+    first run). The window reaches back past midnight, so the hours
+    that closed yesterday settle too.
+    """
+    now = now or timezone.now()
+    today_at = day_start(timezone.localdate(now))
+    latest = ConcurrencyPeak.objects.filter(
+        hour__gte=today_at - timedelta(days=1)
+    ).aggregate(latest=Max('hour'))['latest']
+    start_at = today_at if latest is None else latest - timedelta(hours=get_concurrency_setting('RECHECK_HOURS'))
+    return update_peaks(start_at, now, now)
+
+
+def stored_peaks(kind, start, end=None, hourly=False):
+    """[{'day' (or 'hour'), 'peak'}] of the days in [start, end), oldest first"""
+    queryset = ConcurrencyPeak.objects.filter(kind=kind, hour__gte=day_start(start))
+    if end is not None:
+        queryset = queryset.filter(hour__lt=day_start(end))
+    if hourly:
+        return list(queryset.values('hour', 'peak').order_by('hour'))
+    return list(queryset.annotate(day=TruncDate('hour')).values('day').annotate(peak=Max('peak')).order_by('day'))
@@ -0,0 +1,21 @@
+# crow_app/conf.py - APP SETTINGS WITH DEFAULTS
+#
+# Each tunable subsystem reads a dict from settings (EXPORT, RETENTION,
+# SIGNALING...) in which every option is optional. The module declares
+# its DEFAULTS and gets its reader from setting_reader(), e.g.
+#
+#     get_export_setting = setting_reader('EXPORT', DEFAULTS)
+#
+# Settings are looked up on every call, so override_settings applies.
+
+from django.conf import settings
+
+
+def setting_reader(name, defaults):
+    """A function reading one option of settings.<name>, falling back to `defaults`"""
+    def get_setting(option):
+        config = getattr(settings, name, {})
+        return config.get(option, defaults[option])
+
+    get_setting.__doc__ = f"Read a {name} option, falling back to the defaults"
+    return get_setting
@@ -1,13 +1,76 @@
 # crow_app/consumers.py - WebRTC Signaling Consumer
 
+import asyncio
+import itertools
 import json
+import random
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .models import MeetingRoom, WhiteboardSnapshot
+from .outbox import SendQueue
+from .rooms import TokenBucket, dumps, get_signaling_setting, room_registry, worker_of
+from .sfu import SFU_PEER, sfu_available, sfu_forwarder
+from .strokes import MAX_POINTS, MAX_STROKES, StrokeBatch, decode_stroke_batch, simplify_polyline
 
 class VideoCallConsumer(AsyncWebsocketConsumer):
     """
     WebSocket consumer for WebRTC signaling
     Handles peer discovery, SDP/ICE exchange, and collaborative drawing
+    
+    Offers, answers and ICE candidates are addressed to one peer, so they
+    are sent straight to that peer's channel when the room registry knows
+    it, and only broadcast to the room group as a fallback.
+    
+    Trickled ICE candidates for the same target are held for up to
+    SIGNALING['ICE_BATCH_WINDOW_MS'] and forwarded as one event. Clients
+    that send `features: ['ice-batch']` with `join` get them as a single
+    `ice-candidates` frame; older clients still get one `ice-candidate`
+    frame per candidate.
+    
+    Drawing travels as binary `stroke-batch` frames (see strokes.py).
+    Strokes from one sender are rate limited, optionally simplified and
+    coalesced into one frame per SIGNALING['STROKE_TICK_MS'], which is
+    encoded once and forwarded as-is to every other peer. Each room keeps
+    a compacted stroke log, sent to newcomers as one frame on connect and
+    saved as a WhiteboardSnapshot when the room empties.
+    
+    The registry also keeps the room roster: on `join` the newcomer gets
+    every current member in one `room-state` message while the others get
+    a single `user-joined` delta. A user who connects again (new tab,
+    dropped network) replaces their previous session instead of showing
+    up twice.
+    
+    Outgoing text frames are encoded once by the sender and carried in
+    the channel event as 'text'; receivers only check target/exclusion
+    and forward it verbatim.
+    
+    Once SIGNALING['SFU_MIN_PARTICIPANTS'] members have joined and all of
+    them sent `features: ['sfu']`, the room switches from the mesh to the
+    server-side forwarder (sfu.py): everyone gets `room-mode` and then
+    negotiates one connection with the pseudo-peer SFU_PEER using the same
+    offer/answer/ice-candidate messages. The forwarder lives in one worker
+    process, so a room only switches while every member is connected to
+    that worker, and switches back (`room-mode` with mode 'mesh') as soon
+    as someone joins it on another worker. While in SFU mode, a `join`
+    without the `sfu` feature is refused with `sfu-required` (close code
+    4009): it would get neither mesh peers nor forwarded tracks.
+    
+    Frames to the client go through a bounded SendQueue (outbox.py) that a
+    writer task drains, so handlers never wait on a slow socket. Drawing
+    is merged or dropped when it backs up; a client that falls too far
+    behind on signaling is disconnected with close code 4008.
+    
+    Admission is decided before anything else: a MeetingRoom holds at
+    most `max_participants` users, and each room admits at most
+    SIGNALING['JOIN_BURST'] newcomers at once and JOIN_RATE_PER_SEC after
+    that. A refused client gets `room-full` (close code 4003) or `wait`
+    with a jittered `retryAfter` in seconds (close code 4029). The places
+    are counted by the channel layer when it has the 'admission' extension
+    (so across workers), otherwise by this process.
     """
     
     async def connect(self):
@@ -21,24 +84,90 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
         
         self.user_id = str(self.user.id)
         self.username = self.user.username
+        self.admitted = False
+        max_participants = await self.load_max_participants()
+        verdict, retry_after = await self.try_admit(max_participants)
+        if verdict != 'ok':
+            await self.refuse(verdict, retry_after, max_participants)
+            return
+        self.admitted = True
         
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
-        
-        await self.accept()
+        try:
+            self.joined_at = timezone.now().isoformat()
+            self.replaced = False
+            self.features = set()
+            self.ice_batches = {}  # target -> pending candidates
+            self.stroke_batch = None
+            self.stroke_flush_task = None
+            self.stroke_batch_ids = itertools.count()
+            # A stroke is debited whole, so a smaller burst would never admit the longest one
+            self.stroke_bucket = TokenBucket(
+                get_signaling_setting('STROKE_POINTS_PER_SEC'),
+                max(get_signaling_setting('STROKE_BURST'), MAX_POINTS),
+            )
+            self.outbox = None
+            self.writer_task = None
+            
+            await self.channel_layer.group_add(
+                self.room_group_name,
+                self.channel_name
+            )
+            previous_channel = room_registry.set_channel(self.room_id, self.user_id, self.channel_name)
+            
+            await self.accept()
+            self.outbox = SendQueue(
+                get_signaling_setting('SEND_QUEUE_SIGNALING_MAX'),
+                get_signaling_setting('SEND_QUEUE_DRAWING_MAX'),
+                room_registry.room_counter(self.room_id),
+            )
+            self.writer_task = asyncio.create_task(self.write_outbox())
+            if previous_channel:
+                room_registry.stats['sessions_replaced'] += 1
+                await self.channel_layer.send(previous_channel, {'type': 'session_replaced'})
+            await self.send_whiteboard_state()
+        except BaseException:
+            # Channels only calls disconnect() after a successful connect, so
+            # give the place back here or it stays taken
+            self.admitted = False
+            if getattr(self, 'writer_task', None) is not None:
+                self.writer_task.cancel()
+            room_registry.discard(self.room_id, self.user_id, self.channel_name)
+            await self.release_admission()
+            raise
         print(f"✅ {self.username} connected to room {self.room_id}")
     
     async def disconnect(self, close_code):
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_left',
-                'userId': self.user_id,
-                'username': self.username
-            }
-        )
+        if not getattr(self, 'admitted', False):
+            return  # rejected before joining
+        
+        await self.release_admission()
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+        self.outbox = None
+        await self.flush_all_ice()
+        await self.flush_strokes()
+        if sfu_available():
+            await sfu_forwarder.leave(self.room_id, self.user_id, self.send_signal)
+        room_registry.discard(self.room_id, self.user_id, self.channel_name)
+        if not room_registry.room_size(self.room_id):
+            log = room_registry.drop_stroke_log(self.room_id)
+            if log is not None and (log or log.restored):
+                await self.save_whiteboard(log)
+        
+        if not self.replaced:  # the user is still in the room on their new session
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {
+                    'type': 'user_left',
+                    'text': dumps({
+                        'type': 'user-left',
+                        'userId': self.user_id,
+                        'username': self.username
+                    }),
+                    'userId': self.user_id,
+                    'sender_channel': self.channel_name
+                }
+            )
         
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -46,7 +175,11 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
         )
         print(f"❌ {self.username} disconnected from room {self.room_id}")
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            await self.handle_stroke_batch(bytes_data)
+            return
+        
         try:
             data = json.loads(text_data)
             message_type = data.get('type')
@@ -61,6 +194,8 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
                 await self.handle_answer(data)
             elif message_type == 'ice-candidate':
                 await self.handle_ice_candidate(data)
+            elif message_type == 'media-state':
+                await self.handle_media_state(data)
             elif message_type == 'draw':               # ✏️ NEW
                 await self.handle_draw(data)
                 
@@ -70,126 +205,518 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
             print(f'Error in receive: {e}')
     
     async def handle_join(self, data):
+        self.features = set(data.get('features') or [])
+        media = data.get('media') or {}
+        
+        if 'sfu' not in self.features and self.uses_sfu():
+            room_registry.stats['joins_refused_sfu'] += 1
+            await self.send(text_data=dumps({'type': 'sfu-required', 'mode': 'sfu'}))
+            await self.close(code=4009)
+            return
+        
+        room_registry.set_channel(
+            self.room_id, self.user_id, self.channel_name,
+            username=self.username, media=media, joinedAt=self.joined_at,
+            sfu='sfu' in self.features
+        )
+        sfu_min = get_signaling_setting('SFU_MIN_PARTICIPANTS')
+        switched = False
+        if sfu_min and sfu_available() and room_registry.room_size(self.room_id) >= sfu_min:
+            switched = room_registry.promote_to_sfu(
+                self.room_id, sfu_min, worker_of(self.channel_name), await self.admitted_count()
+            )
+        await self.send_frame(text_data=dumps({
+            'type': 'room-state',
+            'mode': room_registry.room_mode(self.room_id),
+            'participants': [
+                member for member in room_registry.roster(self.room_id)
+                if member['userId'] != self.user_id
+            ]
+        }))
+        
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'user_joined',
+                'text': dumps({
+                    'type': 'user-joined',
+                    'userId': self.user_id,
+                    'username': self.username,
+                    'media': media,
+                    'joinedAt': self.joined_at
+                }),
                 'userId': self.user_id,
                 'username': self.username,
-                'exclude_self': self.channel_name
+                'media': media,
+                'joinedAt': self.joined_at,
+                'exclude_self': self.channel_name,
+                'sender_channel': self.channel_name
             }
         )
+        
+        if switched:
+            room_registry.stats['sfu_rooms'] += 1
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {
+                    'type': 'room_mode',
+                    'text': dumps({'type': 'room-mode', 'mode': 'sfu', 'peer': SFU_PEER}),
+                    'mode': 'sfu',
+                    'worker': worker_of(self.channel_name),
+                    'exclude_self': self.channel_name
+                }
+            )
     
-    async def handle_offer(self, data):
-        target = data.get('target')
-        offer = data.get('offer')
+    async def split_sfu_room(self):
+        """
+        Someone joined this worker's SFU room on another worker, whose
+        clients the forwarder cannot reach: move the whole room back to the mesh
+        """
+        if not room_registry.demote_from_sfu(self.room_id):
+            return  # not in SFU mode, or another consumer got here first
+        room_registry.stats['sfu_rooms_split'] += 1
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'room_mode',
+                'text': dumps({'type': 'room-mode', 'mode': 'mesh'}),
+                'mode': 'mesh',
+                'worker': worker_of(self.channel_name),
+                'exclude_self': None
+            }
+        )
+    
+    async def handle_media_state(self, data):
+        media = data.get('media') or {}
+        room_registry.update_member(self.room_id, self.user_id, media=media)
         
         await self.channel_layer.group_send(
             self.room_group_name,
             {
-                'type': 'webrtc_offer',
-                'offer': offer,
-                'sender': self.user_id,
-                'senderName': self.username,
-                'target': target
+                'type': 'media_state',
+                'text': dumps({
+                    'type': 'media-state',
+                    'userId': self.user_id,
+                    'media': media
+                }),
+                'userId': self.user_id,
+                'media': media
             }
         )
     
+    async def handle_offer(self, data):
+        target = data.get('target')
+        offer = data.get('offer')
+        
+        if target == SFU_PEER:
+            if self.uses_sfu():
+                await sfu_forwarder.offer(self.room_id, self.user_id, offer, self.send_signal)
+            return
+        
+        await self.flush_ice(target)  # renegotiation: old candidates first
+        await self.send_to_peer(target, {
+            'type': 'webrtc_offer',
+            'text': dumps({
+                'type': 'offer',
+                'offer': offer,
+                'sender': self.user_id,
+                'senderName': self.username
+            }),
+            'sender': self.user_id,
+            'sender_channel': self.channel_name,
+            'target': target
+        })
+    
     async def handle_answer(self, data):
         target = data.get('target')
         answer = data.get('answer')
         
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'webrtc_answer',
+        if target == SFU_PEER:
+            if self.uses_sfu():
+                await sfu_forwarder.answer(self.room_id, self.user_id, answer)
+            return
+        
+        await self.flush_ice(target)
+        await self.send_to_peer(target, {
+            'type': 'webrtc_answer',
+            'text': dumps({
+                'type': 'answer',
                 'answer': answer,
                 'sender': self.user_id,
-                'senderName': self.username,
-                'target': target
-            }
-        )
+                'senderName': self.username
+            }),
+            'sender': self.user_id,
+            'sender_channel': self.channel_name,
+            'target': target
+        })
     
     async def handle_ice_candidate(self, data):
         target = data.get('target')
         candidate = data.get('candidate')
         
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
+        if target == SFU_PEER:
+            if self.uses_sfu():
+                await sfu_forwarder.ice_candidate(self.room_id, self.user_id, candidate)
+            return
+        
+        window_ms = get_signaling_setting('ICE_BATCH_WINDOW_MS')
+        if not window_ms:
+            await self.send_to_peer(target, {
                 'type': 'ice_candidate_forward',
-                'candidate': candidate,
-                'sender': self.user_id,
+                'text': dumps({
+                    'type': 'ice-candidate',
+                    'candidate': candidate,
+                    'sender': self.user_id
+                }),
+                'sender_channel': self.channel_name,
                 'target': target
-            }
-        )
+            })
+            return
+        
+        room_registry.stats['ice_candidates'] += 1
+        batch = self.ice_batches.get(target)
+        if batch is None:
+            batch = self.ice_batches[target] = {'candidates': [], 'started': time.perf_counter()}
+            batch['task'] = asyncio.create_task(self.flush_ice_later(target, window_ms / 1000))
+        batch['candidates'].append(candidate)
+        
+        if len(batch['candidates']) >= get_signaling_setting('ICE_BATCH_MAX'):
+            await self.flush_ice(target)
+    
+    async def flush_ice_later(self, target, delay):
+        await asyncio.sleep(delay)
+        await self.flush_ice(target)
+    
+    async def flush_ice(self, target):
+        """Forward the candidates held for one target as a single event"""
+        batch = self.ice_batches.pop(target, None)
+        if batch is None:
+            return
+        if batch['task'] is not asyncio.current_task():
+            batch['task'].cancel()
+        
+        # Added latency is how long the oldest candidate was held back
+        waited_ms = (time.perf_counter() - batch['started']) * 1000
+        stats = room_registry.stats
+        stats['ice_batches'] += 1
+        stats['ice_batch_wait_ms'] += waited_ms
+        stats['ice_batch_wait_max_ms'] = max(stats['ice_batch_wait_max_ms'], waited_ms)
+        
+        await self.send_to_peer(target, {
+            'type': 'ice_candidates_forward',
+            'text': dumps({
+                'type': 'ice-candidates',
+                'candidates': batch['candidates'],
+                'sender': self.user_id
+            }),
+            'candidates': batch['candidates'],  # for clients without 'ice-batch'
+            'sender': self.user_id,
+            'sender_channel': self.channel_name,
+            'target': target
+        })
+    
+    async def flush_all_ice(self):
+        for target in list(self.ice_batches):
+            await self.flush_ice(target)
+    
+    async def send_to_peer(self, target, event):
+        """Deliver an event to one peer, falling back to the room group if their channel is unknown"""
+        channel_name = room_registry.get_channel(self.room_id, str(target))
+        if channel_name:
+            room_registry.stats['unicast'] += 1
+            await self.channel_layer.send(channel_name, event)
+        else:
+            room_registry.stats['group_fallback'] += 1
+            await self.channel_layer.group_send(self.room_group_name, event)
+    
+    async def send_frame(self, text_data=None, bytes_data=None):
+        """Queue a signaling frame for the client; these are never dropped"""
+        if self.outbox is None:
+            return  # closing
+        timeout_ms = get_signaling_setting('SLOW_CLIENT_TIMEOUT_MS')
+        if not self.outbox.put(text_data, bytes_data):
+            await self.drop_slow_client('send queue full')
+        elif timeout_ms and self.outbox.oldest_signal_age() * 1000 > timeout_ms:
+            await self.drop_slow_client('send queue stalled')
+    
+    async def send_drawing(self, text_data=None, bytes_data=None, clear=False, droppable=True):
+        """Queue a drawing frame, which may be merged or dropped if the client lags"""
+        if self.outbox is not None:
+            self.outbox.put_drawing(text_data, bytes_data, clear=clear, droppable=droppable)
+    
+    async def write_outbox(self):
+        """Writer task: send queued frames in order of priority"""
+        while True:
+            text_data, bytes_data = await self.outbox.get()
+            await self.send(text_data=text_data, bytes_data=bytes_data)
+    
+    async def drop_slow_client(self, reason):
+        room_registry.stats['slow_client_disconnects'] += 1
+        room_registry.room_counter(self.room_id)['slow_client_disconnects'] += 1
+        print(f"🐢 Disconnecting {self.username} from room {self.room_id}: {reason}")
+        self.writer_task.cancel()
+        self.outbox = None
+        await self.close(code=4008)
+    
+    def uses_sfu(self):
+        return sfu_available() and room_registry.room_mode(self.room_id) == 'sfu'
+    
+    async def send_signal(self, payload):
+        """Send the client a frame from the SFU (answers and server offers)"""
+        await self.send_frame(text_data=dumps(payload))
+    
+    def learn_peer(self, event, user_id, **details):
+        """Remember a peer's channel from an event (it may live on another worker)"""
+        if event.get('sender_channel') and user_id != self.user_id:
+            room_registry.set_channel(self.room_id, user_id, event['sender_channel'], **details)
 
     # ✏️ NEW: Drawing handler
     async def handle_draw(self, data):
         """Broadcast drawing data to all other participants in the room"""
+        draw_data = data.get('data')
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'draw_broadcast',
-                'draw_data': data.get('data'),
+                'text': dumps({
+                    'type': 'draw',
+                    'data': draw_data,
+                }),
+                'clear': isinstance(draw_data, dict) and draw_data.get('action') == 'clear',
+                'sender': self.user_id,
+            }
+        )
+
+    async def handle_stroke_batch(self, bytes_data):
+        stats = room_registry.stats
+        stats['stroke_frames_in'] += 1
+        stats['stroke_bytes_in'] += len(bytes_data)
+        
+        try:
+            palette, strokes = decode_stroke_batch(bytes_data)
+        except ValueError as e:
+            stats['stroke_decode_errors'] += 1
+            print(f'Invalid stroke batch from {self.username}: {e}')
+            return
+        
+        epsilon = get_signaling_setting('STROKE_SIMPLIFY_EPSILON')
+        accepted = []
+        for index, points in strokes:
+            stats['stroke_points_in'] += len(points)
+            points = simplify_polyline(points, epsilon)
+            if not self.stroke_bucket.take(len(points)):
+                stats['strokes_rate_limited'] += 1
+                continue
+            accepted.append((index, points))
+        if not accepted:
+            return
+        
+        if self.stroke_batch is None:
+            self.stroke_batch = StrokeBatch()
+            self.stroke_flush_task = asyncio.create_task(
+                self.flush_strokes_later(get_signaling_setting('STROKE_TICK_MS') / 1000)
+            )
+        self.stroke_batch.add(palette, accepted)
+        
+        if len(self.stroke_batch.strokes) >= MAX_STROKES or self.stroke_batch.points >= MAX_POINTS:
+            await self.flush_strokes()
+    
+    async def flush_strokes_later(self, delay):
+        await asyncio.sleep(delay)
+        await self.flush_strokes()
+    
+    async def flush_strokes(self):
+        """Broadcast this sender's pending strokes as one pre-encoded frame"""
+        batch, self.stroke_batch = self.stroke_batch, None
+        if batch is None:
+            return
+        if self.stroke_flush_task is not asyncio.current_task():
+            self.stroke_flush_task.cancel()
+        
+        frame = batch.encode(get_signaling_setting('STROKE_SIMPLIFY_EPSILON'))
+        batch_id = f'{self.channel_name}:{next(self.stroke_batch_ids)}'
+        room_registry.stroke_log(self.room_id).append(frame, batch_id)
+        stats = room_registry.stats
+        stats['stroke_batches_out'] += 1
+        stats['stroke_bytes_out'] += len(frame)
+        stats['stroke_points_out'] += batch.points
+        
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'stroke_batch_broadcast',
+                'frame': frame,
+                'batch_id': batch_id,
                 'sender': self.user_id,
             }
         )
 
+    async def send_whiteboard_state(self):
+        """Send everything drawn so far as a single stroke-batch frame"""
+        log = room_registry.stroke_log(self.room_id)
+        if not log and not log.restored:
+            log.restored = True
+            frame = await self.load_whiteboard()
+            if frame and not log:
+                try:
+                    log.load(frame)
+                except ValueError as e:
+                    # A bad saved board must not stop the room from being joined
+                    print(f'Discarding unreadable whiteboard of room {self.room_id}: {e}')
+                    log.clear()
+        
+        frame = log.state_frame()
+        if frame:
+            await self.send_drawing(bytes_data=frame, droppable=False)
+    
+    # ─── Admission ───────────────────────────────────────────────────────────
+    
+    @database_sync_to_async
+    def load_max_participants(self):
+        """The room's capacity, or None for rooms that are not a MeetingRoom"""
+        try:
+            return MeetingRoom.objects.filter(id=self.room_id).values_list('max_participants', flat=True).first()
+        except ValidationError:
+            return None  # not a UUID
+    
+    async def try_admit(self, max_participants):
+        """Take a place in the room: ['ok', None], ['full', None] or ['wait', seconds]"""
+        args = (
+            self.room_id, self.user_id, self.channel_name, max_participants or 0,
+            get_signaling_setting('JOIN_RATE_PER_SEC'), get_signaling_setting('JOIN_BURST'),
+        )
+        if 'admission' in self.channel_layer.extensions:
+            return await self.channel_layer.try_admit(*args)
+        return room_registry.try_admit(*args)
+    
+    async def admitted_count(self):
+        """Places taken in the room on every worker, or None when only this process admits"""
+        if 'admission' in self.channel_layer.extensions:
+            return await self.channel_layer.count(self.room_id)
+        return None
+    
+    async def release_admission(self):
+        if 'admission' in self.channel_layer.extensions:
+            await self.channel_layer.release(self.room_id, self.user_id, self.channel_name)
+        else:
+            room_registry.release(self.room_id, self.user_id, self.channel_name)
+    
+    async def refuse(self, verdict, retry_after, max_participants):
+        """Tell a client it was not admitted, then close"""
+        await self.accept()
+        if verdict == 'wait':
+            room_registry.stats['joins_deferred'] += 1
+            # Jitter keeps a rejected burst from coming back all at once
+            retry_after += random.uniform(0, get_signaling_setting('JOIN_RETRY_JITTER'))
+            await self.send(text_data=dumps({'type': 'wait', 'retryAfter': round(retry_after, 2)}))
+            await self.close(code=4029)
+        else:
+            room_registry.stats['joins_refused_full'] += 1
+            await self.send(text_data=dumps({'type': 'room-full', 'maxParticipants': max_participants}))
+            await self.close(code=4003)
+    
+    @database_sync_to_async
+    def load_whiteboard(self):
+        snapshot = WhiteboardSnapshot.objects.filter(room_key=self.room_id).first()
+        return bytes(snapshot.data) if snapshot else None
+    
+    @database_sync_to_async
+    def save_whiteboard(self, log):
+        frame = log.state_frame()
+        if frame:
+            WhiteboardSnapshot.objects.update_or_create(room_key=self.room_id, defaults={'data': frame})
+        else:
+            # Cleared since it was restored
+            WhiteboardSnapshot.objects.filter(room_key=self.room_id).delete()
+
     # ─── Channel Layer Message Handlers ──────────────────────────────────────
 
     async def user_joined(self, event):
         if event.get('exclude_self') == self.channel_name:
             return
-        
-        await self.send(text_data=json.dumps({
-            'type': 'user-joined',
-            'userId': event['userId'],
-            'username': event['username']
-        }))
+        if event['userId'] == self.user_id:
+            # This user joined again on another worker; this session is stale
+            await self.session_replaced(event)
+            return
+        self.learn_peer(
+            event, event['userId'],
+            username=event['username'], media=event['media'], joinedAt=event['joinedAt']
+        )
+        await self.send_frame(text_data=event['text'])
+        if worker_of(event['sender_channel']) != worker_of(self.channel_name):
+            await self.split_sfu_room()
+    
+    async def media_state(self, event):
+        if event['userId'] == self.user_id:
+            return
+        room_registry.update_member(self.room_id, event['userId'], media=event['media'])
+        await self.send_frame(text_data=event['text'])
+    
+    async def room_mode(self, event):
+        if event['exclude_self'] == self.channel_name:
+            return
+        if event['mode'] == 'sfu':
+            if event['worker'] != worker_of(self.channel_name):
+                return  # that worker's forwarder cannot reach us; it switches back once we join
+            room_registry.set_sfu_mode(self.room_id)
+        else:
+            room_registry.demote_from_sfu(self.room_id)
+            if sfu_available():
+                await sfu_forwarder.leave(self.room_id, self.user_id, self.send_signal)
+        await self.send_frame(text_data=event['text'])
+    
+    async def session_replaced(self, event):
+        self.replaced = True
+        await self.close(code=4000)
     
     async def user_left(self, event):
         if event['userId'] == self.user_id:
             return
-        
-        await self.send(text_data=json.dumps({
-            'type': 'user-left',
-            'userId': event['userId'],
-            'username': event['username']
-        }))
+        room_registry.discard(self.room_id, event['userId'], event.get('sender_channel'))
+        await self.send_frame(text_data=event['text'])
     
     async def webrtc_offer(self, event):
         if event['target'] == self.user_id:
-            await self.send(text_data=json.dumps({
-                'type': 'offer',
-                'offer': event['offer'],
-                'sender': event['sender'],
-                'senderName': event['senderName']
-            }))
+            self.learn_peer(event, event['sender'])
+            await self.send_frame(text_data=event['text'])
     
     async def webrtc_answer(self, event):
         if event['target'] == self.user_id:
-            await self.send(text_data=json.dumps({
-                'type': 'answer',
-                'answer': event['answer'],
-                'sender': event['sender'],
-                'senderName': event['senderName']
-            }))
+            self.learn_peer(event, event['sender'])
+            await self.send_frame(text_data=event['text'])
     
     async def ice_candidate_forward(self, event):
         if event['target'] == self.user_id:
-            await self.send(text_data=json.dumps({
+            await self.send_frame(text_data=event['text'])
+    
+    async def ice_candidates_forward(self, event):
+        if event['target'] != self.user_id:
+            return
+        
+        if 'ice-batch' in self.features:
+            await self.send_frame(text_data=event['text'])
+            return
+        
+        for candidate in event['candidates']:
+            await self.send_frame(text_data=dumps({
                 'type': 'ice-candidate',
-                'candidate': event['candidate'],
+                'candidate': candidate,
                 'sender': event['sender']
             }))
 
+    async def stroke_batch_broadcast(self, event):
+        if event['sender'] == self.user_id:
+            return
+        # Every consumer on this worker sees the event; the log keeps it once
+        room_registry.stroke_log(self.room_id).append(event['frame'], event['batch_id'])
+        await self.send_drawing(bytes_data=event['frame'])
+
     # ✏️ NEW: Forward drawing data to everyone except the sender
     async def draw_broadcast(self, event):
+        if event['clear']:
+            room_registry.stroke_log(self.room_id).clear()
+        
         if event['sender'] == self.user_id:
             return  # Don't echo back to sender
 
-        await self.send(text_data=json.dumps({
-            'type': 'draw',
-            'data': event['draw_data'],
-        }))
\ No newline at end of file
+        await self.send_drawing(text_data=event['text'], clear=event['clear'])
\ No newline at end of file
@@ -0,0 +1,188 @@
+# crow_app/export.py - STREAMING CSV / NDJSON EXPORT OF THE TRACKING TABLES
+#
+# Exports UserActivity, UserSession and MeetingSession rows without ever
+# holding the result in memory: rows come off a database cursor with
+# .iterator(chunk_size=CHUNK_SIZE) (a server-side cursor on PostgreSQL,
+# chunked fetchmany() elsewhere) as plain value tuples, are encoded into a
+# buffer, and leave as a bytes chunk every FLUSH_BYTES, optionally through
+# an on-the-fly gzip compressor. Memory is one chunk of rows plus one
+# buffer whatever the size of the export.
+#
+# The admin endpoint (admin_views.admin_export) wraps export_stream() in a
+# StreamingHttpResponse; `manage.py export_tracking_data` writes it to a
+# file or stdout, and `manage.py bench_export` measures rows/sec. Under
+# ASGI the response must be given async_chunks(): Django buffers a whole
+# synchronous iterator into a list before sending it there.
+#
+# Rows are ordered by their timestamp then id, so an export is stable and
+# a range export lines up with the archive segments of retention.py.
+
+import csv
+import io
+import zlib
+from datetime import datetime, time
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .conf import setting_reader
+from .models import MeetingSession, UserActivity, UserSession
+
+DEFAULTS = {
+    'CHUNK_SIZE': 2000,        # rows fetched from the cursor at a time
+    'FLUSH_BYTES': 64 * 1024,  # encoded bytes buffered before a chunk is yielded
+    'GZIP_LEVEL': 6,
+}
+
+# Export name -> (model, timestamp field the range filters on, exported columns).
+# UserSession.session_key is left out: it would let the reader log in
+EXPORTS = {
+    'activities': (UserActivity, 'timestamp', [
+        'id', 'user_id', 'user__username', 'activity_type', 'description',
+        'meeting_id', 'room_id', 'team_id', 'ip_address', 'user_agent_id', 'timestamp',
+    ]),
+    'sessions': (UserSession, 'login_time', [
+        'id', 'user_id', 'user__username', 'ip_address', 'user_agent_id', 'device_type', 'browser',
+        'location', 'login_time', 'last_activity', 'logout_time', 'is_active',
+    ]),
+    'meeting_sessions': (MeetingSession, 'joined_at', [
+        'id', 'user_id', 'user__username', 'meeting_id', 'room_id', 'joined_at', 'left_at',
+        'connection_quality', 'video_enabled_duration', 'audio_enabled_duration',
+        'screen_shared_duration', 'device_type', 'browser',
+    ]),
+}
+
+FORMATS = {
+    # format -> (content type, file extension)
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+get_export_setting = setting_reader('EXPORT', DEFAULTS)
+
+
+def parse_bound(value):
+    """
+    Aware datetime of a range bound given as an ISO date (its local
+    midnight) or datetime; None for an empty value. Raises ValueError.
+    """
+    if not value:
+        return None
+    at = parse_datetime(value)
+    if at is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Not a date or datetime: {value}")
+        at = datetime.combine(day, time.min)
+    if timezone.is_naive(at):
+        at = timezone.make_aware(at)
+    return at
+
+
+def columns(name):
+    """Column names of an export, as they appear in its header / keys"""
+    return [column.replace('__', '_') for column in EXPORTS[name][2]]
+
+
+def export_rows(name, start=None, end=None, user_ids=None, chunk_size=None):
+    """Value tuples of export `name` with timestamps in [start, end), oldest first"""
+    model, timestamp_field, fields = EXPORTS[name]
+    queryset = model.objects.all()
+    if start is not None:
+        queryset = queryset.filter(**{f'{timestamp_field}__gte': start})
+    if end is not None:
+        queryset = queryset.filter(**{f'{timestamp_field}__lt': end})
+    if user_ids:
+        queryset = queryset.filter(user_id__in=user_ids)
+    queryset = queryset.order_by(timestamp_field, 'id').values_list(*fields)
+    return queryset.iterator(chunk_size=chunk_size or get_export_setting('CHUNK_SIZE'))
+
+
+def _csv_chunks(header, rows, flush_bytes):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= flush_bytes:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(header, rows, flush_bytes):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    lines = []
+    size = 0
+    for row in rows:
+        line = encoder.encode(dict(zip(header, row)))
+        lines.append(line)
+        size += len(line) + 1
+        if size >= flush_bytes:
+            lines.append('')
+            yield '\n'.join(lines)
+            lines = []
+            size = 0
+    if lines:
+        lines.append('')
+        yield '\n'.join(lines)
+
+
+ENCODERS = {
+    'csv': _csv_chunks,
+    'ndjson': _ndjson_chunks,
+}
+
+
+def gzip_chunks(chunks, level=None):
+    """Compress a stream of bytes chunks into one gzip stream, chunk by chunk"""
+    compressor = zlib.compressobj(level or get_export_setting('GZIP_LEVEL'), zlib.DEFLATED, 31)  # 31: gzip header
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_stream(name, fmt='csv', start=None, end=None, user_ids=None, compress=False, chunk_size=None):
+    """
+    Bytes chunks of export `name` in `fmt` ('csv' or 'ndjson'), gzipped
+    with compress=True. Nothing is read until the stream is iterated.
+    """
+    if name not in EXPORTS:
+        raise ValueError(f"Unknown export: {name}")
+    if fmt not in ENCODERS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    rows = export_rows(name, start, end, user_ids, chunk_size)
+    chunks = (
+        text.encode('utf-8')
+        for text in ENCODERS[fmt](columns(name), rows, get_export_setting('FLUSH_BYTES'))
+        if text
+    )
+    return gzip_chunks(chunks) if compress else chunks
+
+
+async def async_chunks(chunks):
+    """
+    Serve a synchronous chunk stream to an async consumer one chunk at a
+    time. Every chunk is pulled on the thread-sensitive thread, so the
+    database cursor stays on the connection that opened it.
+    """
+    chunks = iter(chunks)
+    pull = sync_to_async(next, thread_sensitive=True)
+    while True:
+        chunk = await pull(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def filename(name, fmt, compress=False):
+    """Download name, e.g. activities-2026-10-17.csv.gz"""
+    suffix = '.gz' if compress else ''
+    return f"{name}-{timezone.localdate():%Y-%m-%d}.{FORMATS[fmt][1]}{suffix}"
@@ -0,0 +1,145 @@
+# crow_app/keyset.py - KEYSET (CURSOR) PAGINATION FOR THE ADMIN LISTS
+#
+# OFFSET pagination reads and throws away every row before the page, and
+# Paginator adds a COUNT(*) of the whole table, so every page is slower
+# than the one before. A keyset page continues from the row at its edge
+# instead: with a list ordered by (-created_at, -id) the next page is
+#
+#     WHERE created_at <= :last_created_at
+#       AND (created_at < :last_created_at OR id < :last_id)
+#     ORDER BY created_at DESC, id DESC LIMIT :per_page
+#
+# an index range read that costs the same on page 1 and page 10,000. The
+# ordering must end in a unique column and its columns must not be null.
+#
+# Cursors are opaque URL-safe strings naming the edge row, the direction
+# and the table and ordering they belong to; a cursor from another list or
+# one that was tampered with raises InvalidCursor. Pages carry no total, so
+# show an approximate one from a maintained counter alongside.
+
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """A cursor that cannot be decoded or belongs to another table or ordering"""
+
+
+class KeysetPage:
+    """One page of rows plus the cursors of the pages either side"""
+
+    def __init__(self, rows, next_cursor=None, previous_cursor=None):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def _fields(ordering):
+    """[(field name, descending)] of an order_by()-style ordering"""
+    return [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+
+
+def _json_value(value):
+    # isoformat() keeps the microseconds DjangoJSONEncoder would round off;
+    # the edge value must match the row exactly
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(row, ordering, backwards=False):
+    """Cursor for the rows after `row` (before it with backwards=True)"""
+    payload = {
+        'm': row._meta.label,
+        'o': list(ordering),
+        'v': [getattr(row, name) for name, _ in _fields(ordering)],
+        'b': backwards,
+    }
+    data = json.dumps(payload, default=_json_value, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor, model, ordering):
+    """(edge values, backwards) of a cursor made by encode_cursor() for this model and ordering"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if payload['m'] != model._meta.label or payload['o'] != list(ordering) or len(payload['v']) != len(ordering):
+            raise InvalidCursor("Cursor belongs to another list")
+        values = [
+            model._meta.get_field(name).to_python(value)
+            for (name, _), value in zip(_fields(ordering), payload['v'])
+        ]
+        return values, bool(payload['b'])
+    except InvalidCursor:
+        raise
+    except (ValueError, TypeError, KeyError, ValidationError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}")
+
+
+def _beyond(fields, values):
+    """Q for the rows strictly past `values` in the order of `fields`"""
+    (first, first_desc), first_value = fields[0], values[0]
+    past = Q()
+    equal = Q()
+    for (name, desc), value in zip(fields, values):
+        past |= equal & Q(**{f"{name}__{'lt' if desc else 'gt'}": value})
+        equal &= Q(**{name: value})
+    # The leading bound on its own lets the database range-scan the index
+    return Q(**{f"{first}__{'lte' if first_desc else 'gte'}": first_value}) & past
+
+
+def paginate(queryset, ordering, cursor=None, per_page=50):
+    """
+    The KeysetPage of `queryset` that `cursor` points at (the first page
+    without one), ordered by `ordering`, e.g. ['-created_at', '-id']
+    """
+    first_page = queryset
+    fields = _fields(ordering)
+    backwards = False
+    if cursor:
+        values, backwards = decode_cursor(cursor, queryset.model, ordering)
+        if backwards:
+            fields = [(name, not desc) for name, desc in fields]
+        queryset = queryset.filter(_beyond(fields, values))
+
+    order = [f"{'-' if desc else ''}{name}" for name, desc in fields]
+    rows = list(queryset.order_by(*order)[:per_page + 1])
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if backwards:
+        if not rows:
+            return paginate(first_page, ordering, None, per_page)  # everything before it is gone
+        rows.reverse()
+        has_previous, has_next = more, True
+    else:
+        has_previous, has_next = bool(cursor), more
+
+    if not rows:
+        return KeysetPage(rows)
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1], ordering) if has_next else None,
+        previous_cursor=encode_cursor(rows[0], ordering, backwards=True) if has_previous else None,
+    )
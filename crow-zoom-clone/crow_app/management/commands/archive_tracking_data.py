@@ -0,0 +1,53 @@
+# crow_app/management/commands/archive_tracking_data.py
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from crow_app.retention import (
+    ARCHIVED_MODELS, archivable, archive_chunk, default_cutoff, get_retention_setting,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Roll old UserActivity/UserSession rows into daily aggregates, then move '
+        'them into compressed monthly archive files'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, help='Age in days (default RETENTION MAX_AGE_DAYS)')
+        parser.add_argument('--chunk-size', type=int, help='Rows per transaction (default RETENTION CHUNK_SIZE)')
+        parser.add_argument('--model', choices=sorted(ARCHIVED_MODELS), action='append',
+                            help='Only archive this table (repeatable)')
+        parser.add_argument('--archive-dir', help='Override RETENTION ARCHIVE_DIR')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows would move')
+
+    def handle(self, *args, **options):
+        if options['older_than'] is not None and options['older_than'] < 1:
+            raise CommandError('--older-than must be at least 1 day')
+
+        cutoff = (
+            timezone.now() - timedelta(days=options['older_than'])
+            if options['older_than'] is not None else default_cutoff()
+        )
+        chunk_size = options['chunk_size'] or get_retention_setting('CHUNK_SIZE')
+
+        self.stdout.write(f"Archiving rows older than {cutoff:%Y-%m-%d %H:%M} in chunks of {chunk_size}")
+
+        for model_name in options['model'] or sorted(ARCHIVED_MODELS):
+            pending = archivable(model_name, cutoff).count()
+            if options['dry_run'] or not pending:
+                self.stdout.write(f"{model_name}: {pending} rows to archive")
+                continue
+
+            moved = 0
+            while True:
+                count = archive_chunk(model_name, cutoff, chunk_size, options['archive_dir'])
+                if not count:
+                    break
+                moved += count
+                self.stdout.write(f"{model_name}: {moved}/{pending} rows archived ({moved * 100 // pending}%)")
+
+            self.stdout.write(self.style.SUCCESS(f"{model_name}: done, {moved} rows archived"))
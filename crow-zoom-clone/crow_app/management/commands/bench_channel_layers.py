@@ -0,0 +1,153 @@
+# crow_app/management/commands/bench_channel_layers.py
+#
+# Pushes VideoCallConsumer's signaling message mix (offers, answers and ICE
+# candidates sent to one peer; joins and stroke batches sent to the room
+# group) through each channel layer backend and reports throughput and
+# delivery latency.
+
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+# (event type, sent to one peer?, payload bytes, weight)
+SIGNALING_MIX = [
+    ('webrtc_offer', True, 3000, 1),
+    ('webrtc_answer', True, 3000, 1),
+    ('ice_candidate_forward', True, 250, 8),
+    ('user_joined', False, 150, 1),
+    ('stroke_batch_broadcast', False, 120, 10),
+]
+
+BACKENDS = {
+    'in-memory': ('channels.layers.InMemoryChannelLayer', {}),
+    'unix-socket': ('crow_app.channel_layers.UnixSocketChannelLayer', {}),
+    'redis': ('channels_redis.core.RedisChannelLayer', {}),
+}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark channel layer backends with the video room signaling message mix'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=5000, help='Events sent per backend')
+        parser.add_argument('--room-size', type=int, default=10, help='Consumers in the room group')
+        parser.add_argument('--senders', type=int, default=4, help='Concurrent sending tasks')
+        parser.add_argument('--rate', type=float, default=0,
+                            help='Events/sec to offer (0 sends as fast as possible, which measures '
+                                 'throughput; set a rate to measure latency without a backlog)')
+        parser.add_argument('--backend', action='append', choices=list(BACKENDS), help='Limit to these backends')
+        parser.add_argument('--redis', default='127.0.0.1:6379', help='host:port for the Redis backend')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+
+    def handle(self, *args, **options):
+        results = []
+        for name in options['backend'] or BACKENDS:
+            path, config = BACKENDS[name]
+            config = dict(config, capacity=100000)
+            if name == 'unix-socket':
+                config['path'] = f'/tmp/crow-bench-{os.getpid()}.sock'
+            elif name == 'redis':
+                host, port = options['redis'].rsplit(':', 1)
+                config['hosts'] = [(host, int(port))]
+
+            try:
+                layer = import_string(path)(**config)
+                result = asyncio.run(self.run_backend(layer, options))
+            except Exception as e:
+                # Mostly: channels_redis not installed or no Redis server
+                result = {'skipped': f'{type(e).__name__}: {e}'}
+            result['backend'] = name
+            results.append(result)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(
+            f"{'backend':<12} {'events/s':>10} {'deliveries/s':>13} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'lost':>6}"
+        )
+        for result in results:
+            if 'skipped' in result:
+                self.stdout.write(f"{result['backend']:<12} skipped ({result['skipped']})")
+                continue
+            self.stdout.write(
+                f"{result['backend']:<12} {result['events_per_sec']:>10.0f} {result['deliveries_per_sec']:>13.0f} "
+                f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['lost']:>6}"
+            )
+
+    async def run_backend(self, layer, options):
+        room_size = options['room_size']
+        group = 'video_call_bench'
+        channels = [await layer.new_channel() for _ in range(room_size)]
+        for channel in channels:
+            await layer.group_add(group, channel)
+
+        rng = random.Random(42)
+        plan = rng.choices(SIGNALING_MIX, weights=[entry[3] for entry in SIGNALING_MIX], k=options['messages'])
+        expected = sum(1 if unicast else room_size for _, unicast, _, _ in plan)
+
+        latencies = []
+        all_delivered = asyncio.Event()
+
+        async def receiver(channel):
+            while True:
+                message = await layer.receive(channel)
+                latencies.append((time.perf_counter() - message['sent_at']) * 1000)
+                if len(latencies) >= expected:
+                    all_delivered.set()
+
+        senders = options['senders']
+        interval = senders / options['rate'] if options['rate'] else 0
+
+        async def sender(events):
+            for i, (event_type, unicast, size, _) in enumerate(events):
+                if interval:
+                    delay = started + i * interval - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                message = {'type': event_type, 'payload': 'x' * size, 'sent_at': time.perf_counter()}
+                if unicast:
+                    await layer.send(rng.choice(channels), message)
+                else:
+                    await layer.group_send(group, message)
+
+        receivers = [asyncio.ensure_future(receiver(channel)) for channel in channels]
+        await asyncio.sleep(0.05)  # let every receive reach the layer
+
+        started = time.perf_counter()
+        await asyncio.gather(*(sender(plan[i::senders]) for i in range(senders)))
+        sent = time.perf_counter()
+        try:
+            await asyncio.wait_for(all_delivered.wait(), timeout=30)
+        except asyncio.TimeoutError:
+            pass
+        finished = time.perf_counter()
+
+        for task in receivers:
+            task.cancel()
+        await asyncio.gather(*receivers, return_exceptions=True)
+        for channel in channels:
+            await layer.group_discard(group, channel)
+
+        latencies.sort()
+        if not latencies:
+            latencies = [0.0]
+        return {
+            'events': len(plan),
+            'room_size': room_size,
+            'send_seconds': sent - started,
+            'seconds': finished - started,
+            'events_per_sec': len(plan) / (finished - started),
+            'deliveries_per_sec': len(latencies) / (finished - started),
+            'p50_ms': statistics.median(latencies),
+            'p95_ms': latencies[int(len(latencies) * 0.95) - 1],
+            'p99_ms': latencies[int(len(latencies) * 0.99) - 1],
+            'lost': max(expected - len(latencies), 0),
+        }
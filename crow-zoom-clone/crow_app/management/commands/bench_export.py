@@ -0,0 +1,101 @@
+# crow_app/management/commands/bench_export.py
+#
+# Measures export throughput in rows/sec for each table, format and
+# compression setting, and the peak Python memory of each export, which
+# stays flat as --rows grows. Runs against a throwaway test database
+# seeded with --rows rows per table.
+
+import json
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from crow_app.export import EXPORTS, FORMATS, export_stream
+from crow_app.models import Meeting, MeetingSession, Room, UserActivity, UserSession
+
+
+class Command(BaseCommand):
+    help = 'Benchmark streaming exports (rows/sec and peak memory) per table, format and compression'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Rows seeded per table')
+        parser.add_argument('--chunk-size', type=int, help='Rows fetched from the database at a time')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.seed(options['rows'])
+            results = []
+            for name in EXPORTS:
+                for fmt in FORMATS:
+                    for compress in (False, True):
+                        result = self.run_export(name, fmt, compress, options['chunk_size'])
+                        result['rows'] = options['rows']
+                        result['rows_per_sec'] = options['rows'] / result['seconds']
+                        results.append(result)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'export':<17} {'format':<7} {'gzip':<5} {'rows/s':>10} {'MB out':>8} {'peak MB':>8}")
+        for result in results:
+            self.stdout.write(
+                f"{result['export']:<17} {result['format']:<7} {'yes' if result['gzip'] else 'no':<5} "
+                f"{result['rows_per_sec']:>10.0f} {result['bytes'] / 1e6:>8.1f} {result['peak_bytes'] / 1e6:>8.2f}"
+            )
+
+    def seed(self, total):
+        """`total` rows in each exported table, spread over the last 30 days"""
+        users = [User.objects.create_user(f'bench-user-{i}') for i in range(50)]
+        room = Room.objects.create(name='bench-room', host=users[0])
+        meeting = Meeting.objects.create(room=room, title='bench-meeting', scheduled_time=timezone.now())
+        start = timezone.now() - timedelta(days=30)
+        step = timedelta(days=30) / total
+        for offset in range(0, total, 5000):
+            batch = range(offset, min(offset + 5000, total))
+            UserActivity.objects.bulk_create([
+                UserActivity(user=users[i % 50], activity_type='login', description='bench', timestamp=start + step * i)
+                for i in batch
+            ])
+            UserSession.objects.bulk_create([
+                UserSession(user=users[i % 50], session_key=f'bench-{i}', device_type='Desktop', browser='Chrome')
+                for i in batch
+            ])
+            MeetingSession.objects.bulk_create([
+                MeetingSession(user=users[i % 50], meeting=meeting, room=room, left_at=start + step * i)
+                for i in batch
+            ])
+
+    def run_export(self, name, fmt, compress, chunk_size):
+        def export():
+            written = 0
+            for chunk in export_stream(name, fmt, compress=compress, chunk_size=chunk_size):
+                written += len(chunk)
+            return written
+
+        started = time.perf_counter()
+        written = export()
+        elapsed = time.perf_counter() - started
+
+        # Again under tracemalloc, which would skew the timing
+        tracemalloc.start()
+        export()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            'export': name,
+            'format': fmt,
+            'gzip': compress,
+            'seconds': elapsed,
+            'bytes': written,
+            'peak_bytes': peak,
+        }
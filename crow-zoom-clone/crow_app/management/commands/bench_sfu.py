@@ -0,0 +1,175 @@
+# crow_app/management/commands/bench_sfu.py
+#
+# Runs the selective forwarder against synthetic participants on this host
+# and reports the forwarder's CPU per forwarded stream. The participants
+# (aiortc peer connections publishing generated video, and optionally
+# audio) live in a child process so their encoding and decoding is not
+# counted; signaling travels over a pipe instead of WebSockets.
+
+import asyncio
+import json
+import multiprocessing
+import resource
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crow_app.sfu import SelectiveForwarder, sfu_available
+
+BENCH_ROOM = 'bench-sfu'
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_participants(conn, participants, audio):
+    """Child process: synthetic clients that publish and count what they receive"""
+    from aiortc import AudioStreamTrack, RTCPeerConnection, RTCSessionDescription, VideoStreamTrack
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        inbox = asyncio.Queue()
+        loop.add_reader(conn.fileno(), lambda: inbox.put_nowait(conn.recv()))
+        frames = Counter()
+        pcs = {}
+
+        async def consume(user_id, track):
+            while True:
+                try:
+                    await track.recv()
+                except Exception:
+                    return
+                frames[user_id] += 1
+
+        for user_id in map(str, range(participants)):
+            pc = pcs[user_id] = RTCPeerConnection()
+            pc.addTrack(VideoStreamTrack())
+            if audio:
+                pc.addTrack(AudioStreamTrack())
+            pc.on('track', lambda track, user_id=user_id: asyncio.ensure_future(consume(user_id, track)))
+            await pc.setLocalDescription(await pc.createOffer())
+            conn.send((user_id, 'offer', {'type': 'offer', 'sdp': pc.localDescription.sdp}))
+
+        while True:
+            user_id, payload = await inbox.get()
+            if payload == 'count':
+                conn.send((None, 'count', sum(frames.values())))
+            elif payload == 'stop':
+                break
+            elif payload['type'] == 'answer':
+                await pcs[user_id].setRemoteDescription(RTCSessionDescription(**payload['answer']))
+            elif payload['type'] == 'offer':
+                pc = pcs[user_id]
+                await pc.setRemoteDescription(RTCSessionDescription(**payload['offer']))
+                await pc.setLocalDescription(await pc.createAnswer())
+                conn.send((user_id, 'answer', {'type': 'answer', 'sdp': pc.localDescription.sdp}))
+
+        for pc in pcs.values():
+            await pc.close()
+
+    asyncio.run(main())
+
+
+class Command(BaseCommand):
+    help = 'Benchmark SFU forwarding CPU with synthetic participants on this host'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--participants', type=int, default=4, help='Synthetic clients in the room')
+        parser.add_argument('--audio', action='store_true', help='Publish an audio track as well as video')
+        parser.add_argument('--warmup', type=float, default=3, help='Seconds to let every stream start')
+        parser.add_argument('--duration', type=float, default=10, help='Measured seconds')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+
+    def handle(self, *args, **options):
+        if not sfu_available():
+            raise CommandError('aiortc is not installed')
+
+        conn, child_conn = multiprocessing.Pipe()
+        child = multiprocessing.get_context('fork').Process(
+            target=run_participants, args=(child_conn, options['participants'], options['audio']), daemon=True
+        )
+        child.start()
+        try:
+            result = asyncio.run(self.run_forwarder(conn, options))
+            child.join(timeout=10)
+        finally:
+            if child.is_alive():
+                child.kill()
+
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+
+        self.stdout.write(
+            f"{result['participants']} participants, {result['streams']} forwarded streams, "
+            f"{result['seconds']:.1f}s measured"
+        )
+        self.stdout.write(f"  forwarder CPU           {result['cpu_percent']:.1f}% of a core")
+        self.stdout.write(f"  CPU per stream          {result['cpu_percent_per_stream']:.2f}% of a core")
+        self.stdout.write(f"  frames/s per stream     {result['frames_per_sec_per_stream']:.1f}")
+
+    async def run_forwarder(self, conn, options):
+        loop = asyncio.get_running_loop()
+        inbox = asyncio.Queue()
+        loop.add_reader(conn.fileno(), lambda: inbox.put_nowait(conn.recv()))
+        stats = Counter()
+        forwarder = SelectiveForwarder(stats)
+
+        def signaler(user_id):
+            async def send_signal(payload):
+                conn.send((user_id, payload))
+            return send_signal
+
+        senders = {}
+        counts = asyncio.Queue()
+
+        async def dispatch():
+            while True:
+                user_id, kind, payload = await inbox.get()
+                if kind == 'offer':
+                    sender = senders.setdefault(user_id, signaler(user_id))
+                    await forwarder.offer(BENCH_ROOM, user_id, payload, sender)
+                elif kind == 'answer':
+                    await forwarder.answer(BENCH_ROOM, user_id, payload)
+                elif kind == 'count':
+                    counts.put_nowait(payload)
+
+        dispatcher = asyncio.ensure_future(dispatch())
+
+        async def received_frames():
+            conn.send((None, 'count'))
+            return await counts.get()
+
+        participants = options['participants']
+        streams = participants * (participants - 1) * (2 if options['audio'] else 1)
+        deadline = time.monotonic() + 30
+        while stats['sfu_streams'] < streams:
+            if time.monotonic() > deadline:
+                raise CommandError(f"Only {stats['sfu_streams']} of {streams} streams were set up")
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(options['warmup'])
+
+        frames_before, cpu_before, started = await received_frames(), cpu_seconds(), time.monotonic()
+        await asyncio.sleep(options['duration'])
+        frames_after, cpu_after, seconds = await received_frames(), cpu_seconds(), time.monotonic() - started
+
+        conn.send((None, 'stop'))
+        for user_id in senders:
+            await forwarder.leave(BENCH_ROOM, user_id)
+        dispatcher.cancel()
+        loop.remove_reader(conn.fileno())
+
+        cpu_percent = (cpu_after - cpu_before) / seconds * 100
+        return {
+            'participants': participants,
+            'audio': options['audio'],
+            'streams': streams,
+            'seconds': seconds,
+            'cpu_percent': cpu_percent,
+            'cpu_percent_per_stream': cpu_percent / streams,
+            'frames_per_sec_per_stream': (frames_after - frames_before) / seconds / streams,
+            'renegotiations': stats['sfu_renegotiations'],
+        }
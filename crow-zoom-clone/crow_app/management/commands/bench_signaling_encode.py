@@ -0,0 +1,171 @@
+# crow_app/management/commands/bench_signaling_encode.py
+#
+# Measures the CPU one room broadcast costs across every receiving
+# VideoCallConsumer: the old form, where each receiver rebuilt the frame and
+# called json.dumps, against the pre-encoded form, where the sender encodes
+# once (with the stdlib or orjson) and receivers forward the text.
+
+import asyncio
+import json
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from crow_app import rooms
+from crow_app.consumers import VideoCallConsumer
+from crow_app.outbox import SendQueue
+from crow_app.rooms import dumps, room_registry
+
+BENCH_ROOM = 'bench-signaling-encode'
+
+# A pen segment as the JSON drawing path sends it, and a roster entry
+DRAW_DATA = {
+    'action': 'draw', 'tool': 'pen', 'color': '#1e88e5', 'size': 4,
+    'points': [[round(100 + i * 1.7, 1), round(200 + i * 0.9, 1)] for i in range(24)],
+}
+JOIN_MEDIA = {'audio': True, 'video': True, 'screen': False}
+
+
+class SinkConsumer(VideoCallConsumer):
+    """
+    A receiving consumer whose socket just counts the frames sent to it
+
+    Handlers queue frames on the outbox as in a live connection; drain()
+    does the writer task's part.
+    """
+
+    def __init__(self, user_id):
+        super().__init__()
+        self.user_id = user_id
+        self.room_id = BENCH_ROOM
+        self.frames = 0
+        self.outbox = SendQueue(float('inf'), float('inf'), Counter())
+        self.writer_task = None
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        self.frames += 1
+
+    async def drain(self):
+        while self.outbox:
+            await self.send(*await self.outbox.get())
+
+
+class PerReceiverConsumer(SinkConsumer):
+    """The previous receivers: every one rebuilds the frame and encodes it"""
+
+    async def user_joined(self, event):
+        if event['exclude_self'] == self.channel_name:
+            return
+        self.learn_peer(
+            event, event['userId'],
+            username=event['username'], media=event['media'], joinedAt=event['joinedAt']
+        )
+        await self.send(text_data=json.dumps({
+            'type': 'user-joined',
+            'userId': event['userId'],
+            'username': event['username'],
+            'media': event['media'],
+            'joinedAt': event['joinedAt']
+        }))
+
+    async def draw_broadcast(self, event):
+        if event['sender'] == self.user_id:
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'draw',
+            'data': event['draw_data'],
+        }))
+
+
+def per_receiver_events(sender):
+    return {
+        'draw': lambda: {'type': 'draw_broadcast', 'draw_data': DRAW_DATA, 'sender': sender},
+        'join': lambda: {
+            'type': 'user_joined', 'userId': sender, 'username': 'bench',
+            'media': JOIN_MEDIA, 'joinedAt': 0, 'exclude_self': 'sender', 'sender_channel': 'sender',
+        },
+    }
+
+
+def pre_encoded_events(sender):
+    return {
+        'draw': lambda: {
+            'type': 'draw_broadcast',
+            'text': dumps({'type': 'draw', 'data': DRAW_DATA}),
+            'clear': False,
+            'sender': sender,
+        },
+        'join': lambda: {
+            'type': 'user_joined',
+            'text': dumps({
+                'type': 'user-joined', 'userId': sender, 'username': 'bench',
+                'media': JOIN_MEDIA, 'joinedAt': 0,
+            }),
+            'userId': sender, 'username': 'bench', 'media': JOIN_MEDIA, 'joinedAt': 0,
+            'exclude_self': 'sender', 'sender_channel': 'sender',
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = 'Benchmark per-broadcast CPU of pre-encoded versus per-receiver signaling frames'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--broadcasts', type=int, default=2000, help='Broadcasts per measurement')
+        parser.add_argument('--room-size', type=int, action='append',
+                            help='Receivers per broadcast (repeatable, default 2, 10 and 50)')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+
+    def handle(self, *args, **options):
+        variants = [('per-receiver', PerReceiverConsumer, per_receiver_events, False)]
+        variants.append(('pre-encoded', SinkConsumer, pre_encoded_events, False))
+        if rooms.orjson is not None:
+            variants.append(('pre-encoded+orjson', SinkConsumer, pre_encoded_events, True))
+
+        results = []
+        try:
+            for room_size in options['room_size'] or [2, 10, 50]:
+                for name, consumer_class, make_events, fast_json in variants:
+                    signaling = dict(getattr(settings, 'SIGNALING', {}), FAST_JSON=fast_json)
+                    with override_settings(SIGNALING=signaling):
+                        result = asyncio.run(
+                            self.run_variant(consumer_class, make_events, room_size, options['broadcasts'])
+                        )
+                    results.append(dict(result, variant=name, room_size=room_size))
+        finally:
+            for user_id in range(1000):
+                room_registry.discard(BENCH_ROOM, user_id)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'room':>5} {'variant':<20} {'draw us':>9} {'join us':>9}")
+        for result in results:
+            self.stdout.write(
+                f"{result['room_size']:>5} {result['variant']:<20} "
+                f"{result['draw_us']:>9.1f} {result['join_us']:>9.1f}"
+            )
+
+    async def run_variant(self, consumer_class, make_events, room_size, broadcasts):
+        # One extra consumer sends; the draw/join handlers skip it as they would in a room
+        consumers = [consumer_class(user_id) for user_id in range(room_size + 1)]
+        for consumer in consumers:
+            consumer.channel_name = f'bench.{consumer.user_id}'
+        consumers[0].channel_name = 'sender'
+
+        result = {}
+        for kind, make_event in make_events(consumers[0].user_id).items():
+            started = time.process_time()
+            for _ in range(broadcasts):
+                event = make_event()
+                for consumer in consumers:
+                    await getattr(consumer, event['type'])(event)
+                    await consumer.drain()
+            elapsed = time.process_time() - started
+            result[f'{kind}_us'] = elapsed / broadcasts * 1e6
+        result['frames'] = sum(consumer.frames for consumer in consumers)
+        return result
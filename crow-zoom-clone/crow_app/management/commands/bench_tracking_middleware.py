@@ -0,0 +1,176 @@
+# crow_app/management/commands/bench_tracking_middleware.py
+#
+# Measures requests/sec through Django's ASGI handler with the tracking
+# middlewares in their old thread-hopping form (MiddlewareMixin.__acall__)
+# and in their async-native form. Runs against a throwaway test database.
+
+import asyncio
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import HttpResponse
+from django.test.utils import override_settings
+from django.urls import path
+from django.utils.deprecation import MiddlewareMixin
+
+from crow_app.middleware import ActivityTrackingMiddleware, SessionTrackingMiddleware
+
+BENCH_USER_AGENT = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+)
+
+
+class ThreadHopSessionTrackingMiddleware(SessionTrackingMiddleware):
+    """The pre-async behaviour: every request hops to a thread"""
+    __acall__ = MiddlewareMixin.__acall__
+
+
+class ThreadHopActivityTrackingMiddleware(ActivityTrackingMiddleware):
+    __acall__ = MiddlewareMixin.__acall__
+
+
+async def bench_view(request):
+    return HttpResponse('ok')
+
+
+urlpatterns = [
+    path('bench/', bench_view),
+]
+
+VARIANTS = {
+    'thread-hop': (
+        f'{__name__}.ThreadHopSessionTrackingMiddleware',
+        f'{__name__}.ThreadHopActivityTrackingMiddleware',
+    ),
+    'async-native': (
+        'crow_app.middleware.SessionTrackingMiddleware',
+        'crow_app.middleware.ActivityTrackingMiddleware',
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark ASGI requests/sec with thread-hopping vs async-native tracking middleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per variant')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            cookie = self.create_session()
+            results = []
+            for variant, tracking in VARIANTS.items():
+                middleware = [
+                    name for name in settings.MIDDLEWARE
+                    if not name.startswith('crow_app.middleware.')
+                ] + list(tracking)
+
+                with override_settings(MIDDLEWARE=middleware, ROOT_URLCONF=__name__):
+                    app = ASGIHandler()
+                    asyncio.run(self.run_load(app, cookie, 100, options['concurrency']))  # warm-up
+                    result = asyncio.run(self.run_load(app, cookie, options['requests'], options['concurrency']))
+
+                result['variant'] = variant
+                results.append(result)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'variant':<14} {'req/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+        for result in results:
+            self.stdout.write(
+                f"{result['variant']:<14} {result['requests_per_sec']:>10.1f} "
+                f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['errors']:>7}"
+            )
+
+    def create_session(self):
+        """Log a benchmark user in and return the session cookie header"""
+        user = User.objects.create_user('bench-user', password='bench-password')
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+    async def run_load(self, app, cookie, total, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        errors = 0
+
+        async def one_request():
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                status = await self.request(app, cookie)
+                latencies.append((time.perf_counter() - started) * 1000)
+                if status != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            'requests': total,
+            'concurrency': concurrency,
+            'seconds': elapsed,
+            'requests_per_sec': total / elapsed,
+            'p50_ms': statistics.median(latencies),
+            'p95_ms': latencies[int(len(latencies) * 0.95) - 1],
+            'errors': errors,
+        }
+
+    async def request(self, app, cookie):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': '/bench/',
+            'raw_path': b'/bench/',
+            'query_string': b'',
+            'root_path': '',
+            'headers': [
+                (b'host', b'localhost'),
+                (b'cookie', cookie.encode()),
+                (b'user-agent', BENCH_USER_AGENT.encode()),
+            ],
+            'client': ('127.0.0.1', 50000),
+            'server': ('localhost', 80),
+        }
+        body_sent = False
+        status = None
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # Stay connected until the handler is done with us
+            await asyncio.Future()
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+
+        await app(scope, receive, send)
+        return status
@@ -0,0 +1,57 @@
+# crow_app/management/commands/export_tracking_data.py
+#
+# Streams UserActivity, UserSession or MeetingSession rows to a file or
+# stdout as CSV or NDJSON, optionally gzipped, in constant memory (see
+# crow_app/export.py), e.g.
+#
+#     python manage.py export_tracking_data activities --start 2026-01-01 --gzip -o activities.csv.gz
+
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crow_app.export import EXPORTS, FORMATS, export_stream, parse_bound
+
+
+class Command(BaseCommand):
+    help = 'Stream a tracking table to a file or stdout as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=sorted(EXPORTS), help='Table to export')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--start', help='Only rows at or after this ISO date or datetime')
+        parser.add_argument('--end', help='Only rows before this ISO date or datetime')
+        parser.add_argument('--user', type=int, action='append', help='Only rows of this user id (repeatable)')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip')
+        parser.add_argument('--chunk-size', type=int, help='Rows fetched from the database at a time')
+        parser.add_argument('-o', '--output', default='-', help='Output file (default: stdout)')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] is not None and options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        try:
+            start = parse_bound(options['start'])
+            end = parse_bound(options['end'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        chunks = export_stream(
+            options['export'], options['format'], start, end,
+            options['user'], options['gzip'], options['chunk_size'],
+        )
+        started = time.perf_counter()
+        written = 0
+        out = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+
+        if options['output'] != '-':
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {written:,} bytes to {options['output']} in {time.perf_counter() - started:.1f}s"
+            ))
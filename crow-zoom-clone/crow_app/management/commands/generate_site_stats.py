@@ -0,0 +1,52 @@
+# crow_app/management/commands/generate_site_stats.py
+#
+# Refreshes the SiteStatistics snapshots the admin dashboard reads. Run it
+# from cron every few minutes (by default it recomputes yesterday, to settle
+# the day that just ended, and today):
+#
+#     */5 * * * * cd /path/to/crow-zoom-clone && python manage.py generate_site_stats
+#
+# --start/--end backfill any range in one grouped pass per table;
+# --workers splits long ranges into date chunks computed in parallel.
+#
+# It also keeps the hourly peak-concurrency figures (ConcurrencyPeak) up to
+# date: a plain run only recomputes the last few hours, a backfill
+# recomputes every hour of its range.
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from crow_app.concurrency import refresh_current_day, update_peaks
+from crow_app.management.options import parse_day
+from crow_app.rollups import day_start
+from crow_app.site_stats import generate
+
+
+class Command(BaseCommand):
+    help = 'Compute SiteStatistics snapshots for today and yesterday, or backfill a range of days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day, YYYY-MM-DD (default: yesterday)')
+        parser.add_argument('--end', help='Last day, YYYY-MM-DD (default: today)')
+        parser.add_argument('--workers', type=int, default=1, help='Processes computing date chunks in parallel')
+        parser.add_argument('--chunk-days', type=int, default=31, help='Days per chunk')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        end = parse_day(options['end']) if options['end'] else today
+        start = parse_day(options['start']) if options['start'] else end - timedelta(days=1)
+        if start > end:
+            raise CommandError('--start must not be after --end')
+        if options['workers'] < 1 or options['chunk_days'] < 1:
+            raise CommandError('--workers and --chunk-days must be at least 1')
+
+        written = generate(start, end + timedelta(days=1), options['workers'], options['chunk_days'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote statistics for {written} days ({start} to {end})"))
+
+        if options['start'] or options['end']:
+            hours = update_peaks(day_start(start), min(day_start(end + timedelta(days=1)), timezone.now()))
+        else:
+            hours = refresh_current_day()
+        self.stdout.write(self.style.SUCCESS(f"Updated peak concurrency for {hours} hours"))
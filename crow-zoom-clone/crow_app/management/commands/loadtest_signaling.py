@@ -0,0 +1,440 @@
+# crow_app/management/commands/loadtest_signaling.py
+#
+# Load test for VideoCallConsumer. Simulated participants join rooms at a
+# fixed ramp, negotiate with everyone already there (offer/answer plus
+# trickled ICE), some of them draw, and each leaves after its session.
+# Every relayed frame carries the time it was sent, so the report has
+# p50/p95/p99 relay latency per message kind, messages/sec and memory per
+# connection. Participants the room's join-rate limit answers with `wait`
+# reconnect after the hint, as the page does. Runs against a throwaway
+# test database.
+#
+#   --mode communicator  in-process, through channels.testing.WebsocketCommunicator
+#   --mode daphne        real sockets against a daphne server forked for the run
+#                        (needs the `websockets` package)
+
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+from collections import Counter, defaultdict
+from multiprocessing import get_context
+
+import django
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+try:
+    from websockets.asyncio.client import connect as websocket_connect
+    from websockets.exceptions import ConnectionClosed
+except ImportError:
+    websocket_connect = None
+
+FAKE_SDP = 'v=0\r\n' + 'a=candidate-and-codec-lines\r\n' * 110  # about the size of a real offer
+ICE_PER_NEGOTIATION = 6
+ICE_INTERVAL = 0.01
+
+
+def rss_kb(pid='self'):
+    """Resident memory of a process in KiB (Linux), or None"""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50_ms': statistics.median(values),
+        'p95_ms': values[max(int(len(values) * 0.95) - 1, 0)],
+        'p99_ms': values[max(int(len(values) * 0.99) - 1, 0)],
+        'max_ms': values[-1],
+    }
+
+
+def serve_daphne(port):
+    """Child process: serve the project's ASGI application with daphne"""
+    import sys
+    sys.stdout = open(os.devnull, 'w')  # the consumer prints every message
+    from daphne.server import Server
+
+    application = import_string(settings.ASGI_APPLICATION)
+    Server(application=application, endpoints=[f'tcp:port={port}:interface=127.0.0.1']).run()
+
+
+class CommunicatorTransport:
+    """Talks to the consumer in-process, with the user put straight into the scope"""
+
+    def __init__(self, application, room, user):
+        from channels.testing import WebsocketCommunicator
+
+        self.communicator = WebsocketCommunicator(application, f'/ws/video/{room}/')
+        self.communicator.scope['user'] = user
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=30)
+        return connected
+
+    async def send(self, text):
+        await self.communicator.send_to(text_data=text)
+
+    async def receive(self):
+        """Next text or bytes frame; None once the server closes"""
+        message = await self.communicator.receive_output(timeout=None)
+        if message['type'] == 'websocket.close':
+            return None
+        return message.get('text') or message.get('bytes')
+
+    async def close(self):
+        await self.communicator.disconnect(timeout=5)
+
+
+class SocketTransport:
+    """A real WebSocket to a running server, authenticated with a session cookie"""
+
+    def __init__(self, base_url, room, cookie):
+        self.url = f'{base_url}/ws/video/{room}/'
+        self.headers = {'Cookie': cookie, 'Origin': base_url.replace('ws://', 'http://')}
+        self.socket = None
+
+    async def connect(self):
+        try:
+            self.socket = await websocket_connect(self.url, additional_headers=self.headers, open_timeout=30)
+        except Exception:
+            return False
+        return True
+
+    async def send(self, text):
+        try:
+            await self.socket.send(text)
+        except ConnectionClosed:
+            pass  # closed by the server (e.g. `wait`); receive() reports it
+
+    async def receive(self):
+        try:
+            return await self.socket.recv()
+        except Exception:
+            return None
+
+    async def close(self):
+        await self.socket.close()
+
+
+class Participant:
+    """One simulated client following the page's signaling flow"""
+
+    def __init__(self, load, index, room, transport, draws):
+        self.load = load
+        self.user_id = str(load.users[index].pk)
+        self.room = room
+        self.transport = transport
+        self.draws = draws
+        self.join_sent = None
+        self.retry_after = None  # set when the server answers `wait`
+        self.tasks = set()
+
+    async def send(self, payload):
+        await self.transport.send(json.dumps(payload))
+        self.load.sent += 1
+
+    async def run(self, session_seconds):
+        """Stay for the session (or until the server closes); returns the `wait` retry hint, if any"""
+        if not await self.transport.connect():
+            self.load.errors['connect_failed'] += 1
+            return
+        self.load.connected += 1
+        self.load.peak = max(self.load.peak, self.load.connected)
+        reader = self.start(self.read())
+        try:
+            self.join_sent = time.perf_counter()
+            await self.send({'type': 'join', 'features': ['ice-batch'], 'media': {'audio': True, 'video': True}})
+            if self.draws:
+                self.start(self.draw())
+            await asyncio.wait([reader], timeout=session_seconds)
+        finally:
+            tasks = list(self.tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.load.connected -= 1
+            await self.transport.close()
+        return self.retry_after
+
+    def start(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def read(self):
+        while True:
+            frame = await self.transport.receive()
+            if frame is None:
+                return
+            self.load.received += 1
+            if isinstance(frame, bytes):
+                self.load.received_kinds['stroke-batch'] += 1
+                continue
+            message = json.loads(frame)
+            kind = message.get('type')
+            self.load.received_kinds[kind] += 1
+            now = time.perf_counter()
+
+            if kind == 'room-state':
+                self.load.record('join', now - self.join_sent)
+                for member in message['participants']:
+                    self.start(self.negotiate(member['userId'], 'offer'))
+            elif kind in ('offer', 'answer'):
+                self.load.record(kind, now - message[kind]['sentAt'])
+                if kind == 'offer':
+                    self.start(self.negotiate(message['sender'], 'answer'))
+            elif kind == 'ice-candidates':
+                for candidate in message['candidates']:
+                    self.load.record('ice', now - candidate['sentAt'])
+            elif kind == 'ice-candidate':
+                self.load.record('ice', now - message['candidate']['sentAt'])
+            elif kind == 'draw':
+                self.load.record('draw', now - message['data']['sentAt'])
+            elif kind == 'wait':
+                self.retry_after = message['retryAfter']
+
+    async def negotiate(self, target, kind):
+        """Send an offer or answer to one peer, then trickle ICE candidates to them"""
+        await self.send({
+            'type': kind,
+            'target': target,
+            kind: {'type': kind, 'sdp': FAKE_SDP, 'sentAt': time.perf_counter()},
+        })
+        for i in range(ICE_PER_NEGOTIATION):
+            await asyncio.sleep(ICE_INTERVAL)
+            await self.send({
+                'type': 'ice-candidate',
+                'target': target,
+                'candidate': {
+                    'candidate': f'candidate:{i} 1 udp 2122260223 192.0.2.{i} 5{i}000 typ host',
+                    'sdpMid': '0',
+                    'sdpMLineIndex': 0,
+                    'sentAt': time.perf_counter(),
+                },
+            })
+
+    async def draw(self):
+        interval = 1 / self.load.options['draw_rate']
+        x, y = random.random() * 800, random.random() * 600
+        while True:
+            await asyncio.sleep(interval)
+            points = [[x + i * 3, y + i * 2] for i in range(8)]
+            x, y = points[-1]
+            await self.send({
+                'type': 'draw',
+                'data': {'action': 'draw', 'tool': 'pen', 'color': '#000000', 'size': 3,
+                         'points': points, 'sentAt': time.perf_counter()},
+            })
+
+
+class Command(BaseCommand):
+    help = 'Load-test the video room signaling consumer and report relay latency, throughput and memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['communicator', 'daphne'], default='communicator')
+        parser.add_argument('--rooms', type=int, default=50)
+        parser.add_argument('--participants', type=int, default=1000, help='Simulated participants in total')
+        parser.add_argument('--ramp', type=float, default=200, help='New connections per second')
+        parser.add_argument('--session', type=float, default=10, help='Seconds each participant stays')
+        parser.add_argument('--drawers', type=float, default=0.1, help='Fraction of participants who draw')
+        parser.add_argument('--draw-rate', type=float, default=10, help='Draw messages/sec per drawer')
+        parser.add_argument('--port', type=int, default=8765, help='Port for the daphne server in daphne mode')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+
+    def handle(self, *args, **options):
+        if options['mode'] == 'daphne' and websocket_connect is None:
+            raise CommandError('daphne mode needs the websockets package')
+        self.options = options
+        random.seed(options['seed'])
+
+        test_settings = connection.settings_dict['TEST']
+        if options['mode'] == 'daphne' and connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+            # The server runs in another process, so the test database has to be a file
+            test_settings['NAME'] = os.path.join(tempfile.gettempdir(), f'crow-loadtest-{os.getpid()}.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(CHANNEL_LAYERS=self.channel_layers()):
+                result = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+
+        self.stdout.write(
+            f"{result['mode']}: {result['participants']} participants in {result['rooms']} rooms, "
+            f"peak {result['peak_connections']} connected, {result['seconds']:.1f}s"
+        )
+        self.stdout.write(
+            f"  {result['messages_sent']} sent, {result['messages_received']} received, "
+            f"{result['messages_per_sec']:.0f} received/s"
+        )
+        if result['memory_per_connection_kb'] is not None:
+            self.stdout.write(f"  memory per connection   {result['memory_per_connection_kb']:.1f} KiB")
+        self.stdout.write(f"  {'kind':<8} {'count':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for kind, stats in result['latency'].items():
+            if stats['count']:
+                self.stdout.write(
+                    f"  {kind:<8} {stats['count']:>8} {stats['p50_ms']:>8.2f} "
+                    f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}"
+                )
+        if result['errors']:
+            self.stdout.write(f"  errors: {result['errors']}")
+
+    def channel_layers(self):
+        """The configured layers, with a private socket for the Unix-socket backend"""
+        layers = json.loads(json.dumps(getattr(settings, 'CHANNEL_LAYERS', {})))
+        for layer in layers.values():
+            if layer.get('BACKEND', '').endswith('UnixSocketChannelLayer'):
+                layer.setdefault('CONFIG', {})['path'] = os.path.join(
+                    tempfile.gettempdir(), f'crow-loadtest-{os.getpid()}.sock'
+                )
+        return layers
+
+    def run(self, options):
+        self.users = User.objects.bulk_create(
+            User(username=f'loadtest-{i}') for i in range(options['participants'])
+        )
+        if connection.vendor == 'sqlite' and self.users[0].pk is None:
+            self.users = list(User.objects.filter(username__startswith='loadtest-').order_by('pk'))
+
+        server = None
+        if options['mode'] == 'daphne':
+            cookies = [self.create_session(user) for user in self.users]
+            connections.close_all()  # the forked server must open its own
+            server = get_context('fork').Process(target=serve_daphne, args=(options['port'],), daemon=True)
+            server.start()
+            self.wait_for_port(options['port'])
+            base_url = f"ws://127.0.0.1:{options['port']}"
+            make_transport = lambda index, room: SocketTransport(base_url, room, cookies[index])
+            memory_pid = server.pid
+        else:
+            from channels.routing import URLRouter
+            from crow_app.routing import websocket_urlpatterns
+
+            application = URLRouter(websocket_urlpatterns)
+            make_transport = lambda index, room: CommunicatorTransport(application, room, self.users[index])
+            memory_pid = 'self'
+
+        try:
+            # The consumer prints a line per message; keep that out of the report
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                return asyncio.run(self.run_load(options, make_transport, memory_pid))
+        finally:
+            if server is not None:
+                server.kill()
+                server.join()
+
+    def create_session(self, user):
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+    def wait_for_port(self, port, timeout=30):
+        import socket
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with contextlib.suppress(OSError), socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+            time.sleep(0.1)
+        raise CommandError(f'daphne did not start listening on port {port}')
+
+    async def run_load(self, options, make_transport, memory_pid):
+        self.sent = self.received = self.connected = self.peak = 0
+        self.errors = Counter()
+        self.received_kinds = Counter()
+        self.latencies = defaultdict(list)
+
+        baseline_kb = rss_kb(memory_pid)
+        peak_kb = baseline_kb
+        rooms = [f'loadtest-{i}' for i in range(options['rooms'])]
+        drawers = set(random.sample(range(options['participants']), int(options['participants'] * options['drawers'])))
+
+        async def sample_memory():
+            nonlocal peak_kb
+            while True:
+                await asyncio.sleep(0.5)
+                current = rss_kb(memory_pid)
+                if current is not None:
+                    peak_kb = max(peak_kb, current)
+
+        async def participant(index):
+            await asyncio.sleep(index / options['ramp'])
+            room = rooms[index % len(rooms)]
+            try:
+                while True:
+                    client = Participant(self, index, room, make_transport(index, room), index in drawers)
+                    retry_after = await client.run(options['session'])
+                    if retry_after is None:
+                        break
+                    await asyncio.sleep(retry_after)  # the room is admitting a join rush
+            except Exception as e:
+                self.errors[type(e).__name__] += 1
+
+        sampler = asyncio.ensure_future(sample_memory())
+        started = time.perf_counter()
+        await asyncio.gather(*(participant(index) for index in range(options['participants'])))
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+
+        memory_per_connection = None
+        if baseline_kb is not None and self.peak:
+            memory_per_connection = (peak_kb - baseline_kb) / self.peak
+
+        return {
+            'mode': options['mode'],
+            'started_at': timezone.now().isoformat(),
+            'versions': {'python': platform.python_version(), 'django': django.get_version()},
+            'config': {
+                name: options[name]
+                for name in ('rooms', 'participants', 'ramp', 'session', 'drawers', 'draw_rate', 'seed')
+            },
+            'rooms': options['rooms'],
+            'participants': options['participants'],
+            'peak_connections': self.peak,
+            'seconds': elapsed,
+            'messages_sent': self.sent,
+            'messages_received': self.received,
+            'messages_per_sec': self.received / elapsed,
+            'sent_per_sec': self.sent / elapsed,
+            'received_by_kind': dict(self.received_kinds),
+            'memory_per_connection_kb': memory_per_connection,
+            'latency': {
+                'all': percentiles([value for values in self.latencies.values() for value in values]),
+                **{kind: percentiles(values) for kind, values in sorted(self.latencies.items())},
+            },
+            'errors': dict(self.errors),
+        }
+
+    def record(self, kind, seconds):
+        self.latencies[kind].append(seconds * 1000)
@@ -0,0 +1,35 @@
+# crow_app/management/commands/rebuild_rollups.py
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from crow_app.management.options import parse_day
+from crow_app.rollups import METRICS, rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the dashboard DailyCounter/HourlyCounter rows for a date range '
+        'from the tracking tables and the retention archive'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day to rebuild, YYYY-MM-DD (default: --days before --end)')
+        parser.add_argument('--end', help='Last day to rebuild, YYYY-MM-DD (default today)')
+        parser.add_argument('--days', type=int, default=30, help='Days to rebuild when --start is not given')
+        parser.add_argument('--metric', choices=sorted(METRICS), action='append',
+                            help='Only rebuild this metric (repeatable)')
+
+    def handle(self, *args, **options):
+        end = parse_day(options['end']) if options['end'] else timezone.localdate()
+        start = parse_day(options['start']) if options['start'] else end - timedelta(days=options['days'] - 1)
+        if start > end:
+            raise CommandError('--start must not be after --end')
+
+        self.stdout.write(f"Rebuilding counters for {start} to {end}")
+        counted = rebuild(start, end + timedelta(days=1), options['metric'])
+        for name, rows in counted.items():
+            self.stdout.write(f"{name}: {rows} rows counted")
+        self.stdout.write(self.style.SUCCESS('Done'))
@@ -0,0 +1,25 @@
+# crow_app/management/commands/reconcile_user_stats.py
+#
+# Recomputes the UserStats rows behind the admin user pages from the
+# tracking tables and rewrites the ones that drifted. Run it from cron
+# (e.g. nightly) to repair any bump that failed; the rows of users who
+# existed before the table was added are filled by its migration.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crow_app.user_stats import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-user UserStats counts from the tables and fix the rows that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', help='Only reconcile this user id (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users counted per set of grouped queries')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        checked, written = reconcile(options['user'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} users, corrected {written} UserStats rows"))
@@ -0,0 +1,15 @@
+# crow_app/management/options.py - OPTION PARSING SHARED BY THE COMMANDS
+
+from django.core.management.base import CommandError
+from django.utils.dateparse import parse_date
+
+
+def parse_day(value):
+    """Date of a YYYY-MM-DD command option; raises CommandError"""
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise CommandError(f"Invalid date: {value} (expected YYYY-MM-DD)")
+    return day
@@ -1,48 +1,130 @@
 # crow_app/middleware.py - SESSION TRACKING MIDDLEWARE
 
+from asgiref.sync import sync_to_async
 from django.utils import timezone
 from django.utils.deprecation import MiddlewareMixin
-from .models import UserSession, OnlineUser, UserActivity
-import user_agents
+from .models import UserSession, UserActivity
+from .activity import arecord_activity, record_activity
+from .presence import get_presence_backend
+from .session_buffer import get_session_buffer, should_skip_path
+from .user_agent_cache import get_user_agent_id, parse_user_agent
+
+
+def parse_device_type(user_agent):
+    """Detect device type from a raw user agent string"""
+    return parse_user_agent(user_agent).device_type
+
+
+def parse_browser(user_agent):
+    """Detect browser from a raw user agent string"""
+    parsed = parse_user_agent(user_agent)
+    return f"{parsed.browser_family} {parsed.browser_version}"
+
+
+def _resolve_user(request):
+    request.user.is_authenticated  # forces the lazy session/user lookup
+    return request.user
+
+
+def get_client_ip(request):
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0]
+    return request.META.get('REMOTE_ADDR')
+
+
+def track_session(user, session_key, request):
+    """Write a session touch straight to the database, creating the row on first sight"""
+    user_agent = request.META.get('HTTP_USER_AGENT', '')
+    user_session, created = UserSession.objects.get_or_create(
+        user=user,
+        session_key=session_key,
+        defaults={
+            'ip_address': get_client_ip(request),
+            'user_agent_id': get_user_agent_id(user_agent),
+            'device_type': parse_device_type(user_agent),
+            'browser': parse_browser(user_agent),
+        }
+    )
+    
+    # Update last activity
+    if not created:
+        user_session.last_activity = timezone.now()
+        user_session.save(update_fields=['last_activity'])
+
+
+async def aget_request_user(request):
+    """Resolve request.user without blocking the event loop where Django allows it"""
+    if hasattr(request, 'auser'):
+        return await request.auser()
+    # Django < 5.0 has no async user lookup: resolve the lazy user in one hop
+    return await sync_to_async(_resolve_user)(request)
+
 
 class SessionTrackingMiddleware(MiddlewareMixin):
     """
     Middleware to track user sessions automatically
+    
+    With SESSION_TRACKING['WRITE_BEHIND'] enabled, session touches are
+    coalesced in memory and flushed in bulk instead of being written on
+    every request. The session row itself is written at login (see
+    views.on_user_login), so only last_activity waits for the flush.
+    Online status never touches the database.
+    
+    Under ASGI, __acall__ does the tracking on the event loop instead of
+    going through MiddlewareMixin's sync_to_async thread hop; presence and
+    buffered session touches never block (see crow_app/presence.py). On
+    Django < 5.0 resolving request.user still costs one hop, so the two
+    paths measure about the same there (manage.py bench_tracking_middleware).
     """
     
     def process_request(self, request):
         """Track every request"""
         
-        if request.user.is_authenticated:
+        if not should_skip_path(request.path) and request.user.is_authenticated:
+            # Update online status (in memory, see crow_app/presence.py)
+            get_presence_backend().touch(request.user.id, request.user.username, request.path)
+            
             # Get or create session
             session_key = request.session.session_key
             
-            if session_key:
-                # Update or create user session
-                user_session, created = UserSession.objects.get_or_create(
-                    user=request.user,
-                    session_key=session_key,
-                    defaults={
-                        'ip_address': self.get_client_ip(request),
-                        'user_agent': request.META.get('HTTP_USER_AGENT', ''),
-                        'device_type': self.get_device_type(request),
-                        'browser': self.get_browser(request),
-                    }
-                )
+            buffer = get_session_buffer()
+            if session_key and buffer is not None:
+                self.buffer_session(buffer, request.user, session_key, request)
+            elif session_key:
+                self.update_session(request.user, session_key, request)
+    
+    async def __acall__(self, request):
+        """Async path used when the middleware chain runs under ASGI"""
+        
+        if not should_skip_path(request.path):
+            user = await aget_request_user(request)
+            
+            if user.is_authenticated:
+                get_presence_backend().touch(user.id, user.username, request.path)
                 
-                # Update last activity
-                if not created:
-                    user_session.last_activity = timezone.now()
-                    user_session.save(update_fields=['last_activity'])
+                session_key = request.session.session_key
                 
-                # Update online status
-                online_user, _ = OnlineUser.objects.update_or_create(
-                    user=request.user,
-                    defaults={
-                        'current_page': request.path,
-                        'last_seen': timezone.now()
-                    }
-                )
+                buffer = get_session_buffer()
+                if session_key and buffer is not None:
+                    self.buffer_session(buffer, user, session_key, request)
+                elif session_key:
+                    await sync_to_async(self.update_session)(user, session_key, request)
+        
+        return await self.get_response(request)
+    
+    def buffer_session(self, buffer, user, session_key, request):
+        """Queue a session touch for the next bulk flush (no database access)"""
+        buffer.touch(
+            user.id,
+            session_key,
+            ip_address=self.get_client_ip(request),
+            user_agent=request.META.get('HTTP_USER_AGENT', ''),
+        )
+    
+    def update_session(self, user, session_key, request):
+        """Write the session touch straight to the database"""
+        track_session(user, session_key, request)
     
     def get_client_ip(self, request):
         """Get user's IP address"""
@@ -55,23 +137,11 @@ class SessionTrackingMiddleware(MiddlewareMixin):
     
     def get_device_type(self, request):
         """Detect device type"""
-        user_agent = request.META.get('HTTP_USER_AGENT', '')
-        ua = user_agents.parse(user_agent)
-        
-        if ua.is_mobile:
-            return 'Mobile'
-        elif ua.is_tablet:
-            return 'Tablet'
-        elif ua.is_pc:
-            return 'Desktop'
-        else:
-            return 'Unknown'
+        return parse_device_type(request.META.get('HTTP_USER_AGENT', ''))
     
     def get_browser(self, request):
         """Detect browser"""
-        user_agent = request.META.get('HTTP_USER_AGENT', '')
-        ua = user_agents.parse(user_agent)
-        return f"{ua.browser.family} {ua.browser.version_string}"
+        return parse_browser(request.META.get('HTTP_USER_AGENT', ''))
 
 
 class ActivityTrackingMiddleware(MiddlewareMixin):
@@ -82,48 +152,55 @@ class ActivityTrackingMiddleware(MiddlewareMixin):
     def process_response(self, request, response):
         """Log activities based on the view accessed"""
         
-        if request.user.is_authenticated and response.status_code == 200:
+        if response.status_code == 200 and request.method == 'POST' and request.user.is_authenticated:
             # Only track successful requests
-            
-            # Track specific activities based on URL patterns
-            if request.method == 'POST':
-                path = request.path
-                
-                # Login
-                if 'login' in path:
-                    self.log_activity(request.user, 'login', 'User logged in', request)
-                
-                # Meeting actions
-                elif 'meeting' in path or 'room' in path:
-                    if 'create' in path:
-                        self.log_activity(request.user, 'meeting_created', 'Created a meeting', request)
-                
-                # Team actions
-                elif 'class' in path or 'team' in path:
-                    if 'create' in path:
-                        self.log_activity(request.user, 'team_created', 'Created a team', request)
-                    elif 'join' in path:
-                        self.log_activity(request.user, 'team_joined', 'Joined a team', request)
-                
-                # Settings
-                elif 'settings' in path:
-                    self.log_activity(request.user, 'settings_updated', 'Updated settings', request)
+            activity = self.get_activity(request.path)
+            if activity:
+                self.log_activity(request.user, *activity, request)
         
         return response
     
+    async def __acall__(self, request):
+        """Async path used when the middleware chain runs under ASGI"""
+        response = await self.get_response(request)
+        
+        if response.status_code == 200 and request.method == 'POST':
+            activity = self.get_activity(request.path)
+            if activity:
+                user = await aget_request_user(request)
+                if user.is_authenticated:
+                    await arecord_activity(user, *activity, request=request)
+        
+        return response
+    
+    def get_activity(self, path):
+        """Map a POST path to (activity_type, description), or None"""
+        
+        # Login
+        if 'login' in path:
+            return 'login', 'User logged in'
+        
+        # Meeting actions
+        elif 'meeting' in path or 'room' in path:
+            if 'create' in path:
+                return 'meeting_created', 'Created a meeting'
+        
+        # Team actions
+        elif 'class' in path or 'team' in path:
+            if 'create' in path:
+                return 'team_created', 'Created a team'
+            elif 'join' in path:
+                return 'team_joined', 'Joined a team'
+        
+        # Settings
+        elif 'settings' in path:
+            return 'settings_updated', 'Updated settings'
+        
+        return None
+    
     def log_activity(self, user, activity_type, description, request):
         """Helper to log activity"""
-        try:
-            UserActivity.objects.create(
-                user=user,
-                activity_type=activity_type,
-                description=description,
-                ip_address=self.get_client_ip(request),
-                user_agent=request.META.get('HTTP_USER_AGENT', '')
-            )
-        except Exception as e:
-            # Don't break the request if activity logging fails
-            print(f"Failed to log activity: {e}")
+        record_activity(user, activity_type, description, request=request)
     
     def get_client_ip(self, request):
         """Get user's IP address"""
@@ -0,0 +1,81 @@
+# Generated by Django 4.2 on 2026-10-17 06:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def intern_user_agents(apps, schema_editor):
+    """Move raw user agent strings into the UserAgent dimension table"""
+    from crow_app.user_agent_cache import hash_user_agent, parse_user_agent
+
+    UserAgent = apps.get_model('crow_app', 'UserAgent')
+    UserSession = apps.get_model('crow_app', 'UserSession')
+    UserActivity = apps.get_model('crow_app', 'UserActivity')
+
+    raw_values = set(UserSession.objects.exclude(user_agent='').values_list('user_agent', flat=True).distinct())
+    raw_values |= set(UserActivity.objects.exclude(user_agent='').values_list('user_agent', flat=True).distinct())
+
+    for raw in raw_values:
+        parsed = parse_user_agent(raw)
+        agent, _ = UserAgent.objects.get_or_create(
+            ua_hash=hash_user_agent(raw),
+            defaults={
+                'raw': raw,
+                'device_type': parsed.device_type,
+                'browser_family': parsed.browser_family,
+                'browser_version': parsed.browser_version,
+            }
+        )
+        UserSession.objects.filter(user_agent=raw).update(agent=agent)
+        UserActivity.objects.filter(user_agent=raw).update(agent=agent)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crow_app', '0004_sitestatistics_adminrole'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ua_hash', models.CharField(max_length=40, unique=True)),
+                ('raw', models.TextField()),
+                ('device_type', models.CharField(blank=True, max_length=50)),
+                ('browser_family', models.CharField(blank=True, max_length=50)),
+                ('browser_version', models.CharField(blank=True, max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='usersession',
+            name='agent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sessions', to='crow_app.useragent'),
+        ),
+        migrations.AddField(
+            model_name='useractivity',
+            name='agent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='activities', to='crow_app.useragent'),
+        ),
+        migrations.RunPython(intern_user_agents, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='usersession',
+            name='user_agent',
+        ),
+        migrations.RemoveField(
+            model_name='useractivity',
+            name='user_agent',
+        ),
+        migrations.RenameField(
+            model_name='usersession',
+            old_name='agent',
+            new_name='user_agent',
+        ),
+        migrations.RenameField(
+            model_name='useractivity',
+            old_name='agent',
+            new_name='user_agent',
+        ),
+    ]
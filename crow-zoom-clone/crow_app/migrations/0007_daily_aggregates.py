@@ -0,0 +1,44 @@
+# Generated by Django 4.2 on 2026-10-17 05:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('crow_app', '0006_useractivity_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionDailyAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('session_count', models.IntegerField(default=0)),
+                ('total_seconds', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='session_aggregates', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-date'],
+                'unique_together': {('date', 'user')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ActivityDailyAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('activity_type', models.CharField(max_length=50)),
+                ('count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_aggregates', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-date'],
+                'unique_together': {('date', 'user', 'activity_type')},
+            },
+        ),
+    ]
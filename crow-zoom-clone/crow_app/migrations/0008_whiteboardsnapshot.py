@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2026-10-17 06:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crow_app', '0007_daily_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WhiteboardSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room_key', models.CharField(max_length=100, unique=True)),
+                ('data', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
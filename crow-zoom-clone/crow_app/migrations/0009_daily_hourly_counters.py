@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-17 06:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crow_app', '0008_whiteboardsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlyCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('metric', models.CharField(max_length=50)),
+                ('dimension', models.CharField(blank=True, max_length=100)),
+                ('count', models.BigIntegerField(default=0)),
+                ('total', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-hour'],
+                'unique_together': {('metric', 'hour', 'dimension')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('metric', models.CharField(max_length=50)),
+                ('dimension', models.CharField(blank=True, max_length=100)),
+                ('count', models.BigIntegerField(default=0)),
+                ('total', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-date'],
+                'unique_together': {('metric', 'date', 'dimension')},
+            },
+        ),
+    ]
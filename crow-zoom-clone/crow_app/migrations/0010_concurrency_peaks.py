@@ -0,0 +1,26 @@
+# Generated by Django 4.2 on 2026-10-17 06:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crow_app', '0009_daily_hourly_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConcurrencyPeak',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('users', 'Signed-in users'), ('meetings', 'Users in meetings')], max_length=20)),
+                ('hour', models.DateTimeField()),
+                ('peak', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-hour'],
+                'unique_together': {('kind', 'hour')},
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2 on 2026-10-17 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crow_app', '0010_concurrency_peaks'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='meeting',
+            index=models.Index(fields=['created_at'], name='meeting_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='meetingsession',
+            index=models.Index(fields=['user', 'joined_at'], name='msession_user_joined_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='meetingsession',
+            index=models.Index(fields=['left_at'], name='msession_left_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='onlineuser',
+            index=models.Index(condition=models.Q(('is_in_meeting', True)), fields=['last_seen'], name='onlineuser_in_meeting_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['activity_type', 'timestamp'], name='activity_type_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['user', 'timestamp'], name='activity_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['timestamp'], name='activity_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['user', 'login_time'], name='session_user_login_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['login_time'], name='session_login_idx'),
+        ),
+    ]
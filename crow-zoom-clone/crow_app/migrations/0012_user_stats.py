@@ -0,0 +1,64 @@
+# Generated by Django 4.2 on 2026-10-17 06:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_user_stats(apps, schema_editor):
+    """
+    Count existing users' rows into UserStats, as reconcile_user_stats
+    does; with historical models, since the live ones may have moved on
+    """
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    UserStats = apps.get_model('crow_app', 'UserStats')
+    counted = {
+        'session_count': [('UserSession', None), ('SessionDailyAggregate', 'session_count')],
+        'meeting_count': [('MeetingSession', None)],
+        'team_count': [('ClassMembership', None)],
+        'contact_count': [('Contact', None)],
+        'activity_count': [('UserActivity', None), ('ActivityDailyAggregate', 'count')],
+    }
+
+    values = {user_id: {} for user_id in User.objects.values_list('pk', flat=True)}
+    for field, sources in counted.items():
+        for model_name, summed in sources:
+            model = apps.get_model('crow_app', model_name)
+            total = models.Sum(summed) if summed else models.Count('pk')
+            for user_id, count in model.objects.values_list('user_id').annotate(total).order_by():
+                values[user_id][field] = values[user_id].get(field, 0) + (count or 0)
+    UserSession = apps.get_model('crow_app', 'UserSession')
+    for user_id, at in UserSession.objects.values_list('user_id').annotate(models.Max('last_activity')).order_by():
+        values[user_id]['last_seen'] = at
+
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=user_id, **fields) for user_id, fields in values.items()], batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('crow_app', '0011_analytics_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_count', models.IntegerField(default=0)),
+                ('meeting_count', models.IntegerField(default=0)),
+                ('team_count', models.IntegerField(default=0)),
+                ('contact_count', models.IntegerField(default=0)),
+                ('activity_count', models.IntegerField(default=0)),
+                ('last_seen', models.DateTimeField(blank=True, null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'User Stats',
+            },
+        ),
+        migrations.RunPython(fill_user_stats, migrations.RunPython.noop),
+    ]
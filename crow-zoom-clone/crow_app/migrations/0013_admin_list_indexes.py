@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-17 06:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('crow_app', '0012_user_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userclass',
+            index=models.Index(fields=['created_at'], name='userclass_created_idx'),
+        ),
+        # auth_user is not ours to add Meta indexes to; the admin users list
+        # is ordered (and keyset-paginated) by date_joined
+        migrations.RunSQL(
+            'CREATE INDEX crow_auth_user_joined_idx ON auth_user (date_joined, id)',
+            reverse_sql='DROP INDEX crow_auth_user_joined_idx',
+        ),
+    ]
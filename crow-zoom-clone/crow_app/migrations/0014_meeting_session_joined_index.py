@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-17 07:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crow_app', '0013_admin_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='meetingsession',
+            index=models.Index(fields=['joined_at'], name='msession_joined_idx'),
+        ),
+    ]
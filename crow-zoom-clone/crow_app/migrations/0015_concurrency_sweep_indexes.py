@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-17 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crow_app', '0014_meeting_session_joined_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='meetingsession',
+            name='msession_left_idx',
+        ),
+        migrations.AddIndex(
+            model_name='meetingsession',
+            index=models.Index(fields=['left_at', 'joined_at'], name='msession_left_joined_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['logout_time', 'last_activity'], name='session_end_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2 on 2026-10-17 08:05
+
+from datetime import timedelta
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def fill_rollups(apps, schema_editor):
+    """
+    Count the history written before 0009 added the counter tables
+
+    rebuild() reads the live models and the retention archive, so this
+    runs after the migrations that last changed the tables it counts.
+    """
+    from crow_app import rollups
+
+    start = rollups.history_start()
+    if start is not None:
+        rollups.rebuild(start, timezone.localdate() + timedelta(days=1))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crow_app', '0015_concurrency_sweep_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -29,6 +29,9 @@ class UserClass(models.Model):
     
     class Meta:
         verbose_name_plural = "User Classes"
+        indexes = [
+            models.Index(fields=['created_at'], name='userclass_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.code} - {self.name}"
@@ -63,6 +66,12 @@ class Meeting(models.Model):
     participants = models.ManyToManyField(User, through='MeetingParticipant')
     allowed_classes = models.ManyToManyField(UserClass, blank=True, related_name='meetings')
     restrict_to_classes = models.BooleanField(default=False) 
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='meeting_created_idx'),
+        ]
+    
     def __str__(self):
         return self.title
 
@@ -115,12 +124,48 @@ class MeetingRoom(models.Model):
     
     def __str__(self):
         return f"{self.name} (Host: {self.host.username})"
+
+
+class WhiteboardSnapshot(models.Model):
+    """
+    Drawing history of a video room saved when its last peer leaves,
+    as one stroke-batch frame (see crow_app/strokes.py)
+    """
+    room_key = models.CharField(max_length=100, unique=True)  # WebSocket room_id
+    data = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Whiteboard for {self.room_key}"
+
+
+class UserAgent(models.Model):
+    """
+    Interned user agent strings, parsed once and shared by
+    sessions and activities (see crow_app/user_agent_cache.py)
+    """
+    ua_hash = models.CharField(max_length=40, unique=True)  # sha1 of the raw string
+    raw = models.TextField()
+    device_type = models.CharField(max_length=50, blank=True)  # Desktop, Mobile, Tablet
+    browser_family = models.CharField(max_length=50, blank=True)
+    browser_version = models.CharField(max_length=50, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.browser
+    
+    @property
+    def browser(self):
+        """Browser label in the same format as UserSession.browser"""
+        return f"{self.browser_family} {self.browser_version}"
+
+
 class UserSession(models.Model):
     """Track user login sessions"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sessions')
     session_key = models.CharField(max_length=40, unique=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
-    user_agent = models.TextField(blank=True)
+    user_agent = models.ForeignKey(UserAgent, null=True, blank=True, on_delete=models.SET_NULL, related_name='sessions')
     device_type = models.CharField(max_length=50, blank=True)  # Desktop, Mobile, Tablet
     browser = models.CharField(max_length=50, blank=True)
     location = models.CharField(max_length=200, blank=True)  # City, Country
@@ -133,6 +178,11 @@ class UserSession(models.Model):
     
     class Meta:
         ordering = ['-login_time']
+        indexes = [
+            models.Index(fields=['user', 'login_time'], name='session_user_login_idx'),
+            models.Index(fields=['login_time'], name='session_login_idx'),
+            models.Index(fields=['logout_time', 'last_activity'], name='session_end_idx'),  # concurrency sweeps
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.login_time.strftime('%Y-%m-%d %H:%M')}"
@@ -177,6 +227,11 @@ class MeetingSession(models.Model):
     
     class Meta:
         ordering = ['-joined_at']
+        indexes = [
+            models.Index(fields=['user', 'joined_at'], name='msession_user_joined_idx'),
+            models.Index(fields=['left_at', 'joined_at'], name='msession_left_joined_idx'),  # also open sessions by join time
+            models.Index(fields=['joined_at'], name='msession_joined_idx'),  # range exports
+        ]
     
     def __str__(self):
         return f"{self.user.username} in {self.meeting.title}"
@@ -217,19 +272,27 @@ class UserActivity(models.Model):
     
     # Metadata
     ip_address = models.GenericIPAddressField(null=True, blank=True)
-    user_agent = models.TextField(blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    user_agent = models.ForeignKey(UserAgent, null=True, blank=True, on_delete=models.SET_NULL, related_name='activities')
+    timestamp = models.DateTimeField(default=timezone.now)  # set at record time, rows may be written later
     
     class Meta:
         ordering = ['-timestamp']
         verbose_name_plural = "User Activities"
+        indexes = [
+            models.Index(fields=['activity_type', 'timestamp'], name='activity_type_time_idx'),
+            models.Index(fields=['user', 'timestamp'], name='activity_user_time_idx'),
+            models.Index(fields=['timestamp'], name='activity_time_idx'),  # recent activity, retention
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.activity_type} at {self.timestamp}"
 
 
 class OnlineUser(models.Model):
-    """Track currently online users (real-time presence)"""
+    """
+    Persisted meeting presence; only written when a user joins or leaves a
+    meeting. Per-request online status lives in crow_app/presence.py
+    """
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='online_status')
     last_seen = models.DateTimeField(auto_now=True)
     current_page = models.CharField(max_length=200, blank=True)
@@ -239,25 +302,39 @@ class OnlineUser(models.Model):
     class Meta:
         verbose_name = "Online User"
         verbose_name_plural = "Online Users"
+        indexes = [
+            # Partial: only the few rows of users currently in a meeting
+            models.Index(fields=['last_seen'], condition=models.Q(is_in_meeting=True), name='onlineuser_in_meeting_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - Last seen: {self.last_seen}"
     
     def is_online(self):
-        """User is online if last_seen within 2 minutes"""
-        return (timezone.now() - self.last_seen) < timedelta(minutes=2)
+        """User is online if the presence registry saw them within its timeout (2 minutes)"""
+        from .presence import get_presence_backend
+        return get_presence_backend().is_online(self.user_id)
     
     @staticmethod
     def get_online_count():
-        """Get count of currently online users"""
-        threshold = timezone.now() - timedelta(minutes=2)
-        return OnlineUser.objects.filter(last_seen__gte=threshold).count()
+        """Get count of currently online users (from the presence registry)"""
+        from .presence import get_presence_backend
+        return get_presence_backend().get_online_count()
     
     @staticmethod
     def get_online_users():
-        """Get list of currently online users"""
-        threshold = timezone.now() - timedelta(minutes=2)
-        return OnlineUser.objects.filter(last_seen__gte=threshold).select_related('user')
+        """
+        Get the OnlineUser rows of currently online users. Only users who
+        have joined a meeting have a row; get_online_entries() lists everyone
+        """
+        user_ids = [entry.user_id for entry in OnlineUser.get_online_entries()]
+        return OnlineUser.objects.filter(user_id__in=user_ids).select_related('user')
+    
+    @staticmethod
+    def get_online_entries():
+        """Get list of currently online users (PresenceEntry tuples, no DB access)"""
+        from .presence import get_presence_backend
+        return get_presence_backend().get_online_users()
 class AdminRole(models.Model):
     """
     Extended permissions for admin users
@@ -348,58 +425,126 @@ class SiteStatistics(models.Model):
     
     @classmethod
     def generate_today_stats(cls):
-        """Generate statistics for today"""
-        from django.contrib.auth.models import User
-        from datetime import timedelta
+        """Generate statistics for today (see crow_app/site_stats.py)"""
+        from .site_stats import generate
         
         today = timezone.now().date()
-        yesterday = today - timedelta(days=1)
-        
-        # User stats
-        total_users = User.objects.count()
-        new_users_today = User.objects.filter(date_joined__date=today).count()
-        active_users_today = UserSession.objects.filter(
-            login_time__date=today
-        ).values('user').distinct().count()
-        
-        # Meeting stats
-        total_meetings = Meeting.objects.count()
-        meetings_today = Meeting.objects.filter(created_at__date=today).count()
-        total_meeting_minutes = MeetingSession.objects.filter(
-            left_at__isnull=False
-        ).aggregate(
-            total=models.Sum(
-                models.F('left_at') - models.F('joined_at')
-            )
-        )['total'] or timedelta(0)
-        
-        # Team stats
-        total_teams = UserClass.objects.count()
-        teams_created_today = UserClass.objects.filter(created_at__date=today).count()
-        
-        # Activity stats
-        total_logins_today = UserActivity.objects.filter(
-            activity_type='login',
-            timestamp__date=today
-        ).count()
-        
-        # Create or update stats
-        stats, created = cls.objects.update_or_create(
-            date=today,
-            defaults={
-                'total_users': total_users,
-                'new_users_today': new_users_today,
-                'active_users_today': active_users_today,
-                'total_meetings': total_meetings,
-                'meetings_today': meetings_today,
-                'total_meeting_minutes': int(total_meeting_minutes.total_seconds() // 60),
-                'total_teams': total_teams,
-                'teams_created_today': teams_created_today,
-                'total_logins_today': total_logins_today,
-            }
-        )
-        
-        return stats
+        generate(today, today + timedelta(days=1))
+        return cls.objects.get(date=today)
+
+
+class ActivityDailyAggregate(models.Model):
+    """
+    Per-user daily activity counts kept after raw UserActivity rows are
+    archived (see crow_app/retention.py)
+    """
+    date = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='activity_aggregates')
+    activity_type = models.CharField(max_length=50)
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['date', 'user', 'activity_type']
+        ordering = ['-date']
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.activity_type} x{self.count} on {self.date}"
+
+
+class SessionDailyAggregate(models.Model):
+    """
+    Per-user daily session totals kept after raw UserSession rows are
+    archived (see crow_app/retention.py)
+    """
+    date = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='session_aggregates')
+    session_count = models.IntegerField(default=0)
+    total_seconds = models.BigIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['date', 'user']
+        ordering = ['-date']
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.session_count} sessions on {self.date}"
+
+
+class DailyCounter(models.Model):
+    """
+    Per-day total of one dashboard metric for one dimension value (an
+    activity type, device, browser, host...), kept up to date as rows are
+    written (see crow_app/rollups.py)
+    """
+    date = models.DateField()
+    metric = models.CharField(max_length=50)
+    dimension = models.CharField(max_length=100, blank=True)
+    count = models.BigIntegerField(default=0)
+    total = models.BigIntegerField(default=0)  # summed quantity, e.g. seconds
+    
+    class Meta:
+        unique_together = ['metric', 'date', 'dimension']  # metric first: reads are one metric over a range
+        ordering = ['-date']
+    
+    def __str__(self):
+        return f"{self.metric}[{self.dimension}] x{self.count} on {self.date}"
+
+
+class HourlyCounter(models.Model):
+    """Same as DailyCounter, per hour (`hour` is the start of the hour)"""
+    hour = models.DateTimeField()
+    metric = models.CharField(max_length=50)
+    dimension = models.CharField(max_length=100, blank=True)
+    count = models.BigIntegerField(default=0)
+    total = models.BigIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['metric', 'hour', 'dimension']
+        ordering = ['-hour']
+    
+    def __str__(self):
+        return f"{self.metric}[{self.dimension}] x{self.count} at {self.hour:%Y-%m-%d %H:00}"
+
+
+class ConcurrencyPeak(models.Model):
+    """
+    Most users signed in ('users') or in meetings ('meetings') at once
+    during one hour (see crow_app/concurrency.py)
+    """
+    KIND_CHOICES = [
+        ('users', 'Signed-in users'),
+        ('meetings', 'Users in meetings'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    hour = models.DateTimeField()
+    peak = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['kind', 'hour']
+        ordering = ['-hour']
+
+    def __str__(self):
+        return f"{self.kind} peak {self.peak} at {self.hour:%Y-%m-%d %H:00}"
+
+
+class UserStats(models.Model):
+    """
+    Per-user counts for the admin user pages, kept up to date as rows are
+    written (see crow_app/user_stats.py)
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='stats')
+    session_count = models.IntegerField(default=0)   # including archived sessions
+    meeting_count = models.IntegerField(default=0)   # meeting sessions
+    team_count = models.IntegerField(default=0)
+    contact_count = models.IntegerField(default=0)
+    activity_count = models.IntegerField(default=0)  # including archived activities
+    last_seen = models.DateTimeField(null=True, blank=True)  # latest session activity
+
+    class Meta:
+        verbose_name_plural = "User Stats"
+
+    def __str__(self):
+        return f"Stats for {self.user.username}"
 
 
 # Helper function to check if user is admin
@@ -0,0 +1,104 @@
+# crow_app/outbox.py - PER-CONNECTION SEND QUEUES
+#
+# VideoCallConsumer's channel-layer handlers put outgoing frames here
+# instead of awaiting the socket write themselves, and one writer task per
+# connection drains the queue. A participant whose socket drains slowly
+# then only backs up their own queue, not their consumer's handling of
+# channel-layer events (and with it the channel capacity every sender to
+# them shares).
+#
+#   signaling  offers, answers, ICE, roster and room state; never dropped,
+#              sent before any queued drawing. A client too far behind on
+#              these is disconnected by the consumer instead.
+#   drawing    JSON draw frames and binary stroke batches; bounded. When
+#              full, queued stroke batches are merged into one frame and
+#              otherwise the oldest droppable frame is discarded. A clear
+#              supersedes everything queued before it.
+
+import asyncio
+import time
+from collections import deque
+
+from .strokes import MAX_POINTS, MAX_STROKES, StrokeBatch, decode_stroke_batch
+
+
+class SendQueue:
+    """
+    Outgoing frames for one WebSocket
+
+    Items are (queued_at, text_data, bytes_data, droppable). `stats` (a
+    Counter, usually the room's) gets the drops, merges and peak depth.
+    """
+
+    def __init__(self, max_signaling, max_drawing, stats):
+        self.max_signaling = max_signaling
+        self.max_drawing = max_drawing
+        self.stats = stats
+        self.signaling = deque()
+        self.drawing = deque()
+        self.ready = asyncio.Event()
+
+    def __len__(self):
+        return len(self.signaling) + len(self.drawing)
+
+    def put(self, text_data=None, bytes_data=None):
+        """Queue a signaling frame; False when the client is too far behind to keep"""
+        if len(self.signaling) >= self.max_signaling:
+            return False
+        self.signaling.append((time.monotonic(), text_data, bytes_data, False))
+        self.queued()
+        return True
+
+    def put_drawing(self, text_data=None, bytes_data=None, clear=False, droppable=True):
+        if clear:
+            self.stats['draw_dropped'] += sum(1 for item in self.drawing if item[3])
+            self.drawing = deque(item for item in self.drawing if not item[3])
+            droppable = False
+        elif len(self.drawing) >= self.max_drawing and not self.coalesce_strokes():
+            for index, item in enumerate(self.drawing):
+                if item[3]:
+                    del self.drawing[index]
+                    self.stats['draw_dropped'] += 1
+                    break
+        self.drawing.append((time.monotonic(), text_data, bytes_data, droppable))
+        self.queued()
+
+    def coalesce_strokes(self):
+        """Merge the queued droppable stroke batches into one frame; True if that freed space"""
+        indexes = [
+            index for index, item in enumerate(self.drawing)
+            if item[3] and item[2] is not None
+        ]
+        if len(indexes) < 2:
+            return False
+
+        batch = StrokeBatch()
+        for index in indexes:
+            batch.add(*decode_stroke_batch(self.drawing[index][2]))
+        if len(batch.strokes) > MAX_STROKES or any(len(points) > MAX_POINTS for _, points in batch.strokes):
+            return False
+
+        # The merged frame takes the place of the first one it replaces
+        items = list(self.drawing)
+        items[indexes[0]] = (items[indexes[0]][0], None, batch.encode(), True)
+        for index in reversed(indexes[1:]):
+            del items[index]
+        self.drawing = deque(items)
+        self.stats['draw_coalesced'] += len(indexes) - 1
+        return True
+
+    def queued(self):
+        self.stats['send_queue_peak'] = max(self.stats['send_queue_peak'], len(self))
+        self.ready.set()
+
+    def oldest_signal_age(self):
+        """Seconds the oldest queued signaling frame has waited"""
+        return time.monotonic() - self.signaling[0][0] if self.signaling else 0
+
+    async def get(self):
+        """Next (text_data, bytes_data) to write, signaling first"""
+        while not self.signaling and not self.drawing:
+            self.ready.clear()
+            await self.ready.wait()
+        _, text_data, bytes_data, _ = (self.signaling or self.drawing).popleft()
+        return text_data, bytes_data
@@ -0,0 +1,335 @@
+# crow_app/presence.py - IN-MEMORY PRESENCE REGISTRY
+
+import fcntl
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+PresenceEntry = namedtuple('PresenceEntry', [
+    'user_id', 'username', 'last_seen', 'current_page', 'is_in_meeting', 'current_meeting_id',
+])
+
+DEFAULT_TIMEOUT = 120  # seconds a user stays online after their last touch
+
+
+class BasePresenceBackend:
+    """
+    Interface shared by presence backends
+
+    A user is online while their last touch is younger than `timeout`
+    seconds. Nothing here touches the database.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, **options):
+        self.timeout = timeout
+
+    def touch(self, user_id, username, current_page=''):
+        raise NotImplementedError
+
+    def set_meeting(self, user_id, username, meeting_id):
+        """Mark a user as in a meeting, or out of any meeting when meeting_id is None"""
+        raise NotImplementedError
+
+    def remove(self, user_id):
+        raise NotImplementedError
+
+    def get_online_count(self):
+        raise NotImplementedError
+
+    def is_online(self, user_id):
+        raise NotImplementedError
+
+    def get_online_users(self):
+        """List of PresenceEntry, most recently seen first"""
+        raise NotImplementedError
+
+
+class LocalPresenceBackend(BasePresenceBackend):
+    """
+    Process-local registry
+
+    Only right for a single worker process: each process sees just the
+    users it served. UnixSocketPresenceBackend (the default) serves one of
+    these to every worker on the host.
+
+    Entries live in an OrderedDict kept in last_seen order: every touch
+    moves the user to the end, so expired users are always at the front
+    and expiry, count and touch are all O(1) amortized.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, **options):
+        super().__init__(timeout)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def touch(self, user_id, username, current_page='', now=None):
+        now = now or time.time()
+        with self._lock:
+            entry = self._entries.pop(user_id, None) or {
+                'is_in_meeting': False,
+                'current_meeting_id': None,
+            }
+            entry.update(username=username, current_page=current_page[:200], last_seen=now)
+            self._entries[user_id] = entry
+
+    def set_meeting(self, user_id, username, meeting_id, now=None):
+        now = now or time.time()
+        with self._lock:
+            entry = self._entries.pop(user_id, None) or {'current_page': ''}
+            entry.update(
+                username=username,
+                last_seen=now,
+                is_in_meeting=meeting_id is not None,
+                current_meeting_id=meeting_id,
+            )
+            self._entries[user_id] = entry
+
+    def remove(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def get_online_count(self):
+        with self._lock:
+            self._expire()
+            return len(self._entries)
+
+    def is_online(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            return entry is not None and entry['last_seen'] >= time.time() - self.timeout
+
+    def get_online_users(self):
+        with self._lock:
+            self._expire()
+            return [
+                PresenceEntry(
+                    user_id=user_id,
+                    username=entry['username'],
+                    last_seen=datetime.fromtimestamp(entry['last_seen'], tz=dt_timezone.utc),
+                    current_page=entry['current_page'],
+                    is_in_meeting=entry['is_in_meeting'],
+                    current_meeting_id=entry['current_meeting_id'],
+                )
+                for user_id, entry in reversed(self._entries.items())
+            ]
+
+    def _expire(self):
+        threshold = time.time() - self.timeout
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if oldest['last_seen'] >= threshold:
+                break
+            self._entries.popitem(last=False)
+
+
+# ─── Shared registry over a Unix domain socket ────────────────────────────────
+
+class _PresenceRequestHandler(socketserver.StreamRequestHandler):
+    """Line-delimited JSON: one request per line, replies only for queries"""
+
+    def handle(self):
+        registry = self.server.registry
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+                op = message.pop('op')
+                if op == 'touch':
+                    registry.touch(**message)
+                elif op == 'set_meeting':
+                    registry.set_meeting(**message)
+                elif op == 'remove':
+                    registry.remove(**message)
+                elif op == 'count':
+                    self._reply(registry.get_online_count())
+                elif op == 'is_online':
+                    self._reply(registry.is_online(**message))
+                elif op == 'list':
+                    self._reply([
+                        [e.user_id, e.username, e.last_seen.timestamp(), e.current_page,
+                         e.is_in_meeting, e.current_meeting_id]
+                        for e in registry.get_online_users()
+                    ])
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Bad presence request: {e}")
+
+    def _reply(self, payload):
+        self.wfile.write(json.dumps(payload).encode() + b'\n')
+
+
+class _PresenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class UnixSocketPresenceBackend(BasePresenceBackend):
+    """
+    Presence shared by every worker process on one host
+
+    The first worker to take the lock file serves a LocalPresenceBackend on
+    a Unix socket; the others (and the owner itself) talk to it as clients.
+    If the serving worker exits, the next client that fails to connect
+    takes over. Presence is ephemeral, so losing it on failover is fine.
+    
+    Updates (touch, set_meeting, remove) never block the caller, which may
+    be the event loop: they are queued, in order, for one sender thread.
+    When the queue is full (no server reachable) updates are dropped.
+    Queries go straight to the server and may miss updates still queued.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, path='/tmp/crow-presence.sock', max_pending=10000, **options):
+        super().__init__(timeout)
+        self.path = path
+        self._local = threading.local()
+        self._server = None
+        self._lock_file = None
+        self._server_lock = threading.Lock()
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._sender = None
+        self.dropped = 0
+
+    def touch(self, user_id, username, current_page=''):
+        self._send({'op': 'touch', 'user_id': user_id, 'username': username, 'current_page': current_page})
+
+    def set_meeting(self, user_id, username, meeting_id):
+        self._send({'op': 'set_meeting', 'user_id': user_id, 'username': username, 'meeting_id': meeting_id})
+
+    def remove(self, user_id):
+        self._send({'op': 'remove', 'user_id': user_id})
+
+    def get_online_count(self):
+        return self._call({'op': 'count'}, reply=True) or 0
+
+    def is_online(self, user_id):
+        return bool(self._call({'op': 'is_online', 'user_id': user_id}, reply=True))
+
+    def get_online_users(self):
+        rows = self._call({'op': 'list'}, reply=True) or []
+        return [
+            PresenceEntry(
+                user_id=user_id,
+                username=username,
+                last_seen=datetime.fromtimestamp(last_seen, tz=dt_timezone.utc),
+                current_page=current_page,
+                is_in_meeting=is_in_meeting,
+                current_meeting_id=current_meeting_id,
+            )
+            for user_id, username, last_seen, current_page, is_in_meeting, current_meeting_id in rows
+        ]
+
+    def _send(self, message):
+        """Queue an update for the sender thread"""
+        if self._sender is None:
+            with self._server_lock:
+                if self._sender is None:
+                    self._sender = threading.Thread(target=self._send_pending, name='presence-sender', daemon=True)
+                    self._sender.start()
+        try:
+            self._pending.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def _send_pending(self):
+        while True:
+            self._call(self._pending.get())
+
+    def _call(self, message, reply=False):
+        data = json.dumps(message).encode() + b'\n'
+        for attempt in range(2):
+            try:
+                sock, reader = self._connection()
+                sock.sendall(data)
+                if not reply:
+                    return None
+                line = reader.readline()
+                if not line:
+                    raise ConnectionError('presence server closed the connection')
+                return json.loads(line)
+            except (OSError, ValueError) as e:
+                self._close_connection()
+                if attempt:
+                    logger.warning(f"Presence server unavailable: {e}")
+        return None
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _connect(self):
+        for attempt in range(20):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(1.0)
+            try:
+                sock.connect(self.path)
+                return sock, sock.makefile('rb')
+            except OSError:
+                sock.close()
+                if not self._start_server():
+                    # Another worker holds the lock and is still binding
+                    time.sleep(0.05)
+        raise ConnectionError(f"Cannot reach presence server at {self.path}")
+
+    def _close_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+
+    def _start_server(self):
+        """Serve the registry from this process if no other worker does"""
+        with self._server_lock:
+            if self._server is not None:
+                return True
+
+            lock_file = open(self.path + '.lock', 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+
+            # Holding the lock means any existing socket file is stale
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+            server = _PresenceServer(self.path, _PresenceRequestHandler)
+            server.registry = LocalPresenceBackend(self.timeout)
+            threading.Thread(target=server.serve_forever, name='presence-server', daemon=True).start()
+
+            self._server = server
+            self._lock_file = lock_file
+            logger.info(f"Serving presence registry on {self.path}")
+            return True
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_presence_backend():
+    """Return the configured presence backend (settings.PRESENCE; shared across workers by default)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = getattr(settings, 'PRESENCE', {})
+                backend_class = import_string(config.get('BACKEND', 'crow_app.presence.UnixSocketPresenceBackend'))
+                _backend = backend_class(
+                    timeout=config.get('TIMEOUT', DEFAULT_TIMEOUT),
+                    **config.get('OPTIONS', {})
+                )
+    return _backend
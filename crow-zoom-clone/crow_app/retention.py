@@ -0,0 +1,176 @@
+# crow_app/retention.py - ROLLUP-THEN-ARCHIVE RETENTION FOR TRACKING TABLES
+
+import gzip
+import json
+import os
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .conf import setting_reader
+from .models import ActivityDailyAggregate, SessionDailyAggregate, UserActivity, UserSession
+
+DEFAULTS = {
+    'ARCHIVE_DIR': Path(settings.BASE_DIR) / 'archive',
+    'MAX_AGE_DAYS': 90,
+    'CHUNK_SIZE': 5000,
+}
+
+# Archived table -> (model, timestamp field that decides age and month segment)
+ARCHIVED_MODELS = {
+    'useractivity': (UserActivity, 'timestamp'),
+    'usersession': (UserSession, 'login_time'),
+}
+
+
+get_retention_setting = setting_reader('RETENTION', DEFAULTS)
+
+
+def archive_path(model_name, month, archive_dir=None):
+    """Segment file for one table and month, e.g. archive/useractivity/2026-01.ndjson.gz"""
+    archive_dir = Path(archive_dir or get_retention_setting('ARCHIVE_DIR'))
+    return archive_dir / model_name / f"{month}.ndjson.gz"
+
+
+def _row_to_dict(obj):
+    return {field.attname: getattr(obj, field.attname) for field in obj._meta.concrete_fields}
+
+
+def append_to_archive(model_name, rows, timestamp_field, archive_dir=None):
+    """
+    Append rows to their monthly segments
+
+    Each call adds a new gzip member to the end of the file, so segments
+    are append-only and never rewritten; gzip readers see the members as
+    one continuous stream.
+    """
+    by_month = {}
+    for row in rows:
+        month = timezone.localtime(row[timestamp_field]).strftime('%Y-%m')
+        by_month.setdefault(month, []).append(row)
+
+    for month, month_rows in by_month.items():
+        path = archive_path(model_name, month, archive_dir)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = ''.join(json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in month_rows)
+        with gzip.open(path, 'ab') as f:
+            f.write(payload.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileobj.fileno())
+
+
+def iter_archive(model_name, start=None, end=None, archive_dir=None):
+    """
+    Stream archived rows as dicts, oldest segment first, each row once
+
+    `start`/`end` are optional aware datetimes bounding the row timestamp;
+    only the monthly segments that can overlap the range are opened. A row
+    is always archived to the segment of its own month, so the lines a
+    crashed archive_chunk left behind are repeats within one segment.
+    """
+    model, timestamp_field = ARCHIVED_MODELS[model_name]
+    directory = Path(archive_dir or get_retention_setting('ARCHIVE_DIR')) / model_name
+    if not directory.exists():
+        return
+
+    first_month = timezone.localtime(start).strftime('%Y-%m') if start else None
+    last_month = timezone.localtime(end).strftime('%Y-%m') if end else None
+
+    for path in sorted(directory.glob('*.ndjson.gz')):
+        month = path.name.split('.')[0]
+        if (first_month and month < first_month) or (last_month and month > last_month):
+            continue
+        seen = set()
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                row = json.loads(line)
+                stamp = parse_datetime(row[timestamp_field])
+                if (start and stamp < start) or (end and stamp >= end) or row['id'] in seen:
+                    continue
+                seen.add(row['id'])
+                yield row
+
+
+def _rollup_activities(activities):
+    counts = Counter(
+        (timezone.localtime(a.timestamp).date(), a.user_id, a.activity_type)
+        for a in activities
+    )
+    for (date, user_id, activity_type), count in counts.items():
+        updated = ActivityDailyAggregate.objects.filter(
+            date=date, user_id=user_id, activity_type=activity_type
+        ).update(count=F('count') + count)
+        if not updated:
+            ActivityDailyAggregate.objects.create(
+                date=date, user_id=user_id, activity_type=activity_type, count=count
+            )
+
+
+def _rollup_sessions(sessions):
+    totals = {}
+    for session in sessions:
+        key = (timezone.localtime(session.login_time).date(), session.user_id)
+        end = session.logout_time or session.last_activity
+        count, seconds = totals.get(key, (0, 0))
+        totals[key] = (count + 1, seconds + max(int((end - session.login_time).total_seconds()), 0))
+
+    for (date, user_id), (count, seconds) in totals.items():
+        updated = SessionDailyAggregate.objects.filter(date=date, user_id=user_id).update(
+            session_count=F('session_count') + count,
+            total_seconds=F('total_seconds') + seconds,
+        )
+        if not updated:
+            SessionDailyAggregate.objects.create(
+                date=date, user_id=user_id, session_count=count, total_seconds=seconds
+            )
+
+
+def archivable(model_name, cutoff):
+    """Queryset of rows old enough to be rolled up and archived"""
+    model, timestamp_field = ARCHIVED_MODELS[model_name]
+    queryset = model.objects.filter(**{f'{timestamp_field}__lt': cutoff})
+    if model_name == 'usersession':
+        # Long-lived sessions stay hot until they go idle
+        queryset = queryset.filter(last_activity__lt=cutoff)
+    return queryset.order_by(timestamp_field, 'id')
+
+
+def archive_chunk(model_name, cutoff, chunk_size, archive_dir=None):
+    """
+    Roll up, archive and delete one chunk of old rows; returns the number
+    of rows moved (0 when nothing is left)
+
+    The archive segment is written and fsynced before the transaction that
+    updates the aggregates and deletes the rows commits, so a crash can at
+    worst leave archive lines for rows that are still in the table (and
+    are archived again by the next run), never lose rows. Readers skip
+    both: iter_archive() yields each id once and rollups.rebuild() drops
+    archived ids that are still live.
+    """
+    model, timestamp_field = ARCHIVED_MODELS[model_name]
+
+    with transaction.atomic():
+        rows = list(archivable(model_name, cutoff)[:chunk_size])
+        if not rows:
+            return 0
+
+        if model_name == 'useractivity':
+            _rollup_activities(rows)
+        else:
+            _rollup_sessions(rows)
+
+        append_to_archive(model_name, [_row_to_dict(row) for row in rows], timestamp_field, archive_dir)
+        model.objects.filter(id__in=[row.id for row in rows]).delete()
+
+    return len(rows)
+
+
+def default_cutoff():
+    return timezone.now() - timedelta(days=get_retention_setting('MAX_AGE_DAYS'))
@@ -0,0 +1,280 @@
+# crow_app/rollups.py - INCREMENTAL DAILY/HOURLY COUNTERS FOR THE ADMIN DASHBOARD
+#
+# The dashboard reads its breakdowns (activity types, devices, browsers,
+# rooms per host, meeting time...) from DailyCounter/HourlyCounter rows
+# instead of aggregating the raw tracking tables, so a page costs one row
+# per day and dimension value however much history there is.
+#
+# Each metric names the table and timestamp it counts, the field whose
+# value is its dimension and an optional field summed into `total`.
+# Counters are bumped as rows are written: post_save receivers cover
+# single-row saves and the bulk writers (ActivityPipeline,
+# SessionTouchBuffer) call count_rows() with what they inserted. A failed
+# bump is logged rather than raised; `manage.py rebuild_rollups`
+# recomputes any date range from the live rows and the retention archive
+# (migration 0016 ran it over the history from before the counters).
+
+import logging
+from collections import defaultdict
+from datetime import datetime, time
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Min, Sum, Value
+from django.db.models.functions import TruncHour
+from django.db.models.signals import post_init, post_save
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import DailyCounter, HourlyCounter, Meeting, MeetingSession, Room, UserActivity, UserSession
+from .retention import ARCHIVED_MODELS, iter_archive
+
+logger = logging.getLogger(__name__)
+
+
+class Metric:
+    """What one counter counts: rows of `model` bucketed by their `timestamp` field"""
+
+    def __init__(self, model, timestamp, dimension=None, total=None, filters=None):
+        self.model = model
+        self.timestamp = timestamp
+        self.dimension = dimension  # field whose value splits the counts, e.g. 'browser'
+        self.total = total          # numeric field summed into DailyCounter.total
+        self.filters = filters or {}
+
+    def key(self, row):
+        """(date, hour, dimension, total) for a model instance or an archived row dict"""
+        value = row.get if isinstance(row, dict) else lambda field: getattr(row, field)
+        stamp = value(self.timestamp)
+        if isinstance(stamp, str):
+            stamp = parse_datetime(stamp)
+        stamp = timezone.localtime(stamp)
+        return (
+            stamp.date(),
+            stamp.replace(minute=0, second=0, microsecond=0),
+            self.dimension_value(value(self.dimension)) if self.dimension else '',
+            (value(self.total) or 0) if self.total else 0,
+        )
+
+    @staticmethod
+    def dimension_value(value):
+        return '' if value is None else str(value)[:100]
+
+
+METRICS = {
+    'activity': Metric(UserActivity, 'timestamp', dimension='activity_type'),
+    'session_device': Metric(UserSession, 'login_time', dimension='device_type'),
+    'session_browser': Metric(UserSession, 'login_time', dimension='browser'),
+    'room_created': Metric(Room, 'created_at', dimension='host_id'),
+    'meeting_created': Metric(Meeting, 'created_at'),
+    # Meeting sessions are counted when they end, on the day they started
+    'meeting_session': Metric(MeetingSession, 'joined_at', total='video_enabled_duration',
+                              filters={'left_at__isnull': False}),
+    'meeting_screen_share': Metric(MeetingSession, 'joined_at', total='screen_shared_duration',
+                                   filters={'left_at__isnull': False}),
+}
+
+
+def count_rows(model, rows):
+    """
+    Add freshly written rows of `model` to every metric counting that table
+
+    Rows must already match the metrics' filters. Never raises: the rows
+    are written either way, and a rebuild repairs the counters.
+    """
+    daily = defaultdict(lambda: [0, 0])
+    hourly = defaultdict(lambda: [0, 0])
+    for name, metric in METRICS.items():
+        if metric.model is not model:
+            continue
+        for row in rows:
+            date, hour, dimension, total = metric.key(row)
+            for counts, period in ((daily, date), (hourly, hour)):
+                counts[(name, period, dimension)][0] += 1
+                counts[(name, period, dimension)][1] += total
+
+    if not daily:
+        return
+    try:
+        with transaction.atomic():
+            _bump(DailyCounter, 'date', daily)
+            _bump(HourlyCounter, 'hour', hourly)
+    except Exception as e:
+        logger.error(f"Failed to update rollup counters for {model.__name__}: {e}")
+
+
+def _bump(model, period_field, counts):
+    # Sorted, so concurrent writers lock counter rows in the same order
+    for (metric, period, dimension), (count, total) in sorted(counts.items()):
+        lookup = {'metric': metric, period_field: period, 'dimension': dimension}
+        increment = {'count': F('count') + count, 'total': F('total') + total}
+        if model.objects.filter(**lookup).update(**increment):
+            continue
+        try:
+            with transaction.atomic():
+                model.objects.create(count=count, total=total, **lookup)
+        except IntegrityError:
+            model.objects.filter(**lookup).update(**increment)  # another writer created it first
+
+
+def day_start(date):
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
+def history_start():
+    """The first day any metric has rows for, live or archived (None if there are none)"""
+    days = []
+    for metric in METRICS.values():
+        first = metric.model.objects.aggregate(first=Min(metric.timestamp))['first']
+        if first is not None:
+            days.append(timezone.localtime(first).date())
+    for model_name, (_, timestamp_field) in ARCHIVED_MODELS.items():
+        row = next(iter_archive(model_name), None)  # from the oldest monthly segment
+        if row is not None:
+            days.append(timezone.localtime(parse_datetime(row[timestamp_field])).date().replace(day=1))
+    return min(days, default=None)
+
+
+def _archived_rows(metric, rows, batch_size=1000):
+    """
+    Archived rows not already counted from the table: a crash between
+    archiving a chunk and deleting it leaves the rows in both
+    """
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        live = set(metric.model.objects.filter(id__in=[row['id'] for row in batch]).values_list('id', flat=True))
+        yield from (row for row in batch if row['id'] not in live)
+
+
+def rebuild(start, end, metrics=None):
+    """
+    Recompute the counters of the days in [start, end) from scratch
+
+    Live rows are grouped per hour in the database; rows the retention job
+    moved to the archive are read back and counted too. Each metric is
+    replaced in one transaction. Rows written while it runs may be missed
+    or counted twice, so prefer rebuilding days that are over.
+    Returns {metric: rows counted}.
+    """
+    start_at, end_at = day_start(start), day_start(end)
+    counted = {}
+
+    for name in metrics or METRICS:
+        metric = METRICS[name]
+        hourly = defaultdict(lambda: [0, 0])
+
+        queryset = metric.model.objects.filter(
+            **{f'{metric.timestamp}__gte': start_at, f'{metric.timestamp}__lt': end_at},
+            **metric.filters,
+        )
+        groups = queryset.annotate(
+            hour=TruncHour(metric.timestamp)
+        ).values('hour', **({'dimension': F(metric.dimension)} if metric.dimension else {})).annotate(
+            rows=Count('pk'),
+            summed=Sum(metric.total) if metric.total else Value(0),
+        ).order_by()
+        for group in groups:
+            dimension = metric.dimension_value(group['dimension']) if metric.dimension else ''
+            key = (timezone.localtime(group['hour']), dimension)
+            hourly[key][0] += group['rows']
+            hourly[key][1] += group['summed'] or 0
+
+        archived = metric.model._meta.model_name
+        if archived in ARCHIVED_MODELS:
+            for row in _archived_rows(metric, iter_archive(archived, start_at, end_at)):
+                _, hour, dimension, total = metric.key(row)
+                hourly[(hour, dimension)][0] += 1
+                hourly[(hour, dimension)][1] += total
+
+        daily = defaultdict(lambda: [0, 0])
+        for (hour, dimension), (count, total) in hourly.items():
+            daily[(hour.date(), dimension)][0] += count
+            daily[(hour.date(), dimension)][1] += total
+
+        with transaction.atomic():
+            DailyCounter.objects.filter(metric=name, date__gte=start, date__lt=end).delete()
+            HourlyCounter.objects.filter(metric=name, hour__gte=start_at, hour__lt=end_at).delete()
+            DailyCounter.objects.bulk_create([
+                DailyCounter(metric=name, date=date, dimension=dimension, count=count, total=total)
+                for (date, dimension), (count, total) in daily.items()
+            ], batch_size=1000)
+            HourlyCounter.objects.bulk_create([
+                HourlyCounter(metric=name, hour=hour, dimension=dimension, count=count, total=total)
+                for (hour, dimension), (count, total) in hourly.items()
+            ], batch_size=1000)
+
+        counted[name] = sum(count for count, _ in daily.values())
+
+    return counted
+
+
+# ─── Reading ─────────────────────────────────────────────────────────────────
+
+def _daily(metric, start=None, end=None, dimension=None):
+    queryset = DailyCounter.objects.filter(metric=metric)
+    if start is not None:
+        queryset = queryset.filter(date__gte=start)
+    if end is not None:
+        queryset = queryset.filter(date__lt=end)
+    if dimension is not None:
+        queryset = queryset.filter(dimension=dimension)
+    return queryset
+
+
+def totals(metric, start=None, end=None, dimension=None):
+    """{'count', 'total'} of a metric over the days in [start, end)"""
+    result = _daily(metric, start, end, dimension).aggregate(count=Sum('count'), total=Sum('total'))
+    return {'count': result['count'] or 0, 'total': result['total'] or 0}
+
+
+def by_dimension(metric, start=None, end=None, limit=None):
+    """[{'dimension', 'count', 'total'}] over the days in [start, end), largest count first"""
+    rows = _daily(metric, start, end).values('dimension').annotate(
+        count=Sum('count'), total=Sum('total')
+    ).order_by('-count', 'dimension')
+    return list(rows[:limit] if limit else rows)
+
+
+def series(metric, start, end=None, dimension=None, hourly=False):
+    """[{'day' (or 'hour'), 'count', 'total'}] oldest first, optionally for one dimension value"""
+    if not hourly:
+        rows = _daily(metric, start, end, dimension).values(day=F('date'))
+        return list(rows.annotate(count=Sum('count'), total=Sum('total')).order_by('day'))
+
+    queryset = HourlyCounter.objects.filter(metric=metric, hour__gte=day_start(start))
+    if end is not None:
+        queryset = queryset.filter(hour__lt=day_start(end))
+    if dimension is not None:
+        queryset = queryset.filter(dimension=dimension)
+    return list(queryset.values('hour').annotate(count=Sum('count'), total=Sum('total')).order_by('hour'))
+
+
+# ─── Signals ─────────────────────────────────────────────────────────────────
+
+def on_row_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        count_rows(sender, [instance])
+
+
+def remember_meeting_session_end(sender, instance, **kwargs):
+    # Whether the row had ended when it was loaded. post_init also runs for
+    # unsaved instances (and before from_db() clears _state.adding), so the
+    # first save of a new row ignores it: see `created` below
+    instance._rollup_ended = instance.left_at is not None
+
+
+def on_meeting_session_saved(sender, instance, created, raw=False, **kwargs):
+    """Count a meeting session once, on the save that sets left_at (or creates it ended)"""
+    if raw or instance.left_at is None or (instance._rollup_ended and not created):
+        return
+    instance._rollup_ended = True
+    count_rows(MeetingSession, [instance])
+
+
+for model in (UserActivity, UserSession, Room, Meeting):
+    post_save.connect(on_row_created, sender=model, dispatch_uid=f'rollups_{model._meta.model_name}')
+post_init.connect(remember_meeting_session_end, sender=MeetingSession, dispatch_uid='rollups_meetingsession_init')
+post_save.connect(on_meeting_session_saved, sender=MeetingSession, dispatch_uid='rollups_meetingsession')
@@ -0,0 +1,296 @@
+# crow_app/rooms.py - PER-ROOM SIGNALING STATE
+
+import json
+import threading
+import time
+from collections import Counter
+
+
+from .conf import setting_reader
+from .strokes import StrokeLog
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULTS = {
+    'ICE_BATCH_WINDOW_MS': 20,   # how long a sender holds ICE candidates for one target; 0 disables
+    'ICE_BATCH_MAX': 8,          # flush early once this many candidates are held
+    'STROKE_TICK_MS': 33,        # drawing strokes from one sender are broadcast once per tick
+    'STROKE_POINTS_PER_SEC': 600,  # per-sender drawing rate limit (points after simplification)
+    'STROKE_BURST': 4096,        # points a sender may send at once; never below strokes.MAX_POINTS
+    'STROKE_SIMPLIFY_EPSILON': 2,  # RDP tolerance in quantized canvas units; 0 disables
+    'WHITEBOARD_MAX_POINTS': 20000,  # per-room bound on the drawing history kept for late joiners
+    'WHITEBOARD_COMPACT_EVERY': 64,  # frames between merges of the history into its snapshot
+    'FAST_JSON': True,           # encode frames with orjson when it is installed
+    'SFU_MIN_PARTICIPANTS': 6,   # joined members at which a room switches to the SFU (needs aiortc); 0 disables
+    'SEND_QUEUE_SIGNALING_MAX': 256,  # queued signaling frames before a client is disconnected as too slow
+    'SEND_QUEUE_DRAWING_MAX': 32,     # queued drawing frames before they are merged or dropped
+    'SLOW_CLIENT_TIMEOUT_MS': 15000,  # disconnect a client whose oldest queued signaling frame is older; 0 disables
+    'JOIN_RATE_PER_SEC': 5,      # per-room admissions per second once the burst is spent; 0 disables
+    'JOIN_BURST': 10,            # clients a room admits at once
+    'JOIN_RETRY_JITTER': 1.0,    # seconds of random spread added to `wait` retry hints
+}
+
+
+get_signaling_setting = setting_reader('SIGNALING', DEFAULTS)
+
+
+def worker_of(channel_name):
+    """
+    The process part of a process-specific channel name: Channels names
+    them '<prefix>.<process>!<client>', so two channels with the same
+    part before the '!' are served by the same worker
+    """
+    return channel_name.rpartition('!')[0]
+
+
+def dumps(payload):
+    """Encode an outgoing WebSocket text frame"""
+    if orjson is not None and get_signaling_setting('FAST_JSON'):
+        return orjson.dumps(payload).decode()
+    return json.dumps(payload)
+
+
+class TokenBucket:
+    """Refills at `rate` tokens per second up to `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, amount=1):
+        """Spend `amount` tokens; returns False (spending nothing) if there are not enough"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def wait_time(self, amount=1):
+        """Seconds until `amount` tokens are available (as of the last take)"""
+        return max(amount - self.tokens, 0) / self.rate
+
+
+class Admissions:
+    """
+    Who holds a place in each room, and each room's join-rate bucket
+
+    try_admit() checks and takes a place in one step, so it is atomic for
+    whoever owns the instance: room_registry within one process, or the
+    UnixSocketChannelLayer broker for every worker on the host. Places
+    are keyed by user, so a user reconnecting keeps theirs.
+    """
+
+    def __init__(self):
+        self.members = {}  # room_id -> {user_id: (channel_name, owner)}
+        self.buckets = {}  # room_id -> TokenBucket
+
+    def try_admit(self, room_id, user_id, channel_name, limit, rate, burst, owner=None):
+        """Returns ['ok', None], ['full', None] or ['wait', seconds until a retry can succeed]"""
+        members = self.members.get(room_id, {})
+        if user_id in members:
+            members[user_id] = (channel_name, owner)
+            return ['ok', None]
+        if limit and len(members) >= limit:
+            return ['full', None]
+        if rate:
+            bucket = self.buckets.get(room_id)
+            if bucket is None or (bucket.rate, bucket.burst) != (rate, burst):
+                bucket = self.buckets[room_id] = TokenBucket(rate, burst)
+            if not bucket.take():
+                return ['wait', bucket.wait_time()]
+        self.members.setdefault(room_id, {})[user_id] = (channel_name, owner)
+        return ['ok', None]
+
+    def release(self, room_id, user_id, channel_name):
+        """Give a place back, unless the user has since been admitted on another channel"""
+        members = self.members.get(room_id)
+        if members and members.get(user_id, (None,))[0] == channel_name:
+            del members[user_id]
+            if not members:
+                del self.members[room_id]
+                self.buckets.pop(room_id, None)
+
+    def release_owner(self, owner):
+        """Give back every place taken through `owner` (a broker client that went away)"""
+        for room_id, members in list(self.members.items()):
+            for user_id, (channel_name, member_owner) in list(members.items()):
+                if member_owner is owner:
+                    self.release(room_id, user_id, channel_name)
+
+    def count(self, room_id):
+        """Places taken in a room"""
+        return len(self.members.get(room_id, ()))
+
+
+class RoomRegistry:
+    """
+    Per-room member directory for this worker process
+
+    Consumers register themselves on connect and record peers they learn
+    about from channel-layer events, so targeted signaling can go straight
+    to one channel instead of being broadcast to the whole room group.
+    A miss (peer on another worker we have not heard from yet) means the
+    caller falls back to group_send.
+    
+    Members that have sent `join` also carry their roster details
+    (username, media state, join time), which newcomers receive in one
+    `room-state` message and HTTP views can read with roster().
+    
+    It also holds each room's drawing history (StrokeLog) while the room
+    has members on this worker, whether the room has switched from the
+    peer-to-peer mesh to this worker's SFU (see sfu.py), and per-room
+    counters for the connections' send queues (see outbox.py).
+    """
+
+    def __init__(self):
+        self._rooms = {}   # room_id -> {user_id: member dict}
+        self._stroke_logs = {}  # room_id -> StrokeLog
+        self._sfu_rooms = set()
+        self._room_stats = {}  # room_id -> Counter
+        self._admissions = Admissions()
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def set_channel(self, room_id, user_id, channel_name, **details):
+        """
+        Record a member's channel (and any roster details); returns the
+        channel it replaces, if the user was connected on another one
+        """
+        with self._lock:
+            members = self._rooms.setdefault(room_id, {})
+            member = members.get(user_id)
+            previous = member['channel'] if member else None
+            if member is None or previous != channel_name:
+                member = members[user_id] = {'channel': channel_name}
+            member.update(details)
+            return previous if previous != channel_name else None
+
+    def get_channel(self, room_id, user_id):
+        with self._lock:
+            member = self._rooms.get(room_id, {}).get(user_id)
+            return member['channel'] if member else None
+
+    def update_member(self, room_id, user_id, **details):
+        with self._lock:
+            member = self._rooms.get(room_id, {}).get(user_id)
+            if member is not None:
+                member.update(details)
+
+    def roster(self, room_id):
+        """Members who have joined the room, in join order"""
+        with self._lock:
+            members = [
+                {'userId': user_id, **member}
+                for user_id, member in self._rooms.get(room_id, {}).items()
+                if 'joinedAt' in member
+            ]
+        for member in members:
+            del member['channel']
+            member.pop('sfu', None)
+        return sorted(members, key=lambda member: member['joinedAt'])
+
+    def discard(self, room_id, user_id, channel_name=None):
+        """Forget a user; with channel_name, only if it is still their current channel"""
+        with self._lock:
+            members = self._rooms.get(room_id)
+            if not members or user_id not in members:
+                return
+            if channel_name is not None and members[user_id]['channel'] != channel_name:
+                return  # the user has already reconnected on a new channel
+            del members[user_id]
+            if not members:
+                del self._rooms[room_id]
+                self._sfu_rooms.discard(room_id)
+                self._room_stats.pop(room_id, None)
+
+    def room_mode(self, room_id):
+        with self._lock:
+            return 'sfu' if room_id in self._sfu_rooms else 'mesh'
+
+    def promote_to_sfu(self, room_id, min_members, worker, admitted=None):
+        """
+        Switch a room to SFU mode once it has `min_members` joined members
+        who all declared SFU support; True only for the call that switched it
+
+        The forwarder only reaches the clients of its own process, so every
+        member must be on `worker` (see worker_of()). Members learned from
+        other workers' events are in the registry; `admitted`, the room's
+        places on every worker as counted by the channel layer, also covers
+        the ones this worker has not heard from yet.
+        """
+        with self._lock:
+            if room_id in self._sfu_rooms:
+                return False
+            members = self._rooms.get(room_id, {})
+            if any(worker_of(member['channel']) != worker for member in members.values()):
+                return False
+            if admitted is not None and admitted > len(members):
+                return False
+            joined = [member for member in members.values() if 'joinedAt' in member]
+            if len(joined) < min_members or not all(member.get('sfu') for member in joined):
+                return False
+            self._sfu_rooms.add(room_id)
+            return True
+
+    def set_sfu_mode(self, room_id):
+        """Record a switch announced by another consumer"""
+        with self._lock:
+            if room_id in self._rooms:
+                self._sfu_rooms.add(room_id)
+
+    def demote_from_sfu(self, room_id):
+        """Switch a room back to the mesh; True only for the call that switched it"""
+        with self._lock:
+            if room_id not in self._sfu_rooms:
+                return False
+            self._sfu_rooms.discard(room_id)
+            return True
+
+    def stroke_log(self, room_id):
+        """The room's drawing history, created empty on first use"""
+        with self._lock:
+            log = self._stroke_logs.get(room_id)
+            if log is None:
+                log = self._stroke_logs[room_id] = StrokeLog(
+                    max_points=get_signaling_setting('WHITEBOARD_MAX_POINTS'),
+                    compact_every=get_signaling_setting('WHITEBOARD_COMPACT_EVERY'),
+                )
+            return log
+
+    def drop_stroke_log(self, room_id):
+        """Forget a room's drawing history, returning it (or None)"""
+        with self._lock:
+            return self._stroke_logs.pop(room_id, None)
+
+    def try_admit(self, room_id, user_id, channel_name, limit, rate, burst):
+        """Admission for channel layers without the 'admission' extension (this process only)"""
+        with self._lock:
+            return self._admissions.try_admit(room_id, user_id, channel_name, limit, rate, burst)
+
+    def release(self, room_id, user_id, channel_name):
+        with self._lock:
+            self._admissions.release(room_id, user_id, channel_name)
+
+    def room_counter(self, room_id):
+        """The room's send-queue counters, created on first use"""
+        with self._lock:
+            return self._room_stats.setdefault(room_id, Counter())
+
+    def room_stats(self):
+        """Send-queue counters of every room with members on this worker"""
+        with self._lock:
+            return {room_id: dict(counter) for room_id, counter in self._room_stats.items()}
+
+    def room_size(self, room_id):
+        with self._lock:
+            return len(self._rooms.get(room_id, {}))
+
+
+room_registry = RoomRegistry()
@@ -0,0 +1,226 @@
+# crow_app/session_buffer.py - WRITE-BEHIND BUFFER FOR SESSION TRACKING
+
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .conf import setting_reader
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WRITE_BEHIND': False,
+    'FLUSH_INTERVAL': 5.0,     # seconds between background flushes
+    'BATCH_SIZE': 500,         # pending entries that trigger an early flush
+    'MAX_PENDING': 10000,      # new entries beyond this are dropped
+    'SKIP_PATHS': ['/api/online-users/'],
+}
+
+
+get_tracking_setting = setting_reader('SESSION_TRACKING', DEFAULTS)
+
+
+def should_skip_path(path):
+    """Static, media, websocket and polling requests are never tracked"""
+    prefixes = ['/ws/', settings.MEDIA_URL, '/' + settings.STATIC_URL.lstrip('/')]
+    prefixes += get_tracking_setting('SKIP_PATHS')
+    return any(prefix and path.startswith(prefix) for prefix in prefixes)
+
+
+class SessionTouchBuffer:
+    """
+    Coalesces per-request session touches in memory and writes them out
+    in bulk from a background thread.
+
+    Only the latest touch per (user, session_key) is kept, so a burst of
+    page views costs a single row write at flush time. Session rows are
+    created at login (views.on_user_login); a flush only creates the ones
+    it has never seen, such as sessions opened before tracking started,
+    whose login_time is then the flush time.
+    """
+
+    def __init__(self, flush_interval=5.0, batch_size=500, max_pending=10000):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+        self._sessions = {}   # (user_id, session_key) -> touch details
+
+        self.counters = {
+            'touches': 0,
+            'coalesced': 0,
+            'dropped': 0,
+            'flushes': 0,
+            'flushed_sessions': 0,
+            'flush_errors': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+        }
+
+    def touch(self, user_id, session_key, ip_address='', user_agent=''):
+        """Record that a user was seen; never touches the database"""
+        now = timezone.now()
+        key = (user_id, session_key)
+
+        with self._lock:
+            self.counters['touches'] += 1
+
+            if key in self._sessions:
+                self._sessions[key]['last_activity'] = now
+                self.counters['coalesced'] += 1
+            elif len(self._sessions) >= self.max_pending:
+                self.counters['dropped'] += 1
+                return
+            else:
+                self._sessions[key] = {
+                    'ip_address': ip_address,
+                    'user_agent': user_agent,
+                    'last_activity': now,
+                }
+
+            pending = len(self._sessions)
+
+        self._ensure_worker()
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def flush(self):
+        """Write all pending touches to the database"""
+        with self._flush_lock:
+            with self._lock:
+                sessions, self._sessions = self._sessions, {}
+
+            if not sessions:
+                return
+
+            started = time.perf_counter()
+            try:
+                self._write_sessions(sessions)
+            except Exception as e:
+                # Losing a few last_activity timestamps is preferable to
+                # retrying forever against a broken database
+                logger.error(f"Session buffer flush failed: {e}")
+                with self._lock:
+                    self.counters['flush_errors'] += 1
+                    self.counters['dropped'] += len(sessions)
+                return
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.counters['flushes'] += 1
+                self.counters['flushed_sessions'] += len(sessions)
+                self.counters['last_flush_ms'] = elapsed_ms
+                self.counters['total_flush_ms'] += elapsed_ms
+                self.counters['max_flush_ms'] = max(self.counters['max_flush_ms'], elapsed_ms)
+
+    def _write_sessions(self, sessions):
+        from .middleware import parse_device_type, parse_browser
+        from .models import UserSession
+        from .rollups import count_rows
+        from .user_stats import count_user_rows, touch_last_seen
+        from .user_agent_cache import get_user_agent_id
+
+        by_key = {session_key: (user_id, touch) for (user_id, session_key), touch in sessions.items()}
+        existing = UserSession.objects.filter(
+            session_key__in=by_key.keys()
+        ).only('id', 'user_id', 'session_key')
+
+        to_update = []
+        for user_session in existing:
+            user_id, touch = by_key.pop(user_session.session_key)
+            if user_session.user_id != user_id:
+                continue  # session key was reused by another account
+            user_session.last_activity = touch['last_activity']
+            to_update.append(user_session)
+
+        to_create = [
+            UserSession(
+                user_id=user_id,
+                session_key=session_key,
+                ip_address=touch['ip_address'],
+                user_agent_id=get_user_agent_id(touch['user_agent']),
+                device_type=parse_device_type(touch['user_agent']),
+                browser=parse_browser(touch['user_agent']),
+            )
+            for session_key, (user_id, touch) in by_key.items()
+        ]
+
+        if to_update:
+            UserSession.objects.bulk_update(to_update, ['last_activity'], batch_size=self.batch_size)
+        if to_create:
+            UserSession.objects.bulk_create(to_create, batch_size=self.batch_size, ignore_conflicts=True)
+            # Counted even if another process created the same session key
+            # since the lookup above; rebuild_rollups corrects that
+            count_rows(UserSession, to_create)
+            count_user_rows(UserSession, to_create)
+
+        last_seen = {}
+        for user_session in to_update + to_create:
+            at = user_session.last_activity  # set by bulk_create for new sessions
+            last_seen[user_session.user_id] = max(at, last_seen.get(user_session.user_id, at))
+        touch_last_seen(last_seen)
+
+    def stats(self):
+        """Snapshot of the buffer counters for the metrics endpoint"""
+        with self._lock:
+            data = dict(self.counters)
+            data['pending'] = len(self._sessions)
+        data['avg_flush_ms'] = data['total_flush_ms'] / data['flushes'] if data['flushes'] else 0.0
+        return data
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='session-touch-flusher', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_session_buffer():
+    """Return the process-wide buffer, or None when write-behind is disabled"""
+    global _buffer
+    if not get_tracking_setting('WRITE_BEHIND'):
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = SessionTouchBuffer(
+                    flush_interval=get_tracking_setting('FLUSH_INTERVAL'),
+                    batch_size=get_tracking_setting('BATCH_SIZE'),
+                    max_pending=get_tracking_setting('MAX_PENDING'),
+                )
+                atexit.register(_buffer.flush)
+    return _buffer
@@ -0,0 +1,255 @@
+# crow_app/sfu.py - SELECTIVE FORWARDING FOR LARGE ROOMS
+#
+# A full mesh makes every participant upload one copy of their media per
+# peer. Once a room reaches SIGNALING['SFU_MIN_PARTICIPANTS'] joined
+# members it switches to SFU mode: each client keeps a single peer
+# connection with this worker, publishes its tracks on it once, and
+# receives everybody else's tracks relayed over the same connection.
+#
+# The SFU is addressed as the pseudo-peer SFU_PEER over the existing
+# offer / answer / ice-candidate messages. The client makes the first
+# offer; afterwards the server renegotiates (sends its own offers) whenever
+# tracks are added or removed. Those offers carry `tracks`, mapping each
+# m-line (mid) to the participant whose media it carries.
+#
+# aiortc is optional: without it sfu_available() is False and rooms stay
+# in mesh mode. The forwarder lives in the worker process and only reaches
+# that worker's clients, so a room is only switched while all of its
+# members are on one worker, and goes back to the mesh when someone joins
+# it on another (see RoomRegistry.promote_to_sfu and the consumer).
+
+import asyncio
+
+try:
+    from aiortc import RTCPeerConnection, RTCSessionDescription
+    from aiortc.contrib.media import MediaRelay
+    from aiortc.sdp import candidate_from_sdp
+except ImportError:
+    RTCPeerConnection = None
+
+from .rooms import room_registry
+
+SFU_PEER = 'sfu'
+
+
+def sfu_available():
+    return RTCPeerConnection is not None
+
+
+def description(pc):
+    """A peer connection's local description as the client-side JSON shape"""
+    return {'type': pc.localDescription.type, 'sdp': pc.localDescription.sdp}
+
+
+class SfuParticipant:
+    """One client's peer connection with the forwarder"""
+
+    def __init__(self, user_id, send_signal):
+        self.user_id = user_id
+        self.send_signal = send_signal  # coroutine function taking a client frame dict
+        self.pc = RTCPeerConnection()
+        self.published = []   # tracks received from this client
+        self.forwarded = {}   # transceiver -> user id of the publisher it carries
+        self.sources = set()  # published tracks already relayed to this client
+        self.idle = []        # transceivers whose publisher left, reused for new tracks
+        self.lock = asyncio.Lock()
+        self.connected = False   # the client's first offer has been answered
+        self.needs_offer = False
+        self.deferred_offer = None
+
+
+class SfuRoom:
+    """The participants of one room and the relay fanning their tracks out"""
+
+    def __init__(self, room_id, stats):
+        self.room_id = room_id
+        self.stats = stats
+        self.relay = MediaRelay()
+        self.participants = {}
+
+    async def offer(self, user_id, offer, send_signal):
+        participant = self.participants.get(user_id)
+        if participant is not None and participant.send_signal != send_signal:
+            await self.leave(user_id)  # the user reconnected on a new session
+            participant = None
+        if participant is None:
+            participant = self.participants[user_id] = self.add_participant(user_id, send_signal)
+
+        async with participant.lock:
+            if participant.pc.signalingState != 'stable':
+                # Our own offer is outstanding; answer this one after theirs
+                participant.deferred_offer = offer
+                return
+            await self.answer_offer(participant, offer)
+
+        if not participant.connected:
+            # Subscribe the newcomer to everything already published
+            participant.connected = True
+            for publisher in self.participants.values():
+                if publisher is not participant:
+                    for track in publisher.published:
+                        self.forward(participant, track, publisher.user_id)
+            if participant.forwarded:
+                await self.renegotiate(participant)
+
+    async def answer(self, user_id, answer):
+        participant = self.participants.get(user_id)
+        if participant is None:
+            return
+        async with participant.lock:
+            await participant.pc.setRemoteDescription(
+                RTCSessionDescription(sdp=answer['sdp'], type=answer['type'])
+            )
+            if participant.deferred_offer is not None:
+                offer, participant.deferred_offer = participant.deferred_offer, None
+                await self.answer_offer(participant, offer)
+        if participant.needs_offer:
+            await self.renegotiate(participant)
+
+    async def ice_candidate(self, user_id, candidate):
+        participant = self.participants.get(user_id)
+        if participant is None or not candidate or not candidate.get('candidate'):
+            return  # aiortc does not need end-of-candidates
+        ice = candidate_from_sdp(candidate['candidate'].split(':', 1)[1])
+        ice.sdpMid = candidate.get('sdpMid')
+        ice.sdpMLineIndex = candidate.get('sdpMLineIndex')
+        await participant.pc.addIceCandidate(ice)
+
+    async def leave(self, user_id):
+        participant = self.participants.pop(user_id, None)
+        if participant is None:
+            return
+        await participant.pc.close()
+
+        for other in self.participants.values():
+            other.sources.difference_update(participant.published)
+            removed = False
+            for transceiver, publisher_id in list(other.forwarded.items()):
+                if publisher_id == user_id:
+                    if transceiver.sender.track is not None:
+                        transceiver.sender.track.stop()
+                    transceiver.sender.replaceTrack(None)
+                    transceiver.direction = 'inactive'
+                    del other.forwarded[transceiver]
+                    other.idle.append(transceiver)
+                    self.stats['sfu_streams'] -= 1
+                    removed = True
+            if removed:
+                await self.renegotiate(other)
+
+    def add_participant(self, user_id, send_signal):
+        participant = SfuParticipant(user_id, send_signal)
+
+        @participant.pc.on('track')
+        def on_track(track):
+            participant.published.append(track)
+            self.stats['sfu_tracks_published'] += 1
+            for other in list(self.participants.values()):
+                if other is not participant and other.connected:
+                    self.forward(other, track, participant.user_id)
+                    asyncio.ensure_future(self.renegotiate(other))
+
+        @participant.pc.on('connectionstatechange')
+        async def on_connectionstatechange():
+            if participant.pc.connectionState == 'failed' and self.participants.get(user_id) is participant:
+                await self.leave(user_id)
+
+        return participant
+
+    def forward(self, subscriber, track, publisher_id):
+        """Relay `track` to `subscriber`; takes effect on the next renegotiation"""
+        if track in subscriber.sources:
+            return
+        subscriber.sources.add(track)
+        relayed = self.relay.subscribe(track)
+        for transceiver in subscriber.idle:
+            if transceiver.kind == track.kind:
+                subscriber.idle.remove(transceiver)
+                transceiver.sender.replaceTrack(relayed)
+                transceiver.direction = 'sendonly'
+                break
+        else:
+            transceiver = subscriber.pc.addTransceiver(relayed, direction='sendonly')
+        subscriber.forwarded[transceiver] = publisher_id
+        self.stats['sfu_streams'] += 1
+
+    async def answer_offer(self, participant, offer):
+        pc = participant.pc
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=offer['sdp'], type=offer['type']))
+        await pc.setLocalDescription(await pc.createAnswer())
+        await participant.send_signal({
+            'type': 'answer',
+            'answer': description(pc),
+            'sender': SFU_PEER,
+            'senderName': SFU_PEER,
+        })
+
+    async def renegotiate(self, participant):
+        """Send the client a fresh offer, or flag one if a negotiation is in progress"""
+        async with participant.lock:
+            if not participant.connected:
+                return  # they get everything once their first offer is answered
+            if participant.pc.signalingState != 'stable':
+                participant.needs_offer = True
+                return
+            participant.needs_offer = False
+            pc = participant.pc
+            await pc.setLocalDescription(await pc.createOffer())
+            self.stats['sfu_renegotiations'] += 1
+            await participant.send_signal({
+                'type': 'offer',
+                'offer': description(pc),
+                'sender': SFU_PEER,
+                'senderName': SFU_PEER,
+                'tracks': {
+                    transceiver.mid: publisher_id
+                    for transceiver, publisher_id in participant.forwarded.items()
+                },
+            })
+
+
+class SelectiveForwarder:
+    """
+    The SFU rooms of this worker process
+
+    Consumers hand it the messages their client addresses to SFU_PEER;
+    replies and server offers go back through each participant's
+    `send_signal` coroutine.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self._rooms = {}
+
+    def room(self, room_id):
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = self._rooms[room_id] = SfuRoom(room_id, self.stats)
+        return room
+
+    async def offer(self, room_id, user_id, offer, send_signal):
+        await self.room(room_id).offer(user_id, offer, send_signal)
+
+    async def answer(self, room_id, user_id, answer):
+        room = self._rooms.get(room_id)
+        if room is not None:
+            await room.answer(user_id, answer)
+
+    async def ice_candidate(self, room_id, user_id, candidate):
+        room = self._rooms.get(room_id)
+        if room is not None:
+            await room.ice_candidate(user_id, candidate)
+
+    async def leave(self, room_id, user_id, send_signal=None):
+        """Drop a participant; with send_signal, only if it is still their session"""
+        room = self._rooms.get(room_id)
+        if room is None:
+            return
+        participant = room.participants.get(user_id)
+        if participant is not None and (send_signal is None or participant.send_signal == send_signal):
+            await room.leave(user_id)
+        if not room.participants:
+            del self._rooms[room_id]
+
+
+sfu_forwarder = SelectiveForwarder(room_registry.stats)
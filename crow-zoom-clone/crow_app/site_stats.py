@@ -0,0 +1,167 @@
+# crow_app/site_stats.py - SITESTATISTICS SNAPSHOTS, COMPUTED OFF THE REQUEST PATH
+#
+# `manage.py generate_site_stats` (run it from cron every few minutes)
+# writes the SiteStatistics rows the admin dashboard reads. Any range of
+# days costs one grouped query per table rather than a set of queries per
+# day: every per-day figure is a GROUP BY on the day, and the running
+# totals (users, meetings, teams, meeting minutes) are the rows before the
+# range plus a running sum of the per-day figures. Long backfills can be
+# split into date chunks computed by parallel worker processes.
+#
+# Days whose raw rows were archived (see retention.py) take their active
+# users and logins from the daily aggregates the archiver keeps; active
+# users are the distinct union of both, for days archived in part.
+
+import multiprocessing
+from collections import defaultdict
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+
+from .concurrency import daily_peaks
+from .models import (
+    ActivityDailyAggregate, Meeting, MeetingSession, SessionDailyAggregate, SiteStatistics,
+    UserActivity, UserClass, UserSession,
+)
+from .rollups import day_start
+
+# Per-day figures that feed a running total: (daily field, total field)
+RUNNING_TOTALS = [
+    ('new_users_today', 'total_users'),
+    ('meetings_today', 'total_meetings'),
+    ('teams_created_today', 'total_teams'),
+]
+
+SESSION_SECONDS = ExpressionWrapper(F('left_at') - F('joined_at'), output_field=DurationField())
+
+
+def _per_day(queryset, field, **aggregate):
+    """{date: aggregate value} grouping `queryset` by the local date of `field`"""
+    rows = queryset.annotate(day=TruncDate(field)).values('day').annotate(**aggregate).order_by()
+    (name,) = aggregate
+    return {row['day']: row[name] for row in rows}
+
+
+def _in_range(field, start, end):
+    return {f'{field}__gte': day_start(start), f'{field}__lt': day_start(end)}
+
+
+def daily_figures(start, end):
+    """
+    Per-day (not cumulative) figures for the days in [start, end)
+
+    Returns {date: {field: value}}, including 'meeting_seconds', the length
+    of the meeting sessions that ended that day.
+    """
+    figures = defaultdict(lambda: defaultdict(int))
+
+    def merge(field, values):
+        for day, value in values.items():
+            figures[day][field] += value or 0
+
+    merge('new_users_today', _per_day(User.objects.filter(**_in_range('date_joined', start, end)), 'date_joined', n=Count('id')))
+    merge('meetings_today', _per_day(Meeting.objects.filter(**_in_range('created_at', start, end)), 'created_at', n=Count('id')))
+    merge('teams_created_today', _per_day(UserClass.objects.filter(**_in_range('created_at', start, end)), 'created_at', n=Count('id')))
+    merge('total_logins_today', _per_day(
+        UserActivity.objects.filter(activity_type='login', **_in_range('timestamp', start, end)), 'timestamp', n=Count('id')
+    ))
+    ended = _per_day(
+        MeetingSession.objects.filter(left_at__isnull=False, **_in_range('left_at', start, end)),
+        'left_at', n=Sum(SESSION_SECONDS),
+    )
+    merge('meeting_seconds', {day: duration.total_seconds() for day, duration in ended.items() if duration})
+
+    # Days the retention job already archived
+    archived = {'date__gte': start, 'date__lt': end}
+    merge('total_logins_today', dict(
+        ActivityDailyAggregate.objects.filter(activity_type='login', **archived)
+        .values_list('date').annotate(Sum('count')).order_by()
+    ))
+    # A day the archiver reached part of has users in both: count them once
+    active = defaultdict(set)
+    live = UserSession.objects.filter(**_in_range('login_time', start, end)).annotate(
+        day=TruncDate('login_time')
+    ).values_list('day', 'user_id').distinct().order_by()
+    for day, user_id in [*live, *SessionDailyAggregate.objects.filter(**archived).values_list('date', 'user_id')]:
+        active[day].add(user_id)
+    merge('active_users_today', {day: len(users) for day, users in active.items()})
+
+    # Most users signed in at once (see concurrency.py)
+    for day, peak in daily_peaks('users', start, end).items():
+        figures[day]['peak_concurrent_users'] = peak
+    return figures
+
+
+def _chunk_figures(bounds):
+    start, end = bounds
+    try:
+        return {day: dict(values) for day, values in daily_figures(start, end).items()}
+    finally:
+        connections.close_all()
+
+
+def compute(start, end, workers=1, chunk_days=31):
+    """
+    SiteStatistics field values for every day in [start, end)
+
+    With workers > 1, chunks of `chunk_days` are computed by forked worker
+    processes; the running totals are added up here afterwards.
+    """
+    chunks = []
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days), end)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+
+    if workers > 1 and len(chunks) > 1:
+        connections.close_all()  # forked children must not share the parent's connection
+        with multiprocessing.get_context('fork').Pool(min(workers, len(chunks))) as pool:
+            results = pool.map(_chunk_figures, chunks)
+    else:
+        results = [daily_figures(*chunk) for chunk in chunks]
+    figures = {day: values for result in results for day, values in result.items()}
+
+    # Everything before the range, once
+    before = day_start(start)
+    totals = {
+        'total_users': User.objects.filter(date_joined__lt=before).count(),
+        'total_meetings': Meeting.objects.filter(created_at__lt=before).count(),
+        'total_teams': UserClass.objects.filter(created_at__lt=before).count(),
+    }
+    meeting_time = MeetingSession.objects.filter(left_at__lt=before).aggregate(total=Sum(SESSION_SECONDS))['total']
+    meeting_seconds = meeting_time.total_seconds() if meeting_time else 0
+
+    rows = []
+    day = start
+    while day < end:
+        values = figures.get(day, {})
+        for daily_field, total_field in RUNNING_TOTALS:
+            totals[total_field] += values.get(daily_field, 0)
+        meeting_seconds += values.get('meeting_seconds', 0)
+        rows.append({
+            'date': day,
+            **totals,
+            'total_meeting_minutes': int(meeting_seconds // 60),
+            **{
+                field: values.get(field, 0)
+                for field in ('new_users_today', 'active_users_today', 'meetings_today',
+                              'teams_created_today', 'total_logins_today', 'peak_concurrent_users')
+            },
+        })
+        day += timedelta(days=1)
+    return rows
+
+
+def generate(start, end, workers=1, chunk_days=31):
+    """Compute and save the SiteStatistics rows of [start, end); returns how many were written"""
+    rows = compute(start, end, workers, chunk_days)
+    fields = [field for field in rows[0] if field != 'date'] if rows else []
+    SiteStatistics.objects.bulk_create(
+        [SiteStatistics(**row) for row in rows],
+        update_conflicts=True, unique_fields=['date'], update_fields=fields, batch_size=500,
+    )
+    return len(rows)
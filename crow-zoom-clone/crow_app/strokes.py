@@ -0,0 +1,273 @@
+# crow_app/strokes.py - PACKED STROKE BATCHES FOR COLLABORATIVE DRAWING
+#
+# Binary `stroke-batch` frame (little-endian), sent as WebSocket bytes:
+#
+#   u8   version (STROKE_BATCH_VERSION)
+#   u8   palette size P
+#   P x  (u8 tool, u8 r, u8 g, u8 b, u8 brush size)    tool: 0 pen, 1 eraser
+#   u16  stroke count S
+#   S x  (u8 palette index, u16 point count N,
+#         u16 x0, u16 y0, (N - 1) x (i8 dx, i8 dy))
+#
+# Coordinates are quantized to 0..COORD_MAX of the canvas width/height, so
+# screens of different sizes draw in the same place. Steps larger than an
+# i8 are split into several points by the encoder.
+
+import struct
+from collections import deque
+
+STROKE_BATCH_VERSION = 1
+COORD_MAX = 4095
+MAX_STROKES = 1024
+MAX_POINTS = 4096
+
+_HEADER = struct.Struct('<BB')
+_PALETTE_ENTRY = struct.Struct('<BBBBB')
+_COUNT = struct.Struct('<H')
+_STROKE_HEADER = struct.Struct('<BHHH')
+
+
+def _clamp(value):
+    return min(max(value, 0), COORD_MAX)
+
+
+def decode_stroke_batch(data):
+    """
+    Parse a stroke-batch frame into (palette, strokes)
+
+    `palette` is a list of (tool, r, g, b, size) tuples and `strokes` a
+    list of (palette_index, [(x, y), ...]) with absolute coordinates.
+    Raises ValueError on a malformed frame.
+    """
+    try:
+        version, palette_size = _HEADER.unpack_from(data, 0)
+        if version != STROKE_BATCH_VERSION:
+            raise ValueError(f"Unsupported stroke batch version {version}")
+        offset = _HEADER.size
+
+        palette = []
+        for _ in range(palette_size):
+            palette.append(_PALETTE_ENTRY.unpack_from(data, offset))
+            offset += _PALETTE_ENTRY.size
+
+        (stroke_count,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        if stroke_count > MAX_STROKES:
+            raise ValueError(f"Too many strokes in batch: {stroke_count}")
+
+        strokes = []
+        for _ in range(stroke_count):
+            index, count, x, y = _STROKE_HEADER.unpack_from(data, offset)
+            offset += _STROKE_HEADER.size
+            if index >= palette_size or not 0 < count <= MAX_POINTS:
+                raise ValueError('Bad stroke header')
+
+            deltas = struct.unpack_from(f'<{2 * (count - 1)}b', data, offset)
+            offset += 2 * (count - 1)
+
+            points = [(_clamp(x), _clamp(y))]
+            for i in range(0, len(deltas), 2):
+                x += deltas[i]
+                y += deltas[i + 1]
+                points.append((_clamp(x), _clamp(y)))
+            strokes.append((index, points))
+    except struct.error as e:
+        raise ValueError(f"Truncated stroke batch: {e}")
+
+    if offset != len(data):
+        raise ValueError('Trailing bytes after stroke batch')
+    return palette, strokes
+
+
+def encode_stroke_batch(palette, strokes):
+    """Pack (palette, strokes) as produced by decode_stroke_batch into a frame"""
+    parts = [_HEADER.pack(STROKE_BATCH_VERSION, len(palette))]
+    parts.extend(_PALETTE_ENTRY.pack(*entry) for entry in palette)
+    parts.append(_COUNT.pack(len(strokes)))
+
+    for index, points in strokes:
+        x, y = points[0]
+        deltas = []
+        for next_x, next_y in points[1:]:
+            # Split steps an i8 cannot hold into several shorter ones
+            dx, dy = next_x - x, next_y - y
+            steps = max(1, -(-max(abs(dx), abs(dy)) // 127))
+            prev_x, prev_y = x, y
+            for step in range(1, steps + 1):
+                step_x = x + dx * step // steps
+                step_y = y + dy * step // steps
+                deltas.extend((step_x - prev_x, step_y - prev_y))
+                prev_x, prev_y = step_x, step_y
+            x, y = next_x, next_y
+
+        start_x, start_y = points[0]
+        parts.append(_STROKE_HEADER.pack(index, len(deltas) // 2 + 1, start_x, start_y))
+        parts.append(struct.pack(f'<{len(deltas)}b', *deltas))
+
+    return b''.join(parts)
+
+
+def simplify_polyline(points, epsilon):
+    """
+    Ramer-Douglas-Peucker simplification
+
+    Drops points closer than `epsilon` (in quantized units) to the line
+    through their neighbours; the first and last points are always kept.
+    """
+    if epsilon <= 0 or len(points) < 3:
+        return points
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    epsilon_sq = epsilon * epsilon
+
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+
+        farthest, max_dist_sq = None, epsilon_sq
+        for i in range(first + 1, last):
+            px, py = points[i]
+            if length_sq:
+                cross = dx * (py - y1) - dy * (px - x1)
+                dist_sq = cross * cross / length_sq
+            else:
+                dist_sq = (px - x1) ** 2 + (py - y1) ** 2
+            if dist_sq > max_dist_sq:
+                farthest, max_dist_sq = i, dist_sq
+
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+class StrokeBatch:
+    """
+    Strokes from one sender waiting for the next broadcast tick
+
+    Palettes from the incoming frames are merged so each (tool, colour,
+    size) appears once in the outgoing frame, and a segment that starts
+    where the previous stroke ended is appended to it. No stroke grows
+    past MAX_POINTS: the rest continues in a new stroke from the same point.
+    """
+
+    def __init__(self):
+        self.palette = []
+        self._palette_index = {}
+        self.strokes = []
+        self.points = 0
+
+    def add(self, palette, strokes):
+        for index, points in strokes:
+            entry = palette[index]
+            merged = self._palette_index.get(entry)
+            if merged is None:
+                if len(self.palette) == 255:
+                    continue  # u8 palette is full; drop the stroke rather than the batch
+                merged = self._palette_index[entry] = len(self.palette)
+                self.palette.append(entry)
+            points = list(points)
+            if self.strokes and self.strokes[-1][0] == merged and self.strokes[-1][1][-1] == points[0]:
+                # Continuation of the previous segment: extend that stroke
+                last = self.strokes[-1][1]
+                taken = points[1:1 + MAX_POINTS - len(last)]
+                last.extend(taken)
+                self.points += len(taken)
+                points = points[len(taken):]
+                if len(points) < 2:
+                    continue
+            while points:
+                self.strokes.append((merged, points[:MAX_POINTS]))
+                self.points += len(self.strokes[-1][1])
+                points = points[MAX_POINTS - 1:] if len(points) > MAX_POINTS else []
+
+    def encode(self, epsilon=0):
+        """Pack the batch, simplifying each (possibly merged) stroke first"""
+        self.strokes = [(index, simplify_polyline(points, epsilon)) for index, points in self.strokes]
+        self.points = sum(len(points) for index, points in self.strokes)
+        return encode_stroke_batch(self.palette, self.strokes)
+
+
+class StrokeLog:
+    """
+    Drawing history for one room, for peers that join mid-meeting
+
+    Broadcast frames are appended to a tail; every `compact_every` frames
+    the tail is merged into a vector snapshot, which keeps at most
+    `max_points` points by dropping the oldest strokes. A joining peer
+    gets snapshot and tail as a single stroke-batch frame.
+    """
+
+    def __init__(self, max_points=20000, compact_every=64, epsilon=0):
+        self.max_points = max_points
+        self.compact_every = compact_every
+        self.epsilon = epsilon
+        self.snapshot = StrokeBatch()
+        self.tail = []
+        self.restored = False  # persisted snapshot already loaded
+        self._seen = deque(maxlen=256)
+        self._frame = None
+
+    def __bool__(self):
+        return bool(self.snapshot.strokes or self.tail)
+
+    def append(self, frame, batch_id=None):
+        """Record a broadcast frame; a batch_id already seen is ignored"""
+        if batch_id is not None:
+            if batch_id in self._seen:
+                return
+            self._seen.append(batch_id)
+        self.tail.append(frame)
+        self._frame = None
+        if len(self.tail) >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Merge the tail into the snapshot and trim it to max_points"""
+        strokes = [(self.snapshot.palette[index], points) for index, points in self.snapshot.strokes]
+        for frame in self.tail:
+            try:
+                palette, frame_strokes = decode_stroke_batch(frame)
+            except ValueError:
+                continue
+            strokes.extend((palette[index], points) for index, points in frame_strokes)
+        self.tail = []
+
+        total = sum(len(points) for entry, points in strokes)
+        while strokes and total > self.max_points:
+            total -= len(strokes.pop(0)[1])
+
+        # Rebuilding also drops palette entries no remaining stroke uses
+        snapshot = StrokeBatch()
+        for entry, points in strokes:
+            snapshot.add([entry], [(0, points)])
+        self.snapshot = snapshot
+        self._frame = None
+
+    def clear(self):
+        self.snapshot = StrokeBatch()
+        self.tail = []
+        self._frame = None
+
+    def state_frame(self):
+        """Snapshot plus tail as one encoded frame, or None when nothing is drawn"""
+        if not self:
+            return None
+        if self._frame is None:
+            if self.tail:
+                self.compact()
+            self._frame = self.snapshot.encode(self.epsilon)
+        return self._frame
+
+    def load(self, frame):
+        """Restore a frame saved by state_frame()"""
+        palette, strokes = decode_stroke_batch(frame)
+        self.snapshot = StrokeBatch()
+        self.snapshot.add(palette, strokes)
+        self._frame = None
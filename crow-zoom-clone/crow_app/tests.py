@@ -0,0 +1,1462 @@
+# crow_app/tests.py - QUERY-PLAN REGRESSION SUITE AND BEHAVIOUR TESTS
+#
+# AnalyticsQueryPlanTests seeds every tracking table, runs the code paths behind the admin
+# dashboard, analytics API and statistics jobs, and EXPLAINs each SELECT
+# they issue. None of them may scan a tracking table without an index, so
+# dropping an index or writing a filter that defeats one (a function
+# wrapped around the column, a raw `date(...)` grouping) fails here rather
+# than on a large production table. The plans read are SQLite's. The other
+# classes check what the denormalized and streamed data actually contain,
+# and drive the signaling consumer through WebsocketCommunicator clients.
+# Run with `python manage.py test crow_app`.
+
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.template import TemplateDoesNotExist
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient, AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    admin_views, concurrency, export, retention, rollups, rooms, session_buffer, site_stats, user_agent_cache,
+    user_stats, widget_cache,
+)
+from .management.commands import loadtest_signaling
+from .presence import LocalPresenceBackend, UnixSocketPresenceBackend
+from .activity import ActivityPipeline
+from .channel_layers import UnixSocketChannelLayer, _Broker
+from .middleware import ActivityTrackingMiddleware, SessionTrackingMiddleware
+from .outbox import SendQueue
+from .models import (
+    AdminRole, ClassMembership, Contact, Meeting, MeetingRoom, MeetingSession, OnlineUser, Room,
+    SessionDailyAggregate, UserActivity, UserAgent, UserClass, UserSession, UserStats,
+)
+from .rollups import day_start, totals
+from .rooms import room_registry
+from .routing import websocket_urlpatterns
+from .session_buffer import SessionTouchBuffer
+from .sfu import sfu_available
+from .strokes import MAX_POINTS, StrokeLog, decode_stroke_batch, encode_stroke_batch
+
+# Tables that grow with traffic; small lookup tables may be scanned
+TRACKING_TABLES = {
+    'crow_app_useractivity', 'crow_app_usersession', 'crow_app_meetingsession',
+    'crow_app_meeting', 'crow_app_onlineuser',
+}
+
+# A plan step reading a whole table ("SCAN table") or a whole index of it
+# ("SCAN table USING INDEX ..."); SEARCH steps are the indexed lookups
+SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?( USING (?:COVERING )?INDEX \w+)?')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'reads SQLite query plans')
+@override_settings(
+    ACTIVITY_PIPELINE={'ASYNC': False},
+    SESSION_TRACKING={'WRITE_BEHIND': False},
+    DASHBOARD_CACHE={'BACKGROUND': False},
+)
+class AnalyticsQueryPlanTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.admin = User.objects.create_user('admin', password='pass')
+        AdminRole.objects.create(user=cls.admin, role='super_admin')
+        users = [User.objects.create_user(f'user{i}', password='pass') for i in range(5)]
+        room = Room.objects.create(name='Standup', host=cls.admin)
+        meeting = Meeting.objects.create(room=room, title='Standup', scheduled_time=now)
+        Meeting.objects.create(room=room, title='Retro', scheduled_time=now)
+        for code in ('CS101', 'CS102'):
+            UserClass.objects.create(name=code, code=code, created_by=cls.admin)
+        for i, user in enumerate(users):
+            started = now - timedelta(hours=i * 5)
+            UserSession.objects.create(user=user, session_key=f'session{i}', login_time=started)
+            MeetingSession.objects.create(user=user, meeting=meeting, room=room, left_at=started + timedelta(minutes=30))
+            UserActivity.objects.create(user=user, activity_type='login', timestamp=started)
+            OnlineUser.objects.create(user=user, is_in_meeting=i % 2 == 0, current_meeting=meeting)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def full_scans(self, sql):
+        """Tracking tables the plan of `sql` reads in full"""
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            steps = [row[-1] for row in cursor.fetchall()]
+        aliases = {alias: table for table, alias in re.findall(r'"(\w+)" ([A-Z]\d+)\b', sql)}
+        scanned = set()
+        for match in filter(None, map(SCAN.match, steps)):
+            # Walking an index is fine when it stops early (ordered LIMIT)
+            # or is the whole point of the query (counting every row)
+            if match.group(2) and (' LIMIT ' in sql or ' WHERE ' not in sql):
+                continue
+            scanned.add(aliases.get(match.group(1), match.group(1)))
+        return scanned & TRACKING_TABLES
+
+    def assertNoFullScans(self, run):
+        """Run `run` and check the plan of every SELECT it issued"""
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        selects = [query['sql'] for query in queries if query['sql'].lstrip().upper().startswith('SELECT')]
+        self.assertTrue(selects, 'no queries were captured')
+        for sql in selects:
+            with self.subTest(sql=sql[:200]):
+                self.assertEqual(self.full_scans(sql), set())
+
+    def assertUsesIndex(self, queryset, index):
+        self.assertIn(index, queryset.explain())
+
+    # === Indexes behind the hot filters ===
+
+    def test_activity_type_and_time(self):
+        since = timezone.now() - timedelta(days=1)
+        self.assertUsesIndex(UserActivity.objects.filter(activity_type='login', timestamp__gte=since), 'activity_type_time_idx')
+        self.assertUsesIndex(UserActivity.objects.filter(user=self.admin, timestamp__gte=since), 'activity_user_time_idx')
+        self.assertUsesIndex(UserActivity.objects.order_by('-timestamp')[:20], 'activity_time_idx')
+
+    def test_session_login_time(self):
+        since = timezone.now() - timedelta(days=1)
+        self.assertUsesIndex(UserSession.objects.filter(user=self.admin, login_time__gte=since), 'session_user_login_idx')
+        self.assertUsesIndex(UserSession.objects.filter(login_time__gte=since), 'session_login_idx')
+
+    def test_meeting_session_times(self):
+        since = timezone.now() - timedelta(days=1)
+        self.assertUsesIndex(MeetingSession.objects.filter(user=self.admin, joined_at__gte=since), 'msession_user_joined_idx')
+        # Unordered: with the default -joined_at ordering SQLite (no ANALYZE
+        # stats) prefers walking msession_joined_idx to skip the sort
+        self.assertUsesIndex(MeetingSession.objects.filter(left_at__gte=since).order_by(), 'msession_left_joined_idx')
+        self.assertUsesIndex(MeetingSession.objects.filter(joined_at__gte=since), 'msession_joined_idx')
+
+    def test_meeting_created_at(self):
+        self.assertUsesIndex(Meeting.objects.filter(created_at__gte=timezone.now() - timedelta(days=1)), 'meeting_created_idx')
+
+    def test_online_users_in_meetings(self):
+        self.assertUsesIndex(OnlineUser.objects.filter(is_in_meeting=True), 'onlineuser_in_meeting_idx')
+
+    # === Code paths ===
+
+    def test_dashboard_widgets(self):
+        for compute in (
+            admin_views.overview_widget, admin_views.user_analytics_widget, admin_views.team_analytics_widget,
+            admin_views.meeting_stats_widget, admin_views.activity_widget, admin_views.device_browser_widget,
+            admin_views.concurrency_widget, admin_views.recent_activity_widget,
+        ):
+            with self.subTest(widget=compute.__name__):
+                self.assertNoFullScans(compute)
+
+    def test_dashboard_page(self):
+        self.assertNoFullScans(lambda: self.client.get(reverse('admin_dashboard')))
+
+    def test_analytics_api(self):
+        for chart_type in ('users', 'meetings', 'logins', 'activity', 'concurrency', 'meeting_peaks'):
+            with self.subTest(chart_type=chart_type):
+                self.assertNoFullScans(lambda: self.client.get(reverse('admin_analytics_api'), {'type': chart_type}))
+
+    def test_admin_user_pages(self):
+        for url in (reverse('admin_users_list'), reverse('admin_manage_users'),
+                    reverse('admin_user_detail', args=[self.admin.id])):
+            with self.subTest(url=url):
+                self.assertNoFullScans(lambda: self.client.get(url))
+
+    def test_admin_list_pages(self):
+        for name in ('admin_meetings_list', 'admin_teams_list'):
+            with self.subTest(url=name):
+                self.assertNoFullScans(lambda: self.client.get(reverse(name)))
+        for kind in admin_views.ADMIN_LISTS:
+            with self.subTest(kind=kind):
+                url = reverse('admin_list_api', args=[kind])
+                first = self.client.get(url, {'limit': 1}).json()
+                self.assertNoFullScans(lambda: self.client.get(url, {'limit': 1, 'cursor': first['next']}))
+
+    def test_exports(self):
+        since = timezone.now() - timedelta(days=1)
+        for name in export.EXPORTS:
+            for filters in ({'start': since}, {'user_ids': [self.admin.id], 'start': since}):
+                with self.subTest(export=name, filters=list(filters)):
+                    self.assertNoFullScans(lambda: b''.join(export.export_stream(name, **filters)))
+
+    def test_user_analytics_page(self):
+        def run():
+            try:
+                self.client.get(reverse('user_analytics'))
+            except TemplateDoesNotExist:
+                pass  # the page has no template yet; its queries ran before rendering
+        self.assertNoFullScans(run)
+
+    def test_site_statistics(self):
+        today = timezone.localdate()
+        self.assertNoFullScans(lambda: site_stats.daily_figures(today - timedelta(days=7), today + timedelta(days=1)))
+
+    def test_concurrency_intervals(self):
+        start_at = day_start(timezone.localdate() - timedelta(days=1))
+        for kind in concurrency.KINDS:
+            with self.subTest(kind=kind):
+                self.assertNoFullScans(lambda: concurrency.load_intervals(kind, start_at, timezone.now()))
+
+    def test_concurrency_intervals_are_bounded_from_below(self):
+        # An index range with only an upper bound on the start reads every
+        # session before the window; the sweep must seek by end time instead
+        start_at = day_start(timezone.localdate() - timedelta(days=1))
+        for kind, index, unbounded in (
+            ('users', 'session_end_idx', '(login_time<?)'),
+            ('meetings', 'msession_left_joined_idx', '(joined_at<?)'),
+        ):
+            with self.subTest(kind=kind):
+                with CaptureQueriesContext(connection) as queries:
+                    concurrency.load_intervals(kind, start_at, timezone.now())
+                [sql] = [query['sql'] for query in queries if query['sql'].lstrip().upper().startswith('SELECT')]
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                    plan = ' '.join(row[-1] for row in cursor.fetchall())
+                self.assertIn(index, plan)
+                self.assertNotIn(unbounded, plan)
+
+
+class StrokeLogTests(SimpleTestCase):
+
+    def test_compacted_continuations_round_trip(self):
+        # 200 frames each continuing the stroke of the one before
+        log = StrokeLog(max_points=100000, compact_every=1000)
+        pen = (0, 0, 0, 0, 2)
+        for frame in range(200):
+            # Back and forth across the canvas so every step is one unit
+            points = [(1000 - abs((frame * 29 + i) % 2000 - 1000), 100) for i in range(30)]
+            log.append(encode_stroke_batch([pen], [(0, points)]))
+
+        frame = log.state_frame()
+        _, strokes = decode_stroke_batch(frame)
+        self.assertTrue(all(len(points) <= MAX_POINTS for _, points in strokes))
+        self.assertEqual(sum(len(points) for _, points in strokes), 200 * 29 + len(strokes))
+
+        restored = StrokeLog()
+        restored.load(frame)
+        self.assertEqual(restored.state_frame(), frame)
+
+
+@override_settings(ACTIVITY_PIPELINE={'ASYNC': False}, SESSION_TRACKING={'WRITE_BEHIND': False})
+class MeetingSessionRollupTests(TestCase):
+
+    def test_counted_once_when_ended(self):
+        user = User.objects.create_user('host')
+        room = Room.objects.create(name='Standup', host=user)
+        meeting = Meeting.objects.create(room=room, title='Standup', scheduled_time=timezone.now())
+
+        MeetingSession.objects.create(user=user, meeting=meeting, room=room, left_at=timezone.now())
+        self.assertEqual(totals('meeting_session')['count'], 1)
+
+        session = MeetingSession.objects.create(user=user, meeting=meeting, room=room)
+        self.assertEqual(totals('meeting_session')['count'], 1)
+        session.left_at = timezone.now()
+        session.save()
+        self.assertEqual(totals('meeting_session')['count'], 2)
+
+        # Saving an ended session again, fresh from the database or not, adds nothing
+        session.save()
+        MeetingSession.objects.get(pk=session.pk).save()
+        self.assertEqual(totals('meeting_session')['count'], 2)
+
+
+@override_settings(ACTIVITY_PIPELINE={'ASYNC': False}, SESSION_TRACKING={'WRITE_BEHIND': False})
+class RetentionTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.archive_dir = directory.name
+        settings = override_settings(RETENTION={'ARCHIVE_DIR': self.archive_dir})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_rows_archived_before_a_crash_are_counted_once(self):
+        user = User.objects.create_user('member')
+        old = timezone.now() - timedelta(days=100)
+        for _ in range(3):
+            UserActivity.objects.create(user=user, activity_type='login', timestamp=old)
+        cutoff, day = retention.default_cutoff(), timezone.localdate(old)
+
+        def rebuilt():
+            rollups.rebuild(day, day + timedelta(days=1), ['activity'])
+            return totals('activity', day, day + timedelta(days=1))['count']
+
+        # Crash after the segment was written, before the delete committed
+        with mock.patch('django.db.models.QuerySet.delete', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                retention.archive_chunk('useractivity', cutoff, 2)
+        self.assertEqual(UserActivity.objects.count(), 3)
+        self.assertEqual(len(list(retention.iter_archive('useractivity'))), 2)
+        self.assertEqual(rebuilt(), 3)
+
+        while retention.archive_chunk('useractivity', cutoff, 2):
+            pass
+        self.assertEqual(UserActivity.objects.count(), 0)
+        self.assertEqual(len(list(retention.iter_archive('useractivity'))), 3)
+        self.assertEqual(rebuilt(), 3)
+
+
+@override_settings(ACTIVITY_PIPELINE={'ASYNC': False}, SESSION_TRACKING={'WRITE_BEHIND': False})
+class SiteStatsTests(TestCase):
+
+    def test_active_users_counted_once_across_archived_and_live_rows(self):
+        ann, bob, cy = (User.objects.create_user(name) for name in ('ann', 'bob', 'cy'))
+        day = timezone.localdate() - timedelta(days=3)
+        at = day_start(day) + timedelta(hours=12)
+        # The archiver moved ann's morning session; her evening one and bob's are live
+        SessionDailyAggregate.objects.create(date=day, user=ann, session_count=1)
+        SessionDailyAggregate.objects.create(date=day, user=cy, session_count=2)
+        for user, key in ((ann, 'ann-evening'), (bob, 'bob'), (bob, 'bob-again')):
+            UserSession.objects.create(user=user, session_key=key)
+        UserSession.objects.update(login_time=at)  # auto_now_add
+
+        figures = site_stats.daily_figures(day, day + timedelta(days=1))
+        self.assertEqual(figures[day]['active_users_today'], 3)
+
+
+@override_settings(ACTIVITY_PIPELINE={'ASYNC': False}, SESSION_TRACKING={'WRITE_BEHIND': False})
+class UserStatsTests(TestCase):
+    """UserStats kept equal to the counts of the tables it stands in for"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'member-{i}') for i in range(3)]
+        room = Room.objects.create(name='Standup', host=cls.users[0])
+        cls.meeting = Meeting.objects.create(room=room, title='Standup', scheduled_time=timezone.now())
+        cls.team = UserClass.objects.create(name='Team', code='TEAM', created_by=cls.users[0])
+
+    def assertStatsMatchTables(self):
+        stored = {
+            row['user_id']: row
+            for row in UserStats.objects.values('user_id', *user_stats.COUNT_FIELDS, 'last_seen')
+        }
+        for user_id, fields in user_stats.compute([user.pk for user in self.users]).items():
+            self.assertEqual(stored[user_id], {'user_id': user_id, **fields})
+
+    def test_single_row_writes(self):
+        first, second, third = self.users
+        MeetingSession.objects.create(user=first, meeting=self.meeting, room=self.meeting.room)
+        membership = ClassMembership.objects.create(user=first, user_class=self.team)
+        Contact.objects.create(user=first, contact_user=second)
+        Contact.objects.create(user=first, contact_user=third)
+        UserSession.objects.create(user=second, session_key='single-row')
+        UserActivity.objects.create(user=third, activity_type='login')
+        self.assertStatsMatchTables()
+
+        membership.delete()
+        Contact.objects.filter(user=first, contact_user=second).get().delete()
+        MeetingSession.objects.filter(user=first).get().delete()
+        self.assertStatsMatchTables()
+        self.assertEqual(UserStats.objects.get(user=first).contact_count, 1)
+
+    def test_bulk_writes(self):
+        pipeline = ActivityPipeline(batch_size=1000, flush_interval=3600)
+        for i in range(5):
+            pipeline.put({
+                'user_id': self.users[i % 2].pk, 'activity_type': 'login',
+                'raw_user_agent': '', 'timestamp': timezone.now(),
+            })
+        pipeline.flush()
+
+        buffer = SessionTouchBuffer(flush_interval=3600, batch_size=1000)
+        for i in range(4):
+            buffer.touch(self.users[i % 3].pk, f'bulk-{i}')
+        buffer.touch(self.users[0].pk, 'bulk-0')  # coalesced into the first
+        buffer.flush()
+        buffer.touch(self.users[0].pk, 'bulk-0')  # an update, not a new session
+        buffer.flush()
+
+        self.assertEqual(UserActivity.objects.count(), 5)
+        self.assertEqual(UserSession.objects.count(), 4)
+        self.assertStatsMatchTables()
+
+    def test_reconcile_repairs_drift(self):
+        first, second, _ = self.users
+        Contact.objects.create(user=first, contact_user=second)
+        UserActivity.objects.create(user=second, activity_type='login')
+        UserStats.objects.filter(user=first).update(contact_count=7, session_count=3)
+        UserStats.objects.filter(user=second).delete()
+
+        self.assertEqual(user_stats.reconcile(batch_size=2), (3, 2))
+        self.assertStatsMatchTables()
+        # Nothing left to write
+        self.assertEqual(user_stats.reconcile(), (3, 0))
+
+
+class MigrationTestCase(TransactionTestCase):
+    """Seeds rows through the historical models of `before` and migrates forward to `after`"""
+
+    before = after = None
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('crow_app', target)])
+        executor.loader.build_graph()
+        return executor.loader.project_state([('crow_app', target)]).apps
+
+    def setUp(self):
+        self.old_apps = self.migrate(self.before)
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes('crow_app')[0][1])
+
+
+class UserStatsMigrationTests(MigrationTestCase):
+    before, after = '0011_analytics_indexes', '0012_user_stats'
+
+    def test_existing_users_are_counted(self):
+        get = self.old_apps.get_model
+        first, second = (get('auth', 'User').objects.create(username=f'existing-{i}') for i in range(2))
+        room = get('crow_app', 'Room').objects.create(name='Standup', host=first)
+        meeting = get('crow_app', 'Meeting').objects.create(room=room, title='Standup', scheduled_time=timezone.now())
+        get('crow_app', 'MeetingSession').objects.create(user=first, meeting=meeting, room=room)
+        get('crow_app', 'Contact').objects.create(user=first, contact_user=second)
+        for key in ('a', 'b'):
+            get('crow_app', 'UserSession').objects.create(user=first, session_key=key)
+        get('crow_app', 'SessionDailyAggregate').objects.create(user=first, date=timezone.localdate(), session_count=3)
+        get('crow_app', 'UserActivity').objects.create(user=second, activity_type='login')
+
+        stats = {row.user_id: row for row in self.migrate(self.after).get_model('crow_app', 'UserStats').objects.all()}
+        self.assertEqual(
+            [(row.session_count, row.meeting_count, row.contact_count, row.activity_count) for row in (stats[first.pk], stats[second.pk])],
+            [(5, 1, 1, 0), (0, 0, 0, 1)],
+        )
+        self.assertIsNotNone(stats[first.pk].last_seen)
+        self.assertIsNone(stats[second.pk].last_seen)
+
+
+@override_settings(RETENTION={'ARCHIVE_DIR': '/nonexistent'})
+class RollupsMigrationTests(MigrationTestCase):
+    before, after = '0015_concurrency_sweep_indexes', '0016_fill_rollups'
+
+    def test_existing_rows_are_counted(self):
+        get = self.old_apps.get_model
+        user = get('auth', 'User').objects.create(username='existing')
+        now = timezone.now()
+        for days_ago, activity_type in ((40, 'login'), (2, 'login'), (1, 'logout')):
+            get('crow_app', 'UserActivity').objects.create(
+                user=user, activity_type=activity_type, timestamp=now - timedelta(days=days_ago),
+            )
+
+        self.migrate(self.after)
+        today = timezone.localdate()
+        self.assertEqual(totals('activity', today - timedelta(days=60), today + timedelta(days=1))['count'], 3)
+        self.assertEqual(totals('activity', today - timedelta(days=7), today + timedelta(days=1))['count'], 2)
+
+
+@override_settings(ACTIVITY_PIPELINE={'ASYNC': False}, SESSION_TRACKING={'WRITE_BEHIND': False})
+class KeysetPaginationTests(TestCase):
+    """Admin list paging over rows that share their timestamps"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin')
+        AdminRole.objects.create(user=cls.admin, role='super_admin')
+        room = Room.objects.create(name='Standup', host=cls.admin)
+        now = timezone.now()
+        # Runs of ties, so the id alone decides the order within a run
+        for minutes in (0, 0, 0, 5, 5, 9, 9, 9, 9, 12):
+            meeting = Meeting.objects.create(room=room, title='Standup', scheduled_time=now)
+            Meeting.objects.filter(pk=meeting.pk).update(created_at=now - timedelta(minutes=minutes))
+            activity = UserActivity.objects.create(user=cls.admin, activity_type='login')
+            UserActivity.objects.filter(pk=activity.pk).update(timestamp=now - timedelta(minutes=minutes))
+        for code in ('A', 'B'):
+            UserClass.objects.create(name=code, code=code, created_by=cls.admin)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def walk(self, name, per_page):
+        """Ids of every page following next cursors, then of every page following previous ones back"""
+        pages = [admin_views.list_page(name, per_page=per_page)]
+        while pages[-1].has_next:
+            pages.append(admin_views.list_page(name, pages[-1].next_cursor, per_page))
+        self.assertFalse(pages[0].has_previous)
+        forward = [row.pk for page in pages for row in page]
+
+        backward = [pages[-1]]
+        while backward[-1].has_previous:
+            backward.append(admin_views.list_page(name, backward[-1].previous_cursor, per_page))
+        self.assertEqual([len(page) for page in backward], [len(page) for page in reversed(pages)])
+        return forward, [row.pk for page in reversed(backward) for row in page]
+
+    def test_pages_across_ties(self):
+        for name, model, timestamp in (('meetings', Meeting, 'created_at'), ('activities', UserActivity, 'timestamp')):
+            expected = list(model.objects.order_by(f'-{timestamp}', '-id').values_list('pk', flat=True))
+            for per_page in (1, 2, 3, 4, 10, 11):
+                with self.subTest(name=name, per_page=per_page):
+                    forward, backward = self.walk(name, per_page)
+                    self.assertEqual(forward, expected)
+                    self.assertEqual(backward, expected)
+
+    def test_api_pages_across_ties(self):
+        url = reverse('admin_list_api', args=['activities'])
+        seen = []
+        params = {'limit': 3}
+        while True:
+            page = self.client.get(url, params).json()
+            seen += [row['id'] for row in page['results']]
+            if not page['next']:
+                break
+            params['cursor'] = page['next']
+        self.assertEqual(seen, list(UserActivity.objects.order_by('-timestamp', '-id').values_list('pk', flat=True)))
+
+    def bad_cursors(self):
+        cursor = admin_views.list_page('meetings', per_page=3).next_cursor
+        return {
+            'garbage': 'not-a-cursor',
+            'truncated': cursor[:-4],
+            'edited': cursor[:-2] + ('AA' if cursor[-2:] != 'AA' else 'BB'),
+            'other table': admin_views.list_page('teams', per_page=1).next_cursor,
+            'other ordering': admin_views.list_page('activities', per_page=3).next_cursor,
+        }
+
+    def test_bad_cursor_is_rejected_by_the_api(self):
+        url = reverse('admin_list_api', args=['meetings'])
+        for label, cursor in self.bad_cursors().items():
+            with self.subTest(cursor=label):
+                self.assertEqual(self.client.get(url, {'cursor': cursor}).status_code, 400)
+
+    def test_bad_cursor_shows_the_first_page(self):
+        first = [meeting.pk for meeting in admin_views.list_page('meetings')]
+        for label, cursor in self.bad_cursors().items():
+            with self.subTest(cursor=label):
+                response = self.client.get(reverse('admin_meetings_list'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([meeting.pk for meeting in response.context['meetings']], first)
+
+
+@override_settings(
+    ACTIVITY_PIPELINE={'ASYNC': False},
+    SESSION_TRACKING={'WRITE_BEHIND': False},
+    EXPORT={'FLUSH_BYTES': 64},  # several chunks even for a few rows
+)
+class ExportTests(TestCase):
+    """What export_stream() writes, read back with the standard parsers"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(name) for name in ('ann', 'bob')]
+        cls.now = timezone.now().replace(microsecond=0)
+        descriptions = ['plain', 'comma, inside', 'a "quoted" word', 'two\nlines', 'ünïcode ✓', '']
+        for hours, description in enumerate(descriptions):
+            activity = UserActivity.objects.create(
+                user=cls.users[hours % 2], activity_type='login', description=description,
+            )
+            UserActivity.objects.filter(pk=activity.pk).update(timestamp=cls.now - timedelta(hours=hours))
+
+    def export(self, fmt='csv', **kwargs):
+        return b''.join(export.export_stream('activities', fmt, **kwargs))
+
+    def csv_rows(self, **kwargs):
+        rows = list(csv.reader(io.StringIO(self.export(**kwargs).decode('utf-8'), newline='')))
+        self.assertEqual(rows[0], export.columns('activities'))
+        return [dict(zip(rows[0], row)) for row in rows[1:]]
+
+    def test_csv_quoting(self):
+        rows = self.csv_rows()
+        expected = UserActivity.objects.order_by('timestamp', 'id')
+        self.assertEqual([row['id'] for row in rows], [str(activity.pk) for activity in expected])
+        self.assertEqual([row['description'] for row in rows], [activity.description for activity in expected])
+        self.assertEqual({row['user_username'] for row in rows}, {'ann', 'bob'})
+
+    def test_ndjson_keys(self):
+        lines = self.export('ndjson').decode('utf-8').split('\n')
+        self.assertEqual(lines.pop(), '')  # every line ends in a newline
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(len(records), UserActivity.objects.count())
+        for record in records:
+            self.assertEqual(list(record), export.columns('activities'))
+        self.assertEqual(
+            [record['description'] for record in records],
+            list(UserActivity.objects.order_by('timestamp', 'id').values_list('description', flat=True)),
+        )
+
+    def test_gzip_round_trip(self):
+        for fmt in export.FORMATS:
+            with self.subTest(fmt=fmt):
+                self.assertEqual(gzip.decompress(self.export(fmt, compress=True)), self.export(fmt))
+
+    def test_filters(self):
+        start, end = self.now - timedelta(hours=3), self.now - timedelta(hours=1)
+        cases = {
+            'start': ({'start': start}, UserActivity.objects.filter(timestamp__gte=start)),
+            'end': ({'end': end}, UserActivity.objects.filter(timestamp__lt=end)),
+            'range': ({'start': start, 'end': end}, UserActivity.objects.filter(timestamp__gte=start, timestamp__lt=end)),
+            'user': ({'user_ids': [self.users[1].pk]}, UserActivity.objects.filter(user=self.users[1])),
+            'all': ({'start': start, 'user_ids': [self.users[0].pk]},
+                    UserActivity.objects.filter(timestamp__gte=start, user=self.users[0])),
+        }
+        for label, (filters, expected) in cases.items():
+            with self.subTest(filters=label):
+                expected = [str(pk) for pk in expected.order_by('timestamp', 'id').values_list('pk', flat=True)]
+                self.assertTrue(expected)
+                self.assertEqual([row['id'] for row in self.csv_rows(**filters)], expected)
+
+
+@override_settings(
+    ACTIVITY_PIPELINE={'ASYNC': False},
+    SESSION_TRACKING={'WRITE_BEHIND': True},
+)
+class SessionWriteBehindTests(TestCase):
+    """Session rows under the write-behind buffer, flushed by hand"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('ann', password='pass')
+        self.buffer = SessionTouchBuffer(flush_interval=3600, batch_size=1000)
+        patcher = mock.patch.object(session_buffer, '_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_logout_before_the_flush(self):
+        before = timezone.now()
+        self.client.login(username='ann', password='pass')
+        session = UserSession.objects.get(user=self.user)  # written at login, not at the flush
+        self.assertGreaterEqual(session.login_time, before)
+
+        self.client.get(reverse('home'))
+        self.assertEqual(self.buffer.pending(), 1)
+        self.client.logout()
+        self.buffer.flush()
+
+        session.refresh_from_db()
+        self.assertFalse(session.is_active)
+        self.assertIsNotNone(session.logout_time)
+        self.assertEqual(UserSession.objects.count(), 1)
+
+    def test_logout_of_a_session_only_the_buffer_has_seen(self):
+        self.client.login(username='ann', password='pass')
+        UserSession.objects.all().delete()  # as if it was opened before login tracking
+        self.client.get(reverse('home'))
+        self.client.logout()
+        self.buffer.flush()
+
+        session = UserSession.objects.get(user=self.user)
+        self.assertFalse(session.is_active)
+        self.assertIsNotNone(session.logout_time)
+
+    def test_touches_coalesce(self):
+        for _ in range(3):
+            self.buffer.touch(self.user.pk, 'first', user_agent='Mozilla/5.0')
+        self.buffer.touch(self.user.pk, 'second')
+        self.assertEqual(self.buffer.pending(), 2)
+        self.assertEqual(self.buffer.stats()['coalesced'], 2)
+
+        self.buffer.flush()
+        self.assertEqual(self.buffer.pending(), 0)
+        self.assertEqual(sorted(UserSession.objects.values_list('session_key', flat=True)), ['first', 'second'])
+
+        self.buffer.touch(self.user.pk, 'first')
+        touched_at = self.buffer._sessions[(self.user.pk, 'first')]['last_activity']
+        self.buffer.flush()
+        self.assertEqual(UserSession.objects.count(), 2)
+        self.assertEqual(UserSession.objects.get(session_key='first').last_activity, touched_at)
+        self.assertEqual(self.buffer.stats()['flushed_sessions'], 3)
+
+
+def ints(values):
+    return np.array(values, dtype=np.int64)
+
+
+def brute_level(starts, ends, at):
+    return sum(1 for start, end in zip(starts, ends) if start <= at < end)
+
+
+class ConcurrencySweepTests(SimpleTestCase):
+    """The NumPy sweeps against brute force over small random intervals"""
+
+    def random_intervals(self, rng, count):
+        starts = [rng.randint(0, 20) for _ in range(count)]
+        return starts, [start + rng.randint(1, 12) for start in starts]
+
+    def test_bucket_peaks_events_on_an_edge(self):
+        # Both ends at 9 fall on the bucket's start: the peak is the level after them
+        peaks = concurrency.bucket_peaks(ints([1, 5, 8]), ints([9, 9, 19]), ints([0, 9, 11]))
+        self.assertEqual(peaks.tolist(), [3, 1])
+
+    def test_bucket_peaks(self):
+        rng = random.Random(21)
+        for _ in range(500):
+            starts, ends = self.random_intervals(rng, rng.randint(0, 6))
+            edges = sorted(set(rng.randint(0, 30) for _ in range(rng.randint(2, 6))))
+            if len(edges) < 2:
+                continue
+            expected = [
+                max(brute_level(starts, ends, at) for at in [low] + [t for t in starts + ends if low <= t < high])
+                for low, high in zip(edges, edges[1:])
+            ]
+            with self.subTest(starts=starts, ends=ends, edges=edges):
+                self.assertEqual(concurrency.bucket_peaks(ints(starts), ints(ends), ints(edges)).tolist(), expected)
+
+    def test_merge_overlaps(self):
+        rng = random.Random(22)
+        for _ in range(300):
+            starts, ends = self.random_intervals(rng, rng.randint(0, 8))
+            owners = [rng.randint(1, 3) for _ in starts]
+            merged_starts, merged_ends, merged_owners = concurrency.merge_overlaps(ints(starts), ints(ends), ints(owners))
+            with self.subTest(starts=starts, ends=ends, owners=owners):
+                for owner in set(owners):
+                    covered = {t for s, e, o in zip(starts, ends, owners) if o == owner for t in range(s, e)}
+                    spans = [(s, e) for s, e, o in zip(merged_starts, merged_ends, merged_owners) if o == owner]
+                    # Same instants covered, by disjoint intervals that do not touch
+                    self.assertEqual({t for s, e in spans for t in range(s, e)}, covered)
+                    spans.sort()
+                    self.assertTrue(all(e < s for (_, e), (s, _) in zip(spans, spans[1:])))
+
+    def test_group_peaks(self):
+        rng = random.Random(23)
+        for _ in range(300):
+            starts, ends = self.random_intervals(rng, rng.randint(0, 8))
+            groups = [rng.randint(1, 3) for _ in starts]
+            expected = {}
+            for group in set(groups):
+                group_starts = [s for s, g in zip(starts, groups) if g == group]
+                group_ends = [e for e, g in zip(ends, groups) if g == group]
+                expected[group] = max(brute_level(group_starts, group_ends, at) for at in group_starts)
+            with self.subTest(starts=starts, ends=ends, groups=groups):
+                self.assertEqual(concurrency.group_peaks(ints(groups), ints(starts), ints(ends)), expected)
+
+
+class PresenceTests(SimpleTestCase):
+
+    def test_expiry(self):
+        registry = LocalPresenceBackend(timeout=60)
+        now = time.time()
+        registry.touch(1, 'ann', now=now - 120)
+        registry.set_meeting(3, 'cy', 7, now=now - 90)
+        registry.touch(2, 'bob', now=now - 30)
+        self.assertFalse(registry.is_online(1))
+        self.assertTrue(registry.is_online(2))
+        self.assertEqual(registry.get_online_count(), 1)
+
+        # A touch brings an expired user back
+        registry.touch(1, 'ann', '/rooms/')
+        self.assertEqual([entry.user_id for entry in registry.get_online_users()], [1, 2])
+
+    def test_most_recently_seen_first(self):
+        registry = LocalPresenceBackend(timeout=60)
+        now = time.time()
+        for user_id, seconds_ago in ((1, 3), (2, 2), (3, 1)):
+            registry.touch(user_id, f'user{user_id}', now=now - seconds_ago)
+        registry.set_meeting(1, 'user1', 7, now=now)
+        users = registry.get_online_users()
+        self.assertEqual([entry.user_id for entry in users], [1, 3, 2])
+        self.assertEqual((users[0].is_in_meeting, users[0].current_meeting_id), (True, 7))
+
+        registry.remove(3)
+        self.assertEqual([entry.user_id for entry in registry.get_online_users()], [1, 2])
+
+    def test_shared_over_a_unix_socket(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = f'{directory.name}/presence.sock'
+        serving = UnixSocketPresenceBackend(timeout=60, path=path)
+        other = UnixSocketPresenceBackend(timeout=60, path=path)
+
+        def wait_for_count(count):
+            for _ in range(50):
+                if serving.get_online_count() == count:
+                    return
+                time.sleep(0.02)  # updates are sent by a background thread
+
+        serving.touch(1, 'ann', '/rooms/')
+        wait_for_count(1)
+        self.addCleanup(serving._server.server_close)
+        self.addCleanup(serving._server.shutdown)
+        other.set_meeting(2, 'bob', 7)
+        wait_for_count(2)
+
+        self.assertIsNone(other._server)
+        self.assertTrue(other.is_online(1))
+        self.assertEqual(
+            [(entry.user_id, entry.is_in_meeting) for entry in other.get_online_users()],
+            [(2, True), (1, False)],
+        )
+
+
+@override_settings(ACTIVITY_PIPELINE={'ASYNC': False}, SESSION_TRACKING={'WRITE_BEHIND': False})
+class RoomPageTests(TestCase):
+
+    def test_page_loads_the_signaling_client(self):
+        user = User.objects.create_user('host', password='pass')
+        room = Room.objects.create(name='Standup', host=user)
+        self.client.force_login(user)
+        response = self.client.get(reverse('video_room', args=[room.id]))
+        self.assertContains(response, 'js/signaling.js')
+        self.assertContains(response, '/ws/video/')
+
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class SignalingTestCase(TransactionTestCase):
+    """Clients of the video room consumer, all on one in-memory channel layer (one worker)"""
+
+    application = URLRouter(websocket_urlpatterns)
+
+    def setUp(self):
+        self.room = f'room-{self._testMethodName}'
+        self.users = {}
+
+    def user(self, name):
+        if name not in self.users:
+            self.users[name] = User.objects.create_user(name)
+        return self.users[name]
+
+    async def connect(self, name, join=True, features=('ice-batch', 'sfu')):
+        """A connected client (joined unless join=False), with its connect-time frames read"""
+        client = WebsocketCommunicator(self.application, f'/ws/video/{self.room}/')
+        client.scope['user'] = self.users[name]
+        connected, _ = await client.connect()
+        self.assertTrue(connected)
+        if join:
+            await client.send_json_to({'type': 'join', 'features': list(features), 'media': {}})
+            self.assertEqual((await client.receive_json_from())['type'], 'room-state')
+        return client
+
+    async def frames(self, client, timeout=0.1):
+        """Every text frame the client gets until it has been quiet for `timeout`"""
+        frames = []
+        while not await client.receive_nothing(timeout):
+            output = await client.receive_output()
+            if 'text' in output:
+                frames.append(json.loads(output['text']))
+        return frames
+
+
+@unittest.skipUnless(sfu_available(), 'needs aiortc')
+@override_settings(SIGNALING={'SFU_MIN_PARTICIPANTS': 2})
+class SfuModeTests(SignalingTestCase):
+    """A room only uses this worker's forwarder while all of its members are on this worker"""
+
+    def test_registry_refuses_a_room_spanning_workers(self):
+        local = 'specific.worker-a'
+        for user_id, channel in (('1', f'{local}!1'), ('2', f'{local}!2'), ('3', 'specific.worker-b!3')):
+            room_registry.set_channel(self.room, user_id, channel, joinedAt=user_id, sfu=True)
+        self.assertFalse(room_registry.promote_to_sfu(self.room, 2, local))
+
+        room_registry.discard(self.room, '3')
+        # Admitted on another worker that has not announced it yet
+        self.assertFalse(room_registry.promote_to_sfu(self.room, 2, local, admitted=3))
+        self.assertTrue(room_registry.promote_to_sfu(self.room, 2, local, admitted=2))
+        self.assertEqual(room_registry.room_mode(self.room), 'sfu')
+        for user_id in ('1', '2'):
+            room_registry.discard(self.room, user_id)
+
+    def test_member_on_another_worker_moves_the_room_back_to_the_mesh(self):
+        self.user('ann'), self.user('bob')
+
+        async def run():
+            ann = await self.connect('ann')
+            bob = await self.connect('bob')
+            self.assertIn({'type': 'room-mode', 'mode': 'sfu', 'peer': 'sfu'}, await self.frames(ann))
+            self.assertEqual(room_registry.room_mode(self.room), 'sfu')
+
+            # A join announced from another worker's channel
+            await get_channel_layer().group_send(f'video_call_{self.room}', {
+                'type': 'user_joined', 'text': json.dumps({'type': 'user-joined', 'userId': '99'}),
+                'userId': '99', 'username': 'cy', 'media': {}, 'joinedAt': timezone.now().isoformat(),
+                'exclude_self': None, 'sender_channel': 'specific.other-worker!cy',
+            })
+            for client in (ann, bob):
+                frames = await self.frames(client)
+                self.assertEqual([frame['type'] for frame in frames], ['user-joined', 'room-mode'])
+                self.assertEqual(frames[1]['mode'], 'mesh')
+            self.assertEqual(room_registry.room_mode(self.room), 'mesh')
+
+            # A room with a member elsewhere is not switched again
+            await bob.disconnect()
+            bob = await self.connect('bob')
+            self.assertEqual(room_registry.room_mode(self.room), 'mesh')
+            await ann.disconnect()
+            await bob.disconnect()
+
+        async_to_sync(run)()
+
+
+@override_settings(SIGNALING={'STROKE_SIMPLIFY_EPSILON': 0, 'STROKE_BURST': 100, 'STROKE_TICK_MS': 0})
+class StrokeRateLimitTests(SignalingTestCase):
+
+    def test_longest_stroke_is_admitted(self):
+        self.user('ann'), self.user('bob')
+        stroke = [(i % 100, i // 100) for i in range(MAX_POINTS)]
+        frame = encode_stroke_batch([(0, 0, 0, 0, 2)], [(0, stroke)])
+
+        async def run():
+            ann = await self.connect('ann')
+            bob = await self.connect('bob')
+            await self.frames(ann)
+            limited = room_registry.stats['strokes_rate_limited']
+
+            await ann.send_to(bytes_data=frame)
+            output = await bob.receive_output()
+            _, strokes = decode_stroke_batch(output['bytes'])
+            self.assertEqual(sum(len(points) for _, points in strokes), MAX_POINTS)
+
+            # The burst is spent now
+            await ann.send_to(bytes_data=frame)
+            self.assertTrue(await bob.receive_nothing(0.1))
+            self.assertEqual(room_registry.stats['strokes_rate_limited'], limited + 1)
+            await ann.disconnect()
+            await bob.disconnect()
+
+        async_to_sync(run)()
+
+
+class AdmissionTests(SignalingTestCase):
+
+    async def refused(self, name):
+        """The message and close code a client that is not admitted gets"""
+        client = WebsocketCommunicator(self.application, f'/ws/video/{self.room}/')
+        client.scope['user'] = self.users[name]
+        connected, _ = await client.connect()
+        self.assertTrue(connected)  # accepted only to be told why it is refused
+        message = await client.receive_json_from()
+        return message, await self.close_code(client)
+
+    async def close_code(self, client):
+        while True:
+            output = await client.receive_output()
+            if output['type'] == 'websocket.close':
+                return output['code']
+
+    def test_full_room(self):
+        for name in ('ann', 'bob', 'cy'):
+            self.user(name)
+        self.room = str(MeetingRoom.objects.create(name='Standup', host=self.users['ann'], max_participants=2).id)
+
+        async def run():
+            ann = await self.connect('ann')
+            bob = await self.connect('bob')
+            self.assertEqual(await self.refused('cy'), ({'type': 'room-full', 'maxParticipants': 2}, 4003))
+
+            # A user connecting again keeps their place, and leaving frees it
+            ann_again = await self.connect('ann')
+            self.assertEqual(await self.close_code(ann), 4000)
+            await bob.disconnect()
+            cy = await self.connect('cy')
+            for client in (ann, ann_again, cy):
+                await client.disconnect()
+
+        async_to_sync(run)()
+
+    @override_settings(SIGNALING={'JOIN_BURST': 2, 'JOIN_RATE_PER_SEC': 1, 'JOIN_RETRY_JITTER': 0})
+    def test_join_rush_is_told_to_wait(self):
+        for name in ('ann', 'bob', 'cy'):
+            self.user(name)
+
+        async def run():
+            ann = await self.connect('ann')
+            bob = await self.connect('bob')
+            message, code = await self.refused('cy')
+            self.assertEqual((message['type'], code), ('wait', 4029))
+            self.assertGreater(message['retryAfter'], 0)
+            self.assertLessEqual(message['retryAfter'], 1)
+
+            await asyncio.sleep(message['retryAfter'] + 0.05)
+            cy = await self.connect('cy')
+            for client in (ann, bob, cy):
+                await client.disconnect()
+
+        async_to_sync(run)()
+
+
+class PeerSignalingTests(SignalingTestCase):
+    """Offers, answers and ICE go to the target peer only"""
+
+    def test_offer_is_sent_to_the_target_channel(self):
+        for name in ('ann', 'bob', 'cy'):
+            self.user(name)
+        bob_id = str(self.users['bob'].id)
+
+        async def run():
+            ann, bob, cy = [await self.connect(name) for name in ('ann', 'bob', 'cy')]
+            for client in (ann, bob, cy):
+                await self.frames(client)
+            unicast, fallback = room_registry.stats['unicast'], room_registry.stats['group_fallback']
+
+            await ann.send_json_to({'type': 'offer', 'target': bob_id, 'offer': {'type': 'offer', 'sdp': 'v=0'}})
+            [offer] = await self.frames(bob)
+            self.assertEqual((offer['type'], offer['sender'], offer['offer']['sdp']), ('offer', str(self.users['ann'].id), 'v=0'))
+            self.assertEqual(await self.frames(cy), [])
+            self.assertEqual(room_registry.stats['unicast'], unicast + 1)
+
+            # A peer this worker has no channel for is reached through the room group
+            await ann.send_json_to({'type': 'answer', 'target': '999', 'answer': {'type': 'answer', 'sdp': 'v=0'}})
+            self.assertEqual((await self.frames(bob), await self.frames(cy)), ([], []))
+            self.assertEqual(room_registry.stats['group_fallback'], fallback + 1)
+            for client in (ann, bob, cy):
+                await client.disconnect()
+
+        async_to_sync(run)()
+
+
+class IceBatchTests(SignalingTestCase):
+
+    def candidate(self, n):
+        return {'candidate': f'candidate:{n} 1 udp 2122260223 10.0.0.1 {50000 + n} typ host', 'sdpMid': '0'}
+
+    async def send_candidates(self, client, target, count):
+        for n in range(count):
+            await client.send_json_to({'type': 'ice-candidate', 'target': target, 'candidate': self.candidate(n)})
+
+    @override_settings(SIGNALING={'ICE_BATCH_WINDOW_MS': 50, 'ICE_BATCH_MAX': 8})
+    def test_candidates_are_batched_per_target(self):
+        self.user('ann'), self.user('bob'), self.user('cy')
+        ann_id, bob_id = str(self.users['ann'].id), str(self.users['bob'].id)
+
+        async def run():
+            ann = await self.connect('ann')
+            bob = await self.connect('bob')
+            cy = await self.connect('cy', features=())
+            for client in (ann, bob, cy):
+                await self.frames(client)
+
+            await self.send_candidates(ann, bob_id, 3)
+            [batch] = await self.frames(bob, timeout=0.2)
+            self.assertEqual((batch['type'], batch['sender']), ('ice-candidates', ann_id))
+            self.assertEqual(batch['candidates'], [self.candidate(n) for n in range(3)])
+
+            # A client that did not declare 'ice-batch' gets them one by one
+            await self.send_candidates(ann, str(self.users['cy'].id), 2)
+            frames = await self.frames(cy, timeout=0.2)
+            self.assertEqual([(frame['type'], frame['candidate']) for frame in frames],
+                             [('ice-candidate', self.candidate(n)) for n in range(2)])
+
+            # An offer goes out after the candidates held before it
+            await self.send_candidates(ann, bob_id, 1)
+            await ann.send_json_to({'type': 'offer', 'target': bob_id, 'offer': {'type': 'offer', 'sdp': 'v=0'}})
+            self.assertEqual([frame['type'] for frame in await self.frames(bob)], ['ice-candidates', 'offer'])
+            for client in (ann, bob, cy):
+                await client.disconnect()
+
+        async_to_sync(run)()
+
+    @override_settings(SIGNALING={'ICE_BATCH_WINDOW_MS': 60000, 'ICE_BATCH_MAX': 2})
+    def test_full_batch_is_sent_at_once(self):
+        self.user('ann'), self.user('bob')
+
+        async def run():
+            ann = await self.connect('ann')
+            bob = await self.connect('bob')
+            await self.frames(ann)
+            await self.send_candidates(ann, str(self.users['bob'].id), 2)
+            [batch] = await self.frames(bob)
+            self.assertEqual(len(batch['candidates']), 2)
+            await ann.disconnect()
+            await bob.disconnect()
+
+        async_to_sync(run)()
+
+
+class RosterTests(SignalingTestCase):
+
+    def test_reconnecting_user_is_listed_once(self):
+        for name in ('ann', 'bob', 'cy'):
+            self.user(name)
+        ann_id, bob_id = str(self.users['ann'].id), str(self.users['bob'].id)
+
+        async def run():
+            ann = WebsocketCommunicator(self.application, f'/ws/video/{self.room}/')
+            ann.scope['user'] = self.users['ann']
+            await ann.connect()
+            await ann.send_json_to({'type': 'join', 'features': [], 'media': {'audio': True}})
+            self.assertEqual((await ann.receive_json_from())['participants'], [])
+
+            bob = await self.connect('bob')
+            [joined] = await self.frames(ann)
+            self.assertEqual((joined['type'], joined['userId']), ('user-joined', bob_id))
+            await bob.send_json_to({'type': 'media-state', 'media': {'video': False}})
+            self.assertEqual(await self.frames(ann), [{'type': 'media-state', 'userId': bob_id, 'media': {'video': False}}])
+
+            # ann opens the room again in a new tab: her old session is closed, not listed twice
+            ann_again = await self.connect('ann')
+            self.assertEqual((await ann.receive_output())['type'], 'websocket.close')
+            self.assertEqual([frame['type'] for frame in await self.frames(bob)], ['user-joined'])
+
+            cy = WebsocketCommunicator(self.application, f'/ws/video/{self.room}/')
+            cy.scope['user'] = self.users['cy']
+            await cy.connect()
+            await cy.send_json_to({'type': 'join', 'features': [], 'media': {}})
+            state = await cy.receive_json_from()
+            self.assertEqual([member['userId'] for member in state['participants']], [bob_id, ann_id])
+            self.assertEqual(state['participants'][0]['media'], {'video': False})
+            self.assertEqual([member['userId'] for member in room_registry.roster(self.room)], [bob_id, ann_id, str(self.users['cy'].id)])
+            for client in (ann, ann_again, bob, cy):
+                await client.disconnect()
+
+        async_to_sync(run)()
+
+
+class PreEncodedFrameTests(SignalingTestCase):
+    """A broadcast is encoded once by the sender, however many members receive it"""
+
+    def test_media_state_is_encoded_once_per_broadcast(self):
+        names = ('ann', 'bob', 'cy', 'dee')
+        for name in names:
+            self.user(name)
+
+        async def run():
+            clients = [await self.connect(name) for name in names]
+            for client in clients:
+                await self.frames(client)
+
+            with mock.patch('crow_app.consumers.dumps', wraps=rooms.dumps) as encode:
+                await clients[0].send_json_to({'type': 'media-state', 'media': {'audio': False}})
+                received = [await self.frames(client) for client in clients[1:]]
+            self.assertEqual(encode.call_count, 1)
+            expected = {'type': 'media-state', 'userId': str(self.users['ann'].id), 'media': {'audio': False}}
+            self.assertEqual(received, [[expected]] * 3)
+            for client in clients:
+                await client.disconnect()
+
+        async_to_sync(run)()
+
+    @unittest.skipIf(rooms.orjson is None, 'needs orjson')
+    def test_fast_json_frames_match_the_stdlib(self):
+        payload = {'type': 'offer', 'offer': {'sdp': 'v=0\r\n'}, 'senderName': 'Zoë'}
+        with override_settings(SIGNALING={'FAST_JSON': True}):
+            fast = rooms.dumps(payload)
+        with override_settings(SIGNALING={'FAST_JSON': False}):
+            plain = rooms.dumps(payload)
+        self.assertEqual(fast, rooms.orjson.dumps(payload).decode())
+        self.assertEqual(plain, json.dumps(payload))
+        self.assertEqual(json.loads(fast), json.loads(plain))
+
+
+class LoadTestSignalingTests(SignalingTestCase):
+    """A small in-process run of manage.py loadtest_signaling"""
+
+    def test_communicator_run_reports_relay_latency(self):
+        options = {
+            'mode': 'communicator', 'rooms': 2, 'participants': 4, 'ramp': 100, 'session': 0.5,
+            'drawers': 0.5, 'draw_rate': 20, 'port': 0, 'seed': 1, 'json': True,
+        }
+        command = loadtest_signaling.Command()
+        command.options = options
+        result = command.run(options)
+
+        self.assertEqual(result['errors'], {})
+        self.assertEqual((result['participants'], result['rooms']), (4, 2))
+        self.assertGreaterEqual(result['peak_connections'], 2)
+        self.assertEqual(result['latency']['join']['count'], 4)
+        # The second member of each room offers to the first, who answers
+        self.assertEqual(result['latency']['offer']['count'], 2)
+        self.assertEqual(result['latency']['answer']['count'], 2)
+        self.assertGreater(result['latency']['ice']['count'], 0)
+        self.assertGreater(result['latency']['draw']['count'], 0)
+        self.assertEqual(result['messages_received'], sum(result['received_by_kind'].values()))
+        json.dumps(result)  # what --json prints
+
+
+class SendQueueTests(SimpleTestCase):
+
+    def stroke_frame(self, x):
+        return encode_stroke_batch([(0, 0, 0, 0, 2)], [(0, [(x, 0), (x, 10)])])
+
+    def drain(self, queue):
+        async def run():
+            return [await queue.get() for _ in range(len(queue))]
+        return async_to_sync(run)()
+
+    def test_signaling_goes_first_and_is_bounded(self):
+        queue = SendQueue(2, 4, Counter())
+        queue.put_drawing('draw')
+        self.assertTrue(queue.put('offer'))
+        self.assertTrue(queue.put('answer'))
+        self.assertFalse(queue.put('ice'))
+        self.assertEqual(self.drain(queue), [('offer', None), ('answer', None), ('draw', None)])
+
+    def test_full_drawing_queue_merges_stroke_batches(self):
+        stats = Counter()
+        queue = SendQueue(8, 2, stats)
+        for x in (1, 2, 3):
+            queue.put_drawing(bytes_data=self.stroke_frame(x))
+        [(_, merged), (_, last)] = self.drain(queue)
+        self.assertEqual([points[0] for _, points in decode_stroke_batch(merged)[1]], [(1, 0), (2, 0)])
+        self.assertEqual(last, self.stroke_frame(3))
+        self.assertEqual(stats['draw_coalesced'], 1)
+
+    def test_full_drawing_queue_drops_the_oldest_droppable_frame(self):
+        stats = Counter()
+        queue = SendQueue(8, 2, stats)
+        queue.put_drawing(bytes_data=self.stroke_frame(0), droppable=False)  # the board state for a newcomer
+        queue.put_drawing('first')
+        queue.put_drawing('second')
+        self.assertEqual([text or 'state' for text, _ in self.drain(queue)], ['state', 'second'])
+        self.assertEqual(stats['draw_dropped'], 1)
+
+    def test_clear_supersedes_queued_drawing(self):
+        stats = Counter()
+        queue = SendQueue(8, 8, stats)
+        for text in ('a', 'b'):
+            queue.put_drawing(text)
+        queue.put_drawing('clear', clear=True)
+        queue.put_drawing('c')
+        self.assertEqual(self.drain(queue), [('clear', None), ('c', None)])
+        self.assertEqual(stats['draw_dropped'], 2)
+
+
+class UnixSocketChannelLayerTests(SimpleTestCase):
+    """Two layers (as two workers would hold) talking through one broker on a temporary socket"""
+
+    def test_round_trip(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = f'{directory.name}/channels.sock'
+
+        async def run():
+            # Served in this loop rather than a spawned broker process
+            broker = asyncio.create_task(_Broker(UnixSocketChannelLayer(path=path, capacity=2)).serve(path))
+            while not os.path.exists(path):
+                await asyncio.sleep(0.01)
+            first, second = UnixSocketChannelLayer(path=path), UnixSocketChannelLayer(path=path)
+            try:
+                channel = await second.new_channel()
+                await first.send(channel, {'type': 'hello', 'payload': b'\x00\x01'})
+                self.assertEqual(await second.receive(channel), {'type': 'hello', 'payload': b'\x00\x01'})
+
+                # Capacity is per channel, and applies to whoever sends
+                await first.send(channel, {'type': 'one'})
+                await first.send(channel, {'type': 'two'})
+                with self.assertRaises(ChannelFull):
+                    await second.send(channel, {'type': 'three'})
+                self.assertEqual([(await second.receive(channel))['type'] for _ in range(2)], ['one', 'two'])
+
+                other = await first.new_channel()
+                for layer, member in ((first, other), (second, channel)):
+                    await layer.group_add('room', member)
+                await first.group_send('room', {'type': 'joined'})
+                self.assertEqual((await first.receive(other), await second.receive(channel)), ({'type': 'joined'}, {'type': 'joined'}))
+                await second.group_discard('room', channel)
+                await first.group_send('room', {'type': 'left'})
+                self.assertEqual(await first.receive(other), {'type': 'left'})
+
+                # Places are shared by both, and given back when a worker goes away
+                self.assertEqual(await first.try_admit('room', '1', other, 1, 0, 0), ['ok', None])
+                self.assertEqual(await second.try_admit('room', '2', channel, 1, 0, 0), ['full', None])
+                self.assertEqual(await second.count('room'), 1)
+                await first.close()
+                await asyncio.sleep(0.05)
+                self.assertEqual(await second.count('room'), 0)
+            finally:
+                await first.close()
+                await second.close()
+                await asyncio.sleep(0.05)  # let the broker see both connections close
+                broker.cancel()
+                await asyncio.gather(broker, return_exceptions=True)
+
+        async_to_sync(run)()
+
+
+@override_settings(ACTIVITY_PIPELINE={'ASYNC': False}, SESSION_TRACKING={'WRITE_BEHIND': False})
+class UserAgentCacheTests(TestCase):
+    FIREFOX = 'Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0'
+    SAFARI = 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 Version/17.0 Mobile/15E148 Safari/604.1'
+    CURL = 'curl/8.4.0'
+
+    def setUp(self):
+        user_agent_cache.forget_user_agent_ids()
+        self.addCleanup(user_agent_cache.forget_user_agent_ids)
+
+    def lookup(self, raw):
+        with self.captureOnCommitCallbacks(execute=True):
+            return user_agent_cache.get_user_agent_id(raw)
+
+    def test_ids_are_remembered(self):
+        first = self.lookup(self.FIREFOX)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.lookup(self.FIREFOX), first)
+        self.assertEqual(UserAgent.objects.get(pk=first).browser_family, 'Firefox')
+        self.assertEqual(UserAgent.objects.get(pk=self.lookup(self.SAFARI)).device_type, 'Mobile')
+
+    def test_least_recently_used_is_evicted(self):
+        with mock.patch.object(user_agent_cache, 'CACHE_SIZE', 2):
+            for raw in (self.FIREFOX, self.SAFARI, self.FIREFOX, self.CURL):
+                self.lookup(raw)
+            with self.assertNumQueries(0):
+                self.lookup(self.FIREFOX)
+                self.lookup(self.CURL)
+            with self.assertNumQueries(1):
+                self.lookup(self.SAFARI)  # the row exists; only the id was forgotten
+        self.assertEqual(UserAgent.objects.count(), 3)
+
+    def test_rolled_back_ids_are_not_remembered(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                user_agent_cache.get_user_agent_id(self.FIREFOX)
+                raise RuntimeError
+        self.assertFalse(UserAgent.objects.exists())
+        self.assertEqual(UserAgent.objects.filter(pk=self.lookup(self.FIREFOX)).count(), 1)
+
+    def test_deleting_a_row_forgets_the_ids(self):
+        first = self.lookup(self.FIREFOX)
+        UserAgent.objects.filter(pk=first).delete()
+        self.assertNotEqual(self.lookup(self.FIREFOX), first)
+
+
+class ActivityPipelineTests(SimpleTestCase):
+    """Backpressure policies, with the flusher thread and the database left out"""
+
+    def pipeline(self, policy, **options):
+        pipeline = ActivityPipeline(batch_size=100, flush_interval=3600, policy=policy, **options)
+        self.written = []
+        for name, replacement in (('_ensure_worker', lambda: None), ('_write_batch', self.written.extend)):
+            patcher = mock.patch.object(pipeline, name, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return pipeline
+
+    def queued(self, pipeline):
+        return [fields['n'] for fields in pipeline._queue]
+
+    def test_drop_oldest(self):
+        pipeline = self.pipeline('drop_oldest', max_queue=3)
+        self.assertTrue(all(pipeline.put({'n': n}) for n in range(5)))
+        self.assertEqual(self.queued(pipeline), [2, 3, 4])
+        self.assertEqual(pipeline.stats()['dropped'], 2)
+
+    def test_sample(self):
+        pipeline = self.pipeline('sample', max_queue=4, sample_rate=0.5)
+        with mock.patch('crow_app.activity.random.random', side_effect=[0.9, 0.1, 0.1, 0.1]):
+            kept = [pipeline.put({'n': n}) for n in range(6)]
+        # Everything below half full, then half the rest, never past full
+        self.assertEqual(kept, [True, True, False, True, True, False])
+        self.assertEqual(self.queued(pipeline), [0, 1, 3, 4])
+        self.assertEqual(pipeline.stats()['sampled_out'], 2)
+
+    def test_block(self):
+        pipeline = self.pipeline('block', max_queue=2, block_timeout=0.05)
+        self.assertTrue(pipeline.put({'n': 0}) and pipeline.put({'n': 1}))
+        self.assertFalse(pipeline.put({'n': 2}))  # nothing drained the queue in time
+        self.assertEqual(pipeline.stats()['dropped'], 1)
+
+        pipeline.block_timeout = 5
+        flusher = threading.Timer(0.05, pipeline.flush)
+        flusher.start()
+        self.assertTrue(pipeline.put({'n': 3}))  # waits for the flush to make room
+        flusher.join()
+        self.assertEqual([fields['n'] for fields in self.written], [0, 1])
+        self.assertEqual(self.queued(pipeline), [3])
+
+
+@override_settings(DASHBOARD_CACHE={'DEFAULT_TTL': 60, 'STALE_TTL': 600, 'BACKGROUND': False})
+class WidgetCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.fail = False
+
+        @widget_cache.widget('test-counter')
+        def counter():
+            if self.fail:
+                raise RuntimeError('database is down')
+            self.calls += 1
+            time.sleep(self.compute_seconds)
+            return {'calls': self.calls}
+
+        self.compute_seconds = 0
+        self.addCleanup(widget_cache._widgets.pop, 'test-counter')
+        self.addCleanup(widget_cache._locks.pop, 'test-counter')
+        self.now = time.time()
+
+    def get(self, after=0):
+        """The widget's context `after` seconds from the start of the test"""
+        with mock.patch('crow_app.widget_cache.time.time', return_value=self.now + after):
+            return widget_cache.get_widgets('test-counter')['calls']
+
+    def test_stale_value_is_served_while_it_refreshes(self):
+        self.assertEqual(self.get(), 1)
+        self.assertEqual(self.get(30), 1)   # fresh
+        self.assertEqual(self.get(90), 1)   # stale: served, and refreshed behind it
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.get(100), 2)
+
+    def test_failed_refresh_keeps_the_stale_value(self):
+        self.get()
+        self.fail = True
+        errors = widget_cache.stats()['refresh_errors']
+        self.assertEqual(self.get(90), 1)
+        self.assertEqual(widget_cache.stats()['refresh_errors'], errors + 1)
+        self.fail = False
+        self.assertEqual(self.get(95), 1)  # the next request past the TTL retries
+        self.assertEqual(self.get(96), 2)
+
+    def test_invalidation_recomputes(self):
+        self.get()
+        widget_cache.invalidate_widgets('test-counter')
+        self.assertEqual(self.get(1), 2)
+
+    def test_concurrent_misses_compute_once(self):
+        self.compute_seconds = 0.1
+        threads = [threading.Thread(target=widget_cache.get_widgets, args=('test-counter',)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+
+
+@override_settings(ACTIVITY_PIPELINE={'ASYNC': False}, SESSION_TRACKING={'WRITE_BEHIND': False})
+class AsyncTrackingMiddlewareTests(TransactionTestCase):
+    """The __acall__ paths the tracking middlewares take under ASGI"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('member', password='pass')
+
+    def test_request_is_tracked_without_the_sync_path(self):
+        presence = LocalPresenceBackend()
+        client = AsyncClient()
+        client.force_login(self.user)
+        UserSession.objects.update(last_activity=timezone.now() - timedelta(hours=1))
+
+        with mock.patch('crow_app.middleware.get_presence_backend', return_value=presence), \
+                mock.patch.object(SessionTrackingMiddleware, 'process_request') as process_request:
+            response = async_to_sync(client.get)(reverse('settings'))
+        self.assertEqual(response.status_code, 200)
+        process_request.assert_not_called()
+        self.assertTrue(presence.is_online(self.user.id))
+        self.assertEqual(presence.get_online_users()[0].current_page, reverse('settings'))
+        session = UserSession.objects.get(user=self.user)
+        self.assertGreater(session.last_activity, timezone.now() - timedelta(minutes=1))
+
+    def test_successful_post_records_its_activity(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = ActivityTrackingMiddleware(get_response)
+        request = AsyncRequestFactory().post(reverse('settings'))
+        request.user = self.user
+        async_to_sync(middleware)(request)
+        self.assertEqual(
+            list(UserActivity.objects.filter(user=self.user).values_list('activity_type', flat=True)),
+            ['settings_updated'],
+        )
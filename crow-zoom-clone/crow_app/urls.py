@@ -47,6 +47,9 @@ urlpatterns = [
     path('admin-dashboard/teams/', admin_views.admin_teams_list, name='admin_teams_list'),
     path('admin-dashboard/meetings/', admin_views.admin_meetings_list, name='admin_meetings_list'),
     path('admin-dashboard/analytics-api/', admin_views.admin_analytics_api, name='admin_analytics_api'),
+    path('admin-dashboard/list-api/<str:kind>/', admin_views.admin_list_api, name='admin_list_api'),
+    path('admin-dashboard/export/<str:kind>/', admin_views.admin_export, name='admin_export'),
+    path('admin-dashboard/tracking-metrics/', admin_views.admin_tracking_metrics, name='admin_tracking_metrics'),
     path('admin-dashboard/make-admin/<int:user_id>/', admin_views.make_admin, name='make_admin'),
 
 
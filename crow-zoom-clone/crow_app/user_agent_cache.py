@@ -0,0 +1,95 @@
+# crow_app/user_agent_cache.py - INTERNED USER AGENT LOOKUPS
+
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+import user_agents
+from django.db import transaction
+from django.db.models.signals import post_delete
+
+ParsedUserAgent = namedtuple('ParsedUserAgent', ['device_type', 'browser_family', 'browser_version'])
+
+CACHE_SIZE = 2048
+
+
+def hash_user_agent(raw):
+    """Stable key for the UserAgent dimension table"""
+    return hashlib.sha1(raw.encode('utf-8', 'replace')).hexdigest()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_user_agent(raw):
+    """Parse a raw user agent string once per distinct value"""
+    ua = user_agents.parse(raw)
+
+    if ua.is_mobile:
+        device_type = 'Mobile'
+    elif ua.is_tablet:
+        device_type = 'Tablet'
+    elif ua.is_pc:
+        device_type = 'Desktop'
+    else:
+        device_type = 'Unknown'
+
+    return ParsedUserAgent(
+        device_type=device_type,
+        browser_family=ua.browser.family[:50],
+        browser_version=ua.browser.version_string[:50],
+    )
+
+
+# raw user agent -> UserAgent id, least recently used first. An id is only
+# remembered once the row is committed, so a rolled-back get_or_create
+# cannot leave ids of rows that never existed behind
+_ids = OrderedDict()
+_ids_lock = threading.Lock()
+
+
+def _remember(raw, user_agent_id):
+    with _ids_lock:
+        _ids[raw] = user_agent_id
+        _ids.move_to_end(raw)
+        while len(_ids) > CACHE_SIZE:
+            _ids.popitem(last=False)
+
+
+def get_user_agent_id(raw):
+    """Map a raw user agent string to its UserAgent row id, creating it if needed"""
+    from .models import UserAgent
+
+    if not raw:
+        return None
+
+    with _ids_lock:
+        if raw in _ids:
+            _ids.move_to_end(raw)
+            return _ids[raw]
+
+    parsed = parse_user_agent(raw)
+    user_agent, _ = UserAgent.objects.get_or_create(
+        ua_hash=hash_user_agent(raw),
+        defaults={
+            'raw': raw,
+            'device_type': parsed.device_type,
+            'browser_family': parsed.browser_family,
+            'browser_version': parsed.browser_version,
+        }
+    )
+    # Runs now outside a transaction, and never if the transaction rolls back
+    transaction.on_commit(lambda: _remember(raw, user_agent.id))
+    return user_agent.id
+
+
+def forget_user_agent_ids():
+    """Drop every remembered id"""
+    with _ids_lock:
+        _ids.clear()
+
+
+def on_user_agent_deleted(sender, instance, **kwargs):
+    forget_user_agent_ids()
+
+
+post_delete.connect(on_user_agent_deleted, sender='crow_app.UserAgent', dispatch_uid='user_agent_cache_delete')
@@ -0,0 +1,190 @@
+# crow_app/user_stats.py - DENORMALIZED PER-USER COUNTS FOR THE ADMIN USER PAGES
+#
+# The admin user list, user management page and user detail page read one
+# UserStats row per user instead of counting each user's sessions, meeting
+# sessions, team memberships, contacts and activities. Annotating several
+# of those counts in one query joins several multi-valued relations, which
+# multiplies rows (wrong counts) and is slow.
+#
+# Counts are bumped as rows are written: post_save/post_delete receivers
+# cover single-row writes, the bulk writers (ActivityPipeline,
+# SessionTouchBuffer) call count_user_rows() with what they inserted and
+# touch_last_seen() with the session activity they flushed. Sessions and
+# activities the retention job archives stay counted, as the detail page
+# always added their daily aggregates back in. A failed bump is logged
+# rather than raised; `manage.py reconcile_user_stats` recomputes the rows
+# from the tables. Migration 0012 filled the rows of users who existed
+# before it.
+
+import logging
+from collections import Counter, defaultdict
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Case, Count, DateTimeField, F, Max, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+
+from .models import (
+    ActivityDailyAggregate, ClassMembership, Contact, MeetingSession, SessionDailyAggregate,
+    UserActivity, UserSession, UserStats,
+)
+
+logger = logging.getLogger(__name__)
+
+# Table -> the UserStats field counting its rows (all keyed by `user`)
+COUNTED = {
+    UserSession: 'session_count',
+    MeetingSession: 'meeting_count',
+    ClassMembership: 'team_count',
+    Contact: 'contact_count',
+    UserActivity: 'activity_count',
+}
+
+# Tables whose deletions uncount rows. Sessions and activities are only
+# deleted by the retention job, which keeps them counted in its aggregates
+UNCOUNTED_ON_DELETE = (MeetingSession, ClassMembership, Contact)
+
+# Rows archived by the retention job: (aggregate table, field summed)
+ARCHIVED = {
+    'session_count': (SessionDailyAggregate, 'session_count'),
+    'activity_count': (ActivityDailyAggregate, 'count'),
+}
+
+COUNT_FIELDS = tuple(COUNTED.values())
+
+
+def _ensure(user_ids):
+    UserStats.objects.bulk_create([UserStats(user_id=user_id) for user_id in sorted(user_ids)], ignore_conflicts=True)
+
+
+def count_user_rows(model, rows, sign=1):
+    """
+    Add freshly written rows of `model` to their users' counts (or, with
+    sign=-1, take deleted ones off). Never raises.
+    """
+    field = COUNTED[model]
+    per_user = Counter(row.user_id for row in rows)
+    by_amount = defaultdict(list)
+    for user_id, count in per_user.items():
+        by_amount[count * sign].append(user_id)
+
+    try:
+        with transaction.atomic():
+            if sign > 0:
+                _ensure(per_user)
+            for amount, user_ids in sorted(by_amount.items()):
+                UserStats.objects.filter(user_id__in=user_ids).update(**{field: F(field) + amount})
+    except Exception as e:
+        logger.error(f"Failed to update user stats for {model.__name__}: {e}")
+
+
+def touch_last_seen(seen):
+    """Record {user_id: latest session activity} in one statement. Never raises."""
+    if not seen:
+        return
+    try:
+        with transaction.atomic():
+            _ensure(seen)
+            UserStats.objects.filter(user_id__in=seen).update(last_seen=Case(
+                *[When(user_id=user_id, then=Value(at)) for user_id, at in seen.items()],
+                output_field=DateTimeField(),
+            ))
+    except Exception as e:
+        logger.error(f"Failed to update user last-seen times: {e}")
+
+
+def with_stats(users):
+    """Annotate a User queryset with its UserStats fields (zeros for users without a row yet)"""
+    return users.annotate(
+        **{field: Coalesce(F(f'stats__{field}'), 0) for field in COUNT_FIELDS},
+        last_seen=F('stats__last_seen'),
+    )
+
+
+def compute(user_ids):
+    """{user_id: {field: value}} counted from the tables, one grouped query per table"""
+    values = {user_id: {**dict.fromkeys(COUNT_FIELDS, 0), 'last_seen': None} for user_id in user_ids}
+
+    for model, field in COUNTED.items():
+        counts = model.objects.filter(user_id__in=user_ids).values_list('user_id').annotate(Count('pk')).order_by()
+        for user_id, count in counts:
+            values[user_id][field] += count
+    for field, (model, summed) in ARCHIVED.items():
+        counts = model.objects.filter(user_id__in=user_ids).values_list('user_id').annotate(Sum(summed)).order_by()
+        for user_id, count in counts:
+            values[user_id][field] += count or 0
+
+    last_seen = UserSession.objects.filter(user_id__in=user_ids).values_list('user_id').annotate(Max('last_activity')).order_by()
+    for user_id, at in last_seen:
+        values[user_id]['last_seen'] = at
+    return values
+
+
+def reconcile(user_ids=None, batch_size=1000):
+    """
+    Recompute UserStats from the tables, writing only the rows that
+    drifted; returns (users checked, rows written)
+
+    Rows written while a batch is counted may be missed or counted twice,
+    so prefer quiet hours (or run it again).
+    """
+    users = User.objects.order_by('pk').values_list('pk', flat=True)
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+
+    checked = written = 0
+    last_pk = 0
+    while True:
+        batch = list(users.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1]
+
+        values = compute(batch)
+        stored = {
+            row['user_id']: row
+            for row in UserStats.objects.filter(user_id__in=batch).values('user_id', *COUNT_FIELDS, 'last_seen')
+        }
+        changed = [
+            UserStats(user_id=user_id, **fields)
+            for user_id, fields in values.items()
+            if stored.get(user_id) != {'user_id': user_id, **fields}
+        ]
+        UserStats.objects.bulk_create(
+            changed, update_conflicts=True, unique_fields=['user'],
+            update_fields=[*COUNT_FIELDS, 'last_seen'], batch_size=500,
+        )
+        checked += len(batch)
+        written += len(changed)
+    return checked, written
+
+
+# ─── Signals ─────────────────────────────────────────────────────────────────
+
+def on_row_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        count_user_rows(sender, [instance])
+
+
+def on_row_deleted(sender, instance, **kwargs):
+    count_user_rows(sender, [instance], sign=-1)
+
+
+def on_session_saved(sender, instance, raw=False, **kwargs):
+    """Sessions written directly (write-behind off) carry their user's last activity"""
+    if not raw and instance.last_activity is not None:
+        touch_last_seen({instance.user_id: instance.last_activity})
+
+
+def on_user_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        _ensure([instance.pk])
+
+
+for model in COUNTED:
+    post_save.connect(on_row_created, sender=model, dispatch_uid=f'user_stats_{model._meta.model_name}')
+for model in UNCOUNTED_ON_DELETE:
+    post_delete.connect(on_row_deleted, sender=model, dispatch_uid=f'user_stats_delete_{model._meta.model_name}')
+post_save.connect(on_session_saved, sender=UserSession, dispatch_uid='user_stats_last_seen')
+post_save.connect(on_user_created, sender=User, dispatch_uid='user_stats_user')
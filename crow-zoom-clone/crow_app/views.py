@@ -11,12 +11,18 @@ from django.contrib.auth.models import User
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.db import IntegrityError  # FIX: Added missing import
 from django.db.models import Count, Avg, Sum,Q  # FIX: Added for query filtering
+from django.db.models.functions import TruncDate
 from .models import ClassMembership, Room, Meeting, Contact, UserClass, UserProfile, MeetingRoom
 import json
 import requests
 from django.views.decorators.csrf import csrf_exempt
 from .ai_service import gemini_service
-from .models import UserSession, MeetingSession, UserActivity, OnlineUser
+from .models import UserSession, MeetingSession, UserActivity, OnlineUser, SessionDailyAggregate, WhiteboardSnapshot
+from .activity import record_activity
+from .middleware import track_session
+from .session_buffer import get_session_buffer
+from .presence import get_presence_backend
+from .rooms import room_registry
 
 
 # ===== AI CHATBOT VIEWS =====
@@ -466,7 +472,8 @@ def webrtc_video_room(request, room_id):
     
     return render(request, 'video_room.html', {
         'room': room,
-        'user': request.user
+        'user': request.user,
+        'participants': room_registry.roster(str(room.id)),
     })
 # ===== CLASS MANAGEMENT VIEWS =====
 @login_required
@@ -617,7 +624,11 @@ def session_dashboard(request):
     ).order_by('-timestamp')[:20]
     
     # Statistics
-    total_sessions = UserSession.objects.filter(user=request.user).count()
+    total_sessions = UserSession.objects.filter(user=request.user).count() + (
+        SessionDailyAggregate.objects.filter(user=request.user).aggregate(
+            total=Sum('session_count')
+        )['total'] or 0
+    )  # archived sessions only survive as daily aggregates
     total_meeting_time = MeetingSession.objects.filter(
         user=request.user,
         left_at__isnull=False
@@ -660,13 +671,13 @@ def terminate_session(request, session_id):
 @login_required
 def online_users_api(request):
     """API endpoint to get currently online users"""
-    online_users = OnlineUser.get_online_users()
+    online_users = get_presence_backend().get_online_users()
     
     data = {
-        'count': online_users.count(),
+        'count': len(online_users),
         'users': [
             {
-                'username': user.user.username,
+                'username': user.username,
                 'last_seen': user.last_seen.isoformat(),
                 'is_in_meeting': user.is_in_meeting,
                 'current_page': user.current_page
@@ -689,8 +700,8 @@ def user_analytics(request):
     sessions_by_day = UserSession.objects.filter(
         user=request.user,
         login_time__gte=thirty_days_ago
-    ).extra(
-        select={'day': 'date(login_time)'}
+    ).annotate(
+        day=TruncDate('login_time')
     ).values('day').annotate(
         count=Count('id')
     ).order_by('day')
@@ -762,12 +773,13 @@ def track_meeting_session(user, meeting, action='join'):
                 'current_meeting': meeting
             }
         )
+        get_presence_backend().set_meeting(user.id, user.username, meeting.id)
         
         # Log activity
-        UserActivity.objects.create(
-            user=user,
-            activity_type='meeting_joined',
-            description=f"Joined meeting: {meeting.title}",
+        record_activity(
+            user,
+            'meeting_joined',
+            f"Joined meeting: {meeting.title}",
             meeting=meeting,
             room=meeting.room
         )
@@ -789,12 +801,13 @@ def track_meeting_session(user, meeting, action='join'):
             is_in_meeting=False,
             current_meeting=None
         )
+        get_presence_backend().set_meeting(user.id, user.username, None)
         
         # Log activity
-        UserActivity.objects.create(
-            user=user,
-            activity_type='meeting_left',
-            description=f"Left meeting: {meeting.title}",
+        record_activity(
+            user,
+            'meeting_left',
+            f"Left meeting: {meeting.title}",
             meeting=meeting,
             room=meeting.room
         )
@@ -802,18 +815,19 @@ def track_meeting_session(user, meeting, action='join'):
 
 # Signal handlers for automatic session tracking
 from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models.signals import post_save
 from django.dispatch import receiver
 
 @receiver(user_logged_in)
 def on_user_login(sender, request, user, **kwargs):
     """Track user login"""
-    UserActivity.objects.create(
-        user=user,
-        activity_type='login',
-        description='User logged in',
-        ip_address=get_client_ip(request),
-        user_agent=request.META.get('HTTP_USER_AGENT', '')
-    )
+    
+    # Written now rather than by the write-behind buffer, so the row has
+    # the real login time and a logout before the next flush finds it
+    if request is not None and hasattr(request, 'session') and request.session.session_key:
+        track_session(user, request.session.session_key, request)
+    
+    record_activity(user, 'login', 'User logged in', request=request)
 
 
 @receiver(user_logged_out)
@@ -822,23 +836,36 @@ def on_user_logout(sender, request, user, **kwargs):
     
     # Mark session as inactive
     if hasattr(request, 'session') and request.session.session_key:
-        UserSession.objects.filter(
+        now = timezone.now()
+        closed = UserSession.objects.filter(
             user=user,
             session_key=request.session.session_key,
             is_active=True
         ).update(
             is_active=False,
-            logout_time=timezone.now()
+            logout_time=now
         )
+        if not closed and get_session_buffer() is not None:
+            # A session from before login tracking, so far only held by a
+            # write-behind buffer (maybe another process's): write it closed
+            # now, and the pending touch only moves its last_activity
+            UserSession.objects.get_or_create(
+                user=user,
+                session_key=request.session.session_key,
+                defaults={'ip_address': get_client_ip(request), 'is_active': False, 'logout_time': now},
+            )
     
     # Log activity
-    UserActivity.objects.create(
-        user=user,
-        activity_type='logout',
-        description='User logged out',
-        ip_address=get_client_ip(request),
-        user_agent=request.META.get('HTTP_USER_AGENT', '')
-    )
+    record_activity(user, 'logout', 'User logged out', request=request)
+
+
+@receiver(post_save, sender=MeetingRoom)
+def on_meeting_room_saved(sender, instance, **kwargs):
+    """Drop a room's whiteboard once the room is closed"""
+    if not instance.is_active:
+        room_key = str(instance.id)
+        room_registry.drop_stroke_log(room_key)
+        WhiteboardSnapshot.objects.filter(room_key=room_key).delete()
 
 
 def get_client_ip(request):
@@ -0,0 +1,185 @@
+# crow_app/widget_cache.py - STALE-WHILE-REVALIDATE CACHE FOR DASHBOARD WIDGETS
+#
+# Each admin dashboard section is a widget: a function returning a dict of
+# template context, registered with @widget(name). get_widgets() serves
+# them from the Django cache. A widget is fresh for its TTL; after that
+# its last value is still served for up to STALE_TTL while one refresh
+# recomputes it in the background. Only a missing value is computed in
+# the request, and concurrent requests for it wait for that single
+# computation instead of running their own: a thread lock coalesces
+# within the process, a cache.add() lock across processes sharing the
+# cache.
+#
+# invalidate_widgets() is the hook for admin write actions. It bumps the
+# widgets' generation, which is part of their cache key, so a refresh
+# already running for the old generation cannot bring old data back.
+
+import logging
+import threading
+import time
+
+from django.core.cache import caches
+from django.db import connections
+
+from .conf import setting_reader
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'CACHE': 'default',        # CACHES alias holding the widgets
+    'TTL': {},                 # widget name -> seconds its value is fresh
+    'DEFAULT_TTL': 60,
+    'STALE_TTL': 600,          # seconds past the TTL a value may be served while it refreshes
+    'LOCK_TIMEOUT': 30,        # seconds before a refresh that never finished stops blocking others
+    'BACKGROUND': True,        # False refreshes stale widgets in the request (tests)
+}
+
+
+get_widget_setting = setting_reader('DASHBOARD_CACHE', DEFAULTS)
+
+
+_widgets = {}  # name -> compute function
+_locks = {}    # name -> threading.Lock coalescing computations in this process
+_counters_lock = threading.Lock()
+
+counters = {
+    'hits': 0,
+    'stale_hits': 0,
+    'misses': 0,
+    'coalesced': 0,
+    'refreshes': 0,
+    'refresh_errors': 0,
+    'invalidations': 0,
+    'total_compute_ms': 0.0,
+}
+
+
+def widget(name):
+    """Register a dashboard widget's compute function under `name`"""
+    def register(compute):
+        _widgets[name] = compute
+        _locks[name] = threading.Lock()
+        return compute
+    return register
+
+
+def _count(name, amount=1):
+    with _counters_lock:
+        counters[name] += amount
+
+
+def _cache():
+    return caches[get_widget_setting('CACHE')]
+
+
+def _generation_key(name):
+    return f'crow:widget-generation:{name}'
+
+
+def _value_key(name, generation):
+    return f'crow:widget:{name}:{generation}'
+
+
+def get_widgets(*names):
+    """Context dict merged from the named widgets (all of them when none are named)"""
+    names = names or tuple(_widgets)
+    cache = _cache()
+    generations = cache.get_many([_generation_key(name) for name in names])
+    keys = {name: _value_key(name, generations.get(_generation_key(name), 0)) for name in names}
+    entries = cache.get_many(keys.values())
+
+    context = {}
+    now = time.time()
+    for name in names:
+        entry = entries.get(keys[name])
+        if entry is None:
+            _count('misses')
+            context.update(_compute_once(name, keys[name]))
+            continue
+        if now >= entry['fresh_until']:
+            _count('stale_hits')
+            _start_refresh(name, keys[name])
+        else:
+            _count('hits')
+        context.update(entry['value'])
+    return context
+
+
+def invalidate_widgets(*names):
+    """Drop the cached values of the named widgets (all when none are named)"""
+    cache = _cache()
+    for name in names or tuple(_widgets):
+        key = _generation_key(name)
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+    _count('invalidations')
+
+
+def stats():
+    """Snapshot of the widget cache counters for the metrics endpoint"""
+    with _counters_lock:
+        return dict(counters)
+
+
+def _compute(name, key):
+    """Run a widget and store its value; returns the value"""
+    started = time.perf_counter()
+    value = _widgets[name]()
+    _count('total_compute_ms', (time.perf_counter() - started) * 1000)
+
+    ttl = get_widget_setting('TTL').get(name, get_widget_setting('DEFAULT_TTL'))
+    entry = {'value': value, 'fresh_until': time.time() + ttl}
+    _cache().set(key, entry, timeout=ttl + get_widget_setting('STALE_TTL'))
+    return value
+
+
+def _compute_once(name, key):
+    """Compute a missing widget, or wait for the request already computing it"""
+    cache = _cache()
+    lock_key = f'{key}:lock'
+    with _locks[name]:
+        entry = cache.get(key)
+        if entry is not None:
+            _count('coalesced')
+            return entry['value']
+
+        deadline = time.monotonic() + get_widget_setting('LOCK_TIMEOUT')
+        while not cache.add(lock_key, 1, timeout=get_widget_setting('LOCK_TIMEOUT')):
+            # Another process is computing it
+            entry = cache.get(key)
+            if entry is not None:
+                _count('coalesced')
+                return entry['value']
+            if time.monotonic() >= deadline:
+                return _compute(name, key)
+            time.sleep(0.05)
+
+        try:
+            return _compute(name, key)
+        finally:
+            cache.delete(lock_key)
+
+
+def _start_refresh(name, key):
+    """Recompute a stale widget unless a refresh is already running for it"""
+    lock_key = f'{key}:lock'
+    if not _cache().add(lock_key, 1, timeout=get_widget_setting('LOCK_TIMEOUT')):
+        return
+    if get_widget_setting('BACKGROUND'):
+        threading.Thread(target=_refresh, args=(name, key, lock_key), name=f'widget-refresh-{name}', daemon=True).start()
+    else:
+        _refresh(name, key, lock_key, background=False)
+
+
+def _refresh(name, key, lock_key, background=True):
+    try:
+        _compute(name, key)
+        _count('refreshes')
+    except Exception as e:
+        # Keep serving the stale value; the next request past the TTL retries
+        logger.error(f"Refreshing dashboard widget {name} failed: {e}")
+        _count('refresh_errors')
+    finally:
+        _cache().delete(lock_key)
+        if background:
+            connections.close_all()  # this thread's connections, it is about to exit
@@ -43,6 +43,98 @@ MIDDLEWARE = [
     'crow_app.middleware.ActivityTrackingMiddleware',
 ]
 
+# Session tracking: coalesce per-request session/presence writes in memory
+# and flush them in bulk (see crow_app/session_buffer.py)
+SESSION_TRACKING = {
+    'WRITE_BEHIND': True,
+    'FLUSH_INTERVAL': 5,      # seconds
+    'BATCH_SIZE': 500,        # pending sessions that trigger an early flush
+    'MAX_PENDING': 10000,     # touches for new sessions beyond this are dropped
+    'SKIP_PATHS': ['/api/online-users/'],
+}
+
+# UserActivity ingestion (see crow_app/activity.py). With ASYNC off every
+# activity is written synchronously, which is what tests want
+ACTIVITY_PIPELINE = {
+    'ASYNC': True,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 1.0,     # seconds
+    'MAX_QUEUE': 10000,
+    'POLICY': 'drop_oldest',   # 'block', 'drop_oldest' or 'sample'
+}
+
+# Rollup-then-archive retention for UserActivity/UserSession, run with
+# `python manage.py archive_tracking_data` (see crow_app/retention.py)
+RETENTION = {
+    'ARCHIVE_DIR': BASE_DIR / 'archive',
+    'MAX_AGE_DAYS': 90,
+    'CHUNK_SIZE': 5000,
+}
+
+# Cache for the admin dashboard widgets. Per-process memory is enough for a
+# single worker; with several, point them all at a shared backend so one
+# refresh serves everyone, e.g.
+#     'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#     'LOCATION': 'redis://127.0.0.1:6379',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'crow',
+    },
+}
+
+# Admin dashboard sections are cached per widget (see crow_app/widget_cache.py):
+# fresh for their TTL in seconds, then served stale for up to STALE_TTL while
+# one background refresh recomputes them
+DASHBOARD_CACHE = {
+    'TTL': {
+        'overview': 60,
+        'user_analytics': 300,
+        'team_analytics': 300,
+        'meeting_stats': 120,
+        'activity': 120,
+        'device_browser': 600,
+        'recent_activity': 15,
+        'concurrency': 120,
+    },
+    'STALE_TTL': 600,
+}
+
+# Peak-concurrency engine (see crow_app/concurrency.py). Meeting sessions
+# that never recorded a leave count as open for at most OPEN_SESSION_HOURS;
+# each refresh recomputes the last RECHECK_HOURS of stored hourly peaks
+CONCURRENCY = {
+    'OPEN_SESSION_HOURS': 4,
+    'RECHECK_HOURS': 2,
+}
+
+# Streaming exports of the tracking tables (see crow_app/export.py): rows are
+# fetched CHUNK_SIZE at a time and sent in chunks of about FLUSH_BYTES
+EXPORT = {
+    'CHUNK_SIZE': 2000,
+    'FLUSH_BYTES': 64 * 1024,
+    'GZIP_LEVEL': 6,
+}
+
+# Online presence registry (see crow_app/presence.py), shared like the
+# channel layer by every worker process on this host. A single-process
+# deployment can use 'crow_app.presence.LocalPresenceBackend' instead
+PRESENCE = {
+    'BACKEND': 'crow_app.presence.UnixSocketPresenceBackend',
+    'TIMEOUT': 120,  # seconds since last request before a user is offline
+    'OPTIONS': {'path': '/tmp/crow-presence.sock'},
+}
+
+# WebRTC signaling (see crow_app/rooms.py). Trickled ICE candidates for the
+# same peer are held for up to ICE_BATCH_WINDOW_MS and sent as one frame
+SIGNALING = {
+    'ICE_BATCH_WINDOW_MS': 20,
+    'ICE_BATCH_MAX': 8,
+    'SFU_MIN_PARTICIPANTS': 6,  # switch larger rooms from the P2P mesh to the server forwarder (needs aiortc)
+    'JOIN_BURST': 10,           # newcomers a room admits at once during a join rush
+    'JOIN_RATE_PER_SEC': 5,     # ...and per second after that; the rest are told to `wait`
+}
+
 ROOT_URLCONF = 'crow_project.urls'
 
 TEMPLATES = [
@@ -98,18 +190,18 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 ASGI_APPLICATION = 'crow_project.asgi.application'
 # Channels configuration
-# Configure Channels
+# The Unix-socket layer (crow_app/channel_layers.py) is shared by every
+# daphne process on this host. For several hosts use Redis instead:
+#     'BACKEND': 'channels_redis.core.RedisChannelLayer',
+#     'CONFIG': {"hosts": [('127.0.0.1', 6379)]},
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'BACKEND': 'crow_app.channel_layers.UnixSocketChannelLayer',
         'CONFIG': {
-            "hosts": [('127.0.0.1', 6379)],
+            'path': '/tmp/crow-channels.sock',
+            'capacity': 100,
+            'expiry': 60,
         },
     },
 }
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
-    }
-}
 # REMOVED the duplicate ASGI_APPLICATION line that was at the bottom
\ No newline at end of file
@@ -146,7 +146,7 @@ function drawLine(x1, y1, x2, y2, color, size, tool, broadcast = false) {
     drawCtx.restore();
 
     if (broadcast) {
-        broadcastDraw({ x1, y1, x2, y2, color, size, tool });
+        queueSegment(x1, y1, x2, y2, color, size, tool);
     }
 }
 
@@ -210,6 +210,145 @@ function handleDrawMessage(data) {
     drawLine(x1, y1, x2, y2, color, size, tool, false);
 }
 
+// ─── Stroke Batches (binary) ──────────────────────────────────────────────────
+// Segments drawn during one tick are packed into a single `stroke-batch`
+// frame (format documented in crow_app/strokes.py). Pages that provide
+// sendSignalBytes() use it; otherwise each segment goes out as a JSON
+// `draw` message. The page's WebSocket needs binaryType = 'arraybuffer'.
+const STROKE_BATCH_VERSION = 1;
+const STROKE_COORD_MAX = 4095;
+const STROKE_TICK_MS = 33;
+
+const strokeQueue = { strokes: [], timer: null };
+
+function quantize(value, extent) {
+    return Math.max(0, Math.min(STROKE_COORD_MAX, Math.round(value / extent * STROKE_COORD_MAX)));
+}
+
+function queueSegment(x1, y1, x2, y2, color, size, tool) {
+    if (typeof sendSignalBytes !== 'function') {
+        broadcastDraw({ x1, y1, x2, y2, color, size, tool });
+        return;
+    }
+
+    const start = [quantize(x1, drawCanvas.width), quantize(y1, drawCanvas.height)];
+    const end = [quantize(x2, drawCanvas.width), quantize(y2, drawCanvas.height)];
+    const last = strokeQueue.strokes[strokeQueue.strokes.length - 1];
+    const lastPoint = last && last.points[last.points.length - 1];
+
+    // Continue the current stroke when this segment starts where it ended
+    if (last && last.color === color && last.size === size && last.tool === tool
+            && lastPoint[0] === start[0] && lastPoint[1] === start[1]) {
+        last.points.push(end);
+    } else {
+        strokeQueue.strokes.push({ color, size, tool, points: [start, end] });
+    }
+
+    if (!strokeQueue.timer) {
+        strokeQueue.timer = setTimeout(flushStrokes, STROKE_TICK_MS);
+    }
+}
+
+function flushStrokes() {
+    strokeQueue.timer = null;
+    const strokes = strokeQueue.strokes;
+    strokeQueue.strokes = [];
+    if (strokes.length) {
+        sendSignalBytes(encodeStrokeBatch(strokes));
+    }
+}
+
+function encodeStrokeBatch(strokes) {
+    const palette = [];
+    const paletteIndex = new Map();
+
+    const packed = strokes.map(stroke => {
+        const key = `${stroke.tool}|${stroke.color}|${stroke.size}`;
+        if (!paletteIndex.has(key)) {
+            paletteIndex.set(key, palette.length);
+            palette.push(stroke);
+        }
+
+        // Split steps an int8 delta cannot hold into several shorter ones
+        const points = [stroke.points[0]];
+        for (const [nextX, nextY] of stroke.points.slice(1)) {
+            const [x, y] = points[points.length - 1];
+            const steps = Math.max(1, Math.ceil(Math.max(Math.abs(nextX - x), Math.abs(nextY - y)) / 127));
+            for (let step = 1; step <= steps; step++) {
+                points.push([x + Math.trunc((nextX - x) * step / steps), y + Math.trunc((nextY - y) * step / steps)]);
+            }
+        }
+        return { index: paletteIndex.get(key), points };
+    });
+
+    const size = 4 + palette.length * 5 + packed.reduce((n, s) => n + 7 + (s.points.length - 1) * 2, 0);
+    const view = new DataView(new ArrayBuffer(size));
+    let offset = 0;
+
+    view.setUint8(offset++, STROKE_BATCH_VERSION);
+    view.setUint8(offset++, palette.length);
+    for (const entry of palette) {
+        view.setUint8(offset++, entry.tool === 'eraser' ? 1 : 0);
+        for (let i = 1; i < 7; i += 2) {
+            view.setUint8(offset++, parseInt(entry.color.slice(i, i + 2), 16) || 0);
+        }
+        view.setUint8(offset++, entry.size);
+    }
+
+    view.setUint16(offset, packed.length, true);
+    offset += 2;
+    for (const { index, points } of packed) {
+        view.setUint8(offset, index);
+        view.setUint16(offset + 1, points.length, true);
+        view.setUint16(offset + 3, points[0][0], true);
+        view.setUint16(offset + 5, points[0][1], true);
+        offset += 7;
+        for (let i = 1; i < points.length; i++) {
+            view.setInt8(offset++, points[i][0] - points[i - 1][0]);
+            view.setInt8(offset++, points[i][1] - points[i - 1][1]);
+        }
+    }
+    return view.buffer;
+}
+
+// Call this from the main WS onmessage handler for binary frames
+function handleStrokeBatch(buffer) {
+    const view = new DataView(buffer);
+    if (view.getUint8(0) !== STROKE_BATCH_VERSION) return;
+
+    const palette = [];
+    let offset = 2;
+    for (let i = 0; i < view.getUint8(1); i++, offset += 5) {
+        const rgb = [1, 2, 3].map(k => view.getUint8(offset + k).toString(16).padStart(2, '0'));
+        palette.push({
+            tool: view.getUint8(offset) === 1 ? 'eraser' : 'pen',
+            color: '#' + rgb.join(''),
+            size: view.getUint8(offset + 4),
+        });
+    }
+
+    const scaleX = drawCanvas.width / STROKE_COORD_MAX;
+    const scaleY = drawCanvas.height / STROKE_COORD_MAX;
+    const strokeCount = view.getUint16(offset, true);
+    offset += 2;
+
+    for (let s = 0; s < strokeCount; s++) {
+        const style = palette[view.getUint8(offset)];
+        const pointCount = view.getUint16(offset + 1, true);
+        let x = view.getUint16(offset + 3, true);
+        let y = view.getUint16(offset + 5, true);
+        offset += 7;
+
+        for (let p = 1; p < pointCount; p++, offset += 2) {
+            const nextX = x + view.getInt8(offset);
+            const nextY = y + view.getInt8(offset + 1);
+            drawLine(x * scaleX, y * scaleY, nextX * scaleX, nextY * scaleY, style.color, style.size, style.tool, false);
+            x = nextX;
+            y = nextY;
+        }
+    }
+}
+
 // ─── Toggle Drawing Mode ──────────────────────────────────────────────────────
 async function toggleDrawingMode() {
     drawingState.enabled = !drawingState.enabled;
@@ -0,0 +1,81 @@
+// 📡 signaling.js - Signaling protocol helpers for Crow Video Room
+// Shared by the page's WebSocket code: what the client declares on join and
+// how batched server frames are unpacked before the normal message handler
+
+// ─── Protocol Features ────────────────────────────────────────────────────────
+// Sent with `join`; the server only uses a batched frame type once the
+// client has declared it understands it. These are for a client that runs
+// its own RTCPeerConnections: the room page (video_room.html) carries its
+// media over Agora and only reads the roster, so it declares neither
+const SIGNALING_FEATURES = ['ice-batch', 'sfu'];
+
+// The server-side forwarder, addressed like any other peer in offer /
+// answer / ice-candidate messages once the room is in SFU mode
+const SFU_PEER = 'sfu';
+
+// `media` is the local state shown in the roster, e.g. { audio: true, video: false };
+// the reply is one `room-state` message listing everyone already in the room.
+// A page that only wants the roster (its media going elsewhere) passes no features
+function joinMessage(media = {}, features = SIGNALING_FEATURES) {
+    return { type: 'join', features, media };
+}
+
+// Send whenever the local microphone/camera/screen state changes
+function mediaStateMessage(media) {
+    return { type: 'media-state', media };
+}
+
+// ─── Incoming Frames ──────────────────────────────────────────────────────────
+// Call this from the main WS onmessage handler and handle each returned
+// message as before; batched frames come back as the individual messages
+function expandSignal(message) {
+    if (message.type === 'ice-candidates') {
+        return message.candidates.map(candidate => ({
+            type: 'ice-candidate',
+            candidate,
+            sender: message.sender,
+        }));
+    }
+    return [message];
+}
+
+// ─── SFU Mode ─────────────────────────────────────────────────────────────────
+// `room-state` carries the room's mode and `room-mode` announces a switch.
+// In 'sfu' mode close the mesh connections and open one RTCPeerConnection
+// with SFU_PEER: add the local tracks, send it an offer, then answer every
+// offer it sends back (it renegotiates whenever someone joins or leaves).
+// A room can also switch back to 'mesh' (someone joined it through another
+// server process): close the SFU_PEER connection and offer to every peer
+let roomMode = 'mesh';
+const sfuTrackOwners = {};
+
+// Returns the new mode ('sfu' or 'mesh') when the message switched it, else null
+function updateRoomMode(message) {
+    if ((message.type === 'room-state' || message.type === 'room-mode') && message.mode && message.mode !== roomMode) {
+        roomMode = message.mode;
+        return roomMode;
+    }
+    return null;
+}
+
+// Call with every offer from SFU_PEER before answering it
+function rememberSfuTracks(message) {
+    if (message.sender === SFU_PEER && message.tracks) {
+        Object.assign(sfuTrackOwners, message.tracks);
+    }
+}
+
+// Which participant a remote track belongs to, from the SFU connection's `track` event
+function sfuTrackOwner(event) {
+    return sfuTrackOwners[event.transceiver.mid];
+}
+
+// ─── Admission ────────────────────────────────────────────────────────────────
+// A full room answers with `room-full` (close code 4003), and a room that
+// switched to SFU mode answers `sfu-required` (close code 4009) to a client
+// that did not declare 'sfu'. During a join rush the server answers `wait`
+// instead (close code 4029): reconnect after the returned number of
+// milliseconds. Returns null for any other message
+function admissionRetryDelay(message) {
+    return message.type === 'wait' ? message.retryAfter * 1000 : null;
+}